@@ -0,0 +1,342 @@
+"""
+End-to-end benchmark of the sensor-to-display pipeline.
+
+The sender runs as main.py does: a simulated MAX30102 (in real time, or
+`speed` times faster) is drained by the acquisition.Pipeline reader
+thread, a process stage decimates red and IR, filters them and tracks
+the beats with sub-sample interpolation and SpO2, and a transmit stage
+hands the frames to BluetoothSender, whose writer thread sends them over
+a local socket. A BluetoothReceiver thread decodes them into the
+receiver's store and renders the trace with the blitted plot (Agg
+backend). Every component is the real one, only the sensor and the
+radio are replaced.
+
+Timed per call, on the thread that runs it:
+
+    decode     read_fifo_block(): simulated I2C reads and FIFO decoding
+    decimate   PolyphaseDecimator.process() on red and IR (faster profiles)
+    monitor    StreamingHRMonitor.push(): filtering, beats, metrics, SpO2
+    serialize  BluetoothSender.send_frame(): encoding and queueing
+    parse      read_frames() once data is waiting: recv(), FrameDecoder,
+               duplicate filter, store write
+    render     store snapshot and blitted trace update
+
+Socket writes happen on the sender's writer thread and are part of the
+latency. A frame's latency is measured from the production of its newest
+sample by the simulated sensor (so it includes the wait for the FIFO's
+almost-full interrupt) and from the read of that sample, to the end of
+its rendering. The CPU time of the whole process per second of signal
+gives the number of sensors one core could serve.
+
+Results are printed as JSON, so runs can be compared across changes:
+    python pipeline_benchmark.py --seconds 600 --speed 20 --output results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import select
+import sys
+import threading
+from time import monotonic, perf_counter_ns, process_time, sleep
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "heartrate_sender-master"))
+sys.path.insert(1, os.path.join(HERE, "..", "heartrate_receiver-main"))
+
+import acquisition  # noqa: E402
+import hrdata  # noqa: E402
+import max30102  # noqa: E402
+from bluetooth_receiver import BluetoothReceiver  # noqa: E402
+from bluetooth_sender_test import BluetoothSender  # noqa: E402
+from simulator import SimulatedMAX30102, SyntheticPPG  # noqa: E402
+from store import SignalStore  # noqa: E402
+
+STAGES = ["decode", "decimate", "monitor", "serialize", "parse", "render"]
+
+
+class StageTimer:
+    """Durations of every call of each stage, in nanoseconds."""
+
+    def __init__(self):
+        self.times = {stage: [] for stage in STAGES}
+
+    def add(self, stage, start):
+        """Record a call of `stage` started at perf_counter_ns() `start`; returns now."""
+        now = perf_counter_ns()
+        self.times[stage].append(now - start)
+        return now
+
+    def summary(self):
+        """
+        Returns:
+            dict: Calls, mean, p50 and p99 in microseconds, and share of the
+            total time of every stage that ran.
+        """
+        total = sum(sum(times) for times in self.times.values())
+        result = {}
+        for stage, times in self.times.items():
+            if not times:
+                continue
+            us = np.array(times) / 1000
+            result[stage] = {
+                "calls": len(times),
+                "mean_us": round(float(us.mean()), 2),
+                "p50_us": round(float(np.percentile(us, 50)), 2),
+                "p99_us": round(float(np.percentile(us, 99)), 2),
+                "share": round(float(us.sum() * 1000 / total), 4),
+            }
+        return result
+
+
+class TimedSensor(SimulatedMAX30102):
+    """Simulated sensor timing its FIFO drains and logging when each block was read."""
+
+    def __init__(self, timer, *args, **kwargs):
+        self.timer = timer
+        self.read_at = {}  # Timestamp of a block's last sample -> perf_counter_ns() of its read
+        super().__init__(*args, **kwargs)
+
+    def read_fifo_block(self, event=None):
+        start = perf_counter_ns()
+        block = super().read_fifo_block(event)
+        if event is not None:
+            self.timer.add("decode", start)
+        return block
+
+    def take_unread(self, timed=False):
+        result = super().take_unread(timed)
+        if timed and len(result[1]):
+            self.read_at[float(result[1][-1])] = perf_counter_ns()
+        return result
+
+
+def _make_plot(n_points):
+    """Blitted trace plot on an Agg canvas, None if Matplotlib is missing."""
+    try:
+        import matplotlib
+    except ImportError:
+        return None
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from plotting import BlittedTracePlot
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.set_xlabel("Time")
+    ax.set_ylabel("IR")
+    ax.set_title("Heartbeat")
+    return BlittedTracePlot(ax, n_points)
+
+
+def _percentiles(ms):
+    ms = np.asarray(ms)
+    if not len(ms):
+        return None
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "max": round(float(ms.max()), 3),
+    }
+
+
+def run(seconds=600, speed=20.0, hr=72.0, profile=max30102.DEFAULT_PROFILE, fs=25,
+        window_size=100, hop=12, transport="unix", address="", render=True,
+        trace_samples=250):
+    """
+    Run the pipeline over `seconds` of simulated signal.
+
+    Args:
+        seconds (float): Simulated signal duration.
+        speed (float): Simulated time per wall clock second; the sensor
+            produces `speed` times its sample rate.
+        hr (float): Simulated heart rate.
+        profile (str): Acquisition profile, a key of max30102.PROFILES.
+        fs (float): Processing rate, faster profiles are decimated to it.
+        window_size, hop (int): Metrics window and update interval, as in main.py.
+        transport (str): "unix" or "tcp".
+        address (str): Socket path or host, a temporary one by default.
+        render (bool): Render every received frame.
+        trace_samples (int): Samples in the rendered trace.
+
+    Returns:
+        dict: Configuration, per-stage timings, pipeline counters, latency
+        and throughput.
+    """
+    timer = StageTimer()
+    sensor = TimedSensor(timer, SyntheticPPG(hr=hr), realtime=True, burst=True,
+                         profile=profile, speed=speed)
+    factor = int(sensor.fs // fs) if sensor.fs > fs else 1
+    decimator = hrdata.PolyphaseDecimator(factor) if factor > 1 else None
+    monitor = hrdata.StreamingHRMonitor(sensor.fs / factor, window_size=window_size, hop=hop,
+                                        interpolate=True, spo2=True)
+
+    if transport == "unix" and not address:
+        address = f"/tmp/pipeline_benchmark_{os.getpid()}.sock"
+    elif transport == "tcp" and not address:
+        address = "127.0.0.1"
+    port = 47000 + os.getpid() % 1000 if transport == "tcp" else None
+    store = SignalStore()
+    plot = _make_plot(trace_samples) if render else None
+    sent_at = {}  # Frame sequence number -> (production, read) time of its newest sample
+    latencies = {"produced": [], "read": []}
+    received = [0]
+
+    receiver = BluetoothReceiver(port=port, transport=transport, address=address)
+    sender = BluetoothSender(address, port=port, transport=transport, queue_size=256,
+                             reconnect=False)
+
+    done = threading.Event()
+
+    def receive():
+        receiver.start_server()
+        while not done.is_set():
+            # Only time the reads that do not wait for data
+            sock = receiver.client_sock
+            try:
+                if sock is not None and not select.select([sock], [], [], 0.1)[0]:
+                    continue
+            except (OSError, ValueError):
+                return
+            start = perf_counter_ns()
+            frames = receiver.read_frames()
+            if frames is None:
+                return
+            if not frames:
+                continue
+            for frame in frames:
+                store.write(frame)
+            now = timer.add("parse", start)
+            if plot is not None:
+                plot.update(store.device(frame["device_id"]).snapshot(trace_samples)["samples"])
+                now = timer.add("render", now)
+            for frame in frames:
+                produced, read = sent_at.pop(frame["seq"], (None, None))
+                if produced is not None:
+                    latencies["produced"].append((now - produced) / 1e6)
+                    latencies["read"].append((now - read) / 1e6)
+            received[0] += len(frames)
+
+    # Simulated sensor time -> perf_counter_ns()
+    offset_ns = perf_counter_ns() - monotonic() * 1e9
+
+    def to_perf_ns(t):
+        return sensor.clock.to_monotonic(t) * 1e9 + offset_ns
+
+    def process(item):
+        timestamps, red_ir, lost = item
+        read = sensor.read_at.pop(float(timestamps[-1]), None)
+        start = perf_counter_ns()
+        if decimator:
+            lost = decimator.skip(lost)
+            red_ir, timestamps = decimator.process(red_ir, timestamps)
+            start = timer.add("decimate", start)
+        monitor.set_sample_rate(sensor.rate.fs / factor)
+        result = monitor.push(red_ir, lost)
+        timer.add("monitor", start)
+        if result is None or result[0] is None:
+            return None
+        hr_value, ipm, hrstd, rmssd, window = result
+        return (hr_value, ipm, hrstd, rmssd, monitor.spo2, window.copy(),
+                monitor.total_samples - len(window), timestamps[-1], read)
+
+    def transmit(item):
+        hr_value, ipm, hrstd, rmssd, spo2, window, start_index, newest, read = item
+        sent_at[sender.seq] = (to_perf_ns(newest), read if read is not None else perf_counter_ns())
+        start = perf_counter_ns()
+        sender.send_frame(window, hr_value, ipm, hrstd, rmssd, spo2=spo2,
+                          start_index=start_index,
+                          timestamp=newest - (len(window) - 1) / monitor.fs)
+        timer.add("serialize", start)
+
+    receiver_thread = threading.Thread(target=receive, daemon=True)
+    receiver_thread.start()
+    while receiver.server_sock is None and receiver_thread.is_alive():
+        sleep(0.01)
+    sender.connect()
+
+    pipeline = acquisition.Pipeline(sensor, [("process", process), ("transmit", transmit)])
+    n_samples = int(seconds * sensor.fs)
+    cpu_start = process_time()
+    wall_start = monotonic()
+    pipeline.start()
+    while sensor.sim_bus.produced < n_samples and pipeline.is_alive():
+        sleep(0.05)
+    pipeline.stop()
+    sender.disconnect()
+    deadline = monotonic() + 5
+    while received[0] < sender.sent and monotonic() < deadline:
+        sleep(0.01)
+    wall_s = monotonic() - wall_start
+    cpu_s = process_time() - cpu_start
+    done.set()
+    receiver_thread.join(1)
+    receiver.stop_server()
+    if transport == "unix" and os.path.exists(address):
+        os.unlink(address)
+
+    stats = pipeline.stats()
+    samples = stats["reader"]["samples"]
+    signal_s = samples / sensor.fs
+    cpu_per_signal_s = cpu_s / signal_s if signal_s else 0.0
+    return {
+        "config": {
+            "seconds": seconds, "speed": speed, "profile": profile, "sensor_fs": sensor.fs,
+            "fs": sensor.fs / factor, "window_size": window_size, "hop": hop,
+            "transport": transport, "render": plot is not None,
+        },
+        "platform": {
+            "machine": platform.machine(), "system": platform.platform(),
+            "python": platform.python_version(), "numpy": np.__version__,
+        },
+        "samples": samples,
+        "frames": {"sent": sender.sent, "received": received[0],
+                   "dropped": sender.stats()["dropped"]},
+        "stages": timer.summary(),
+        "pipeline": stats,
+        "latency_ms": {
+            "from_production": _percentiles(latencies["produced"]),
+            "from_read": _percentiles(latencies["read"]),
+        },
+        "throughput": {
+            "wall_seconds": round(wall_s, 3),
+            "samples_per_s": round(samples / wall_s),
+            "cpu_seconds": round(cpu_s, 3),
+            "cpu_per_signal_second": round(cpu_per_signal_s, 6),
+            "max_streams": int(1 / cpu_per_signal_s) if cpu_per_signal_s else None,
+        },
+        "i2c_reads": sensor.sim_bus.reads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sensor-to-display pipeline.")
+    parser.add_argument("--seconds", type=float, default=600, help="Simulated signal duration")
+    parser.add_argument("--speed", type=float, default=20.0,
+                        help="Simulated seconds per wall clock second")
+    parser.add_argument("--hr", type=float, default=72.0, help="Simulated heart rate")
+    parser.add_argument("--profile", choices=list(max30102.PROFILES),
+                        default=max30102.DEFAULT_PROFILE, help="Acquisition profile")
+    parser.add_argument("--window-size", type=int, default=100)
+    parser.add_argument("--hop", type=int, default=12)
+    parser.add_argument("--transport", choices=["unix", "tcp"], default="unix")
+    parser.add_argument("--no-render", action="store_true", help="Skip the render stage")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    # Keep the driver and socket messages out of the JSON output
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.seconds, args.speed, args.hr, args.profile,
+                  window_size=args.window_size, hop=args.hop, transport=args.transport,
+                      render=not args.no_render)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+CPU cost and beat timing precision of the acquisition profiles.
+
+Every profile of max30102.PROFILES is run on a simulated MAX30102
+(virtual clock) whose synthetic PPG has a constant heart rate and no
+breathing, so every true inter-beat interval is the same and any spread
+of the measured ones is measurement error. For each profile and processing rate the host
+decimates the IR samples (hrdata.PolyphaseDecimator) and tracks the
+beats, with and without sub-sample peak interpolation. Reported per
+configuration:
+
+    driver_cpu   share of one core spent in read_block() (I2C transfers
+                 and FIFO decoding; here mostly the simulated bus)
+    host_cpu     share of one core spent decimating and tracking beats
+    ibi_sd_ms    standard deviation of the inter-beat intervals
+    rmssd_ms     RMSSD of the intervals, the floor of the HRV measurement
+    bpm_error    mean heart rate error
+
+Run it on the Pi to see the headroom each profile leaves:
+    python profile_benchmark.py --seconds 120 --output profiles.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+from time import process_time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "heartrate_sender-master"))
+
+import hrdata  # noqa: E402
+import max30102  # noqa: E402
+from simulator import SimulatedMAX30102, SyntheticPPG  # noqa: E402
+
+PROCESSING_RATES = (25, 50, 100)
+WARMUP_S = 10  # Beats of the filter's settling time are ignored
+
+
+def run_profile(name, processing_fs, interpolate, seconds=120, hr=67.0, noise=20.0):
+    """
+    Run one configuration.
+
+    Args:
+        name (str): Key of max30102.PROFILES.
+        processing_fs (float): Rate the samples are decimated to before beat tracking.
+        interpolate (bool): Locate the beats between samples.
+        seconds (float): Simulated signal duration.
+        hr (float): Simulated heart rate, constant.
+        noise (float): Standard deviation of the ADC noise in counts.
+
+    Returns:
+        dict: Configuration, CPU shares and beat interval statistics.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        sensor = SimulatedMAX30102(SyntheticPPG(hr=hr, hrv=0.0, noise=noise, respiration=0.0),
+                                   realtime=False, burst=True, profile=name)
+    factor = int(round(sensor.fs / processing_fs))
+    decimator = hrdata.PolyphaseDecimator(factor) if factor > 1 else None
+    window_size = int(4 * processing_fs)
+    monitor = hrdata.StreamingHRMonitor(processing_fs, window_size=window_size,
+                                        hop=window_size // 8, interpolate=interpolate)
+
+    beats = []
+    driver_s = host_s = 0.0
+    while sensor.sim_bus.produced < seconds * sensor.fs:
+        start = process_time()
+        red_ir = sensor.read_block()
+        read = process_time()
+        ir = decimator.process(red_ir[1]) if decimator else red_ir[1]
+        monitor.push(ir)
+        host_s += process_time() - read
+        driver_s += read - start
+
+        tracker_beats = monitor.tracker.beats
+        if tracker_beats and (not beats or tracker_beats[-1] != beats[-1]):
+            beats.append(tracker_beats[-1])
+
+    beat_times = np.array(beats) / processing_fs
+    ibi = np.diff(beat_times[beat_times > WARMUP_S]) * 1000
+    return {
+        "profile": name,
+        "sample_rate": sensor.profile.sample_rate,
+        "averaging": sensor.profile.averaging,
+        "fifo_fs": sensor.fs,
+        "processing_fs": processing_fs,
+        "interpolate": interpolate,
+        "driver_cpu": round(driver_s / seconds, 5),
+        "host_cpu": round(host_s / seconds, 5),
+        "i2c_reads_per_s": round(sensor.sim_bus.reads / seconds, 1),
+        "beats": len(ibi) + 1,
+        "ibi_sd_ms": round(float(np.std(ibi)), 3),
+        "rmssd_ms": round(float(hrdata.calculate_rmssd(ibi)), 3),
+        "bpm_error": round(float(60000 / np.mean(ibi) - hr), 3),
+    }
+
+
+def run(seconds=120, hr=67.0, noise=20.0, profiles=None):
+    """
+    Run every profile at every processing rate it can be decimated to.
+
+    Returns:
+        dict: Platform and the results of every configuration.
+    """
+    results = []
+    for name in profiles or max30102.PROFILES:
+        fs = max30102.PROFILES[name].fs
+        for processing_fs in PROCESSING_RATES:
+            if processing_fs > fs or fs % processing_fs:
+                continue
+            for interpolate in (False, True):
+                result = run_profile(name, processing_fs, interpolate, seconds, hr, noise)
+                print(f"{name:>11} -> {processing_fs:>3} Hz interpolate={interpolate!s:5} "
+                      f"cpu {100 * (result['driver_cpu'] + result['host_cpu']):6.2f}% "
+                      f"ibi sd {result['ibi_sd_ms']:6.2f} ms rmssd {result['rmssd_ms']:6.2f} ms",
+                      file=sys.stderr)
+                results.append(result)
+    return {
+        "config": {"seconds": seconds, "hr": hr, "noise": noise},
+        "platform": {
+            "machine": platform.machine(), "system": platform.platform(),
+            "python": platform.python_version(), "numpy": np.__version__,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition profiles.")
+    parser.add_argument("--seconds", type=float, default=120, help="Simulated signal duration")
+    parser.add_argument("--hr", type=float, default=67.0, help="Simulated heart rate")
+    parser.add_argument("--noise", type=float, default=20.0, help="ADC noise in counts")
+    parser.add_argument("--profile", action="append", choices=list(max30102.PROFILES),
+                        help="Profile to run, repeatable (default: all)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.hr, args.noise, args.profile)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Asyncio receiver serving many senders at once.
+
+Each connection is handled by its own task. Frames are demultiplexed by
+device id into per-device streams, so one hub can aggregate every sensor
+node in a room regardless of which connection a frame arrived on.
+
+Example:
+    async def main():
+        receiver = AsyncReceiver(transport="tcp")
+        await receiver.start()
+        async for stream in receiver.devices():
+            asyncio.create_task(show(stream))
+
+    async def show(stream):
+        async for frame in stream:
+            print(stream.device_id, frame["bpm"])
+"""
+import asyncio
+import os
+import socket
+import threading
+
+import protocol
+from transport import Transport, make_transport
+
+
+def _as_socket(sock):
+    """
+    Return a standard library socket for a transport socket, so the event
+    loop can use it. pybluez sockets are wrapped around a duplicate of
+    their file descriptor.
+    """
+    if isinstance(sock, socket.socket):
+        return sock
+    wrapped = socket.socket(fileno=os.dup(sock.fileno()))
+    sock.close()
+    return wrapped
+
+
+class DeviceStream:
+    """
+    Frames of one device, as an async iterator.
+
+    The queue is bounded: if the consumer falls behind, the oldest frames
+    are dropped so a slow display never stalls the network.
+    """
+
+    def __init__(self, device_id, queue_size=256):
+        """
+        Args:
+            device_id (int): Id of the sending device.
+            queue_size (int): Maximum number of frames waiting to be read.
+        """
+        self.device_id = device_id
+        self.queue = asyncio.Queue(queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.last_frame = None
+
+    def put(self, frame):
+        """Add a frame, dropping the oldest one if the queue is full."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+        self.received += 1
+        self.last_frame = frame
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.queue.get()
+        if frame is None:
+            raise StopAsyncIteration  # The receiver was stopped
+        return frame
+
+
+class AsyncReceiver:
+    """Receiver accepting any number of concurrent sender connections."""
+
+    def __init__(self, port=None, transport="rfcomm", address="", backlog=8,
+                 queue_size=256, on_frame=None):
+        """
+        Initialize the AsyncReceiver object.
+
+        Args:
+            port (int): RFCOMM channel or TCP port to listen on.
+            transport (str or Transport): "rfcomm", "tcp" or "unix".
+            address (str): Interface to listen on for TCP, socket path for Unix sockets.
+            backlog (int): Number of pending connections to queue.
+            queue_size (int): Maximum number of unread frames per device.
+            on_frame (callable): Called with every new frame, from the event loop.
+                Must be quick; e.g. copy the frame into a store.
+        """
+        if not isinstance(transport, Transport):
+            transport = make_transport(transport, address, port)
+        self.transport = transport
+        self.backlog = backlog
+        self.queue_size = queue_size
+        self.on_frame = on_frame
+
+        self.streams = {}  # Device id -> DeviceStream
+        self.sequence_filter = protocol.SequenceFilter()
+        self.connections = 0  # Currently open connections
+        self.corrupt = 0  # Connections dropped because of corrupt data
+        self.callback_errors = 0  # Frames on_frame raised an exception for
+
+        self._server_sock = None
+        self._new_devices = None
+        self._tasks = set()
+        self._loop = None
+
+    async def start(self):
+        """Start listening and accepting connections in the background."""
+        self._loop = asyncio.get_running_loop()
+        self._new_devices = asyncio.Queue()
+        self.transport.enable()
+
+        self._server_sock = _as_socket(self.transport.listen(self.backlog))
+        self._server_sock.setblocking(False)
+        print(f"Listening for connections on {self.transport}")
+        self._spawn(self._accept_loop())
+
+    def stop(self):
+        """
+        Close every connection and end the device iterators.
+        Must be called from the receiver's event loop.
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        if self._server_sock:
+            self._server_sock.close()
+            self._server_sock = None
+        for stream in self.streams.values():
+            if stream.queue.full():
+                stream.queue.get_nowait()
+            stream.queue.put_nowait(None)
+        if self._new_devices is not None:
+            self._new_devices.put_nowait(None)
+        self.transport.disable()
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def stream(self, device_id):
+        """
+        Get the stream of a device, creating it if no frame was received yet.
+
+        Args:
+            device_id (int): Id of the sending device.
+
+        Returns:
+            DeviceStream: The device's frames.
+        """
+        stream = self.streams.get(device_id)
+        if stream is None:
+            stream = self.streams[device_id] = DeviceStream(device_id, self.queue_size)
+            self._new_devices.put_nowait(stream)
+        return stream
+
+    async def devices(self):
+        """
+        Async iterator over the device streams, yielding each one when its
+        first frame arrives (or when stream() is first called for it).
+        """
+        while True:
+            stream = await self._new_devices.get()
+            if stream is None:
+                return
+            yield stream
+
+    async def _accept_loop(self):
+        while self._server_sock is not None:
+            try:
+                client_sock, client_info = await self._loop.sock_accept(self._server_sock)
+                client_sock = _as_socket(client_sock)
+            except OSError as e:
+                if self._server_sock is None:
+                    break  # Stopped
+                # E.g. out of file descriptors, keep serving the open connections
+                print(f"Failed to accept a new connection: {e}", flush=True)
+                await asyncio.sleep(0.1)
+                continue
+            print(f"Accepted connection from {client_info}", flush=True)
+            self._spawn(self._handle_client(client_sock, client_info))
+
+    def _dispatch(self, frames):
+        """Pass the new frames on to their device's stream and to on_frame."""
+        for frame in frames:
+            if self.sequence_filter.accept(frame):
+                self.stream(frame["device_id"]).put(frame)
+                if self.on_frame:
+                    try:
+                        self.on_frame(frame)
+                    except Exception as e:
+                        # A bad frame must not close the sender's connection
+                        self.callback_errors += 1
+                        print(f"on_frame failed for device {frame['device_id']}, "
+                              f"seq {frame['seq']}: {e!r}", flush=True)
+
+    async def _handle_client(self, client_sock, client_info):
+        """Read and dispatch the frames of one connection until it closes."""
+        decoder = protocol.FrameDecoder()
+        client_sock.setblocking(False)
+        self.connections += 1
+        try:
+            while True:
+                data = await self._loop.sock_recv(client_sock, 4096)
+                if not data:
+                    break
+                self._dispatch(decoder.feed(data))
+        except protocol.ProtocolError as e:
+            # Keep the frames decoded before the corrupt one; the sender
+            # reconnects and replays what was lost
+            self._dispatch(e.frames)
+            print(f"Dropped connection from {client_info} with corrupt data: {e}")
+            self.corrupt += 1
+        except OSError as e:
+            print(f"An error occurred while reading from {client_info}: {e}")
+        finally:
+            self.connections -= 1
+            client_sock.close()
+            print(f"Connection from {client_info} closed", flush=True)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Open connections, duplicates dropped and frames received
+            and dropped per device.
+        """
+        return {
+            "connections": self.connections,
+            "corrupt": self.corrupt,
+            "callback_errors": self.callback_errors,
+            "duplicates": self.sequence_filter.duplicates,
+            "devices": {device_id: {"received": s.received, "dropped": s.dropped}
+                        for device_id, s in self.streams.items()},
+        }
+
+    def run_in_thread(self):
+        """
+        Run the receiver on its own event loop in a daemon thread, e.g.
+        next to a Tk main loop. Frames are then consumed through on_frame.
+
+        Returns:
+            threading.Thread: The started thread.
+
+        Raises:
+            Exception: The error of start(), e.g. an address already in use.
+            TimeoutError: If the receiver did not start within 10 s.
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as e:
+                errors.append(e)
+                loop.close()
+                return
+            finally:
+                started.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        if not started.wait(timeout=10):
+            raise TimeoutError("The receiver did not start within 10 s")
+        if errors:
+            raise errors[0]
+        return thread
+
+
+# Example usage
+if __name__ == "__main__":
+    async def print_stream(stream):
+        async for frame in stream:
+            print(f"Device {stream.device_id}: seq {frame['seq']}, BPM {frame['bpm']:.1f}")
+
+    async def main():
+        receiver = AsyncReceiver(transport="tcp")
+        await receiver.start()
+        try:
+            async for stream in receiver.devices():
+                asyncio.ensure_future(print_stream(stream))
+        finally:
+            receiver.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Shutting down server...")
@@ -1,60 +1,76 @@
-import bluetooth
-import subprocess
 import atexit
 
+import protocol
+from transport import Transport, make_transport
+
 
 class BluetoothReceiver:
 
-    def __init__(self, port=1):
+    def __init__(self, port=None, transport="rfcomm", address=""):
         """
         Initialize the BluetoothReceiver object.
 
         Args:
-            port (int): RFCOMM port to listen on. Default is 1.
+            port (int): RFCOMM channel or TCP port to listen on. Default is 1 for RFCOMM.
+            transport (str or Transport): "rfcomm", "tcp" or "unix".
+            address (str): Interface to listen on for TCP, socket path for Unix sockets.
         """
+        if not isinstance(transport, Transport):
+            transport = make_transport(transport, address, port)
+        self.transport = transport
         self.port = port
         self.server_sock = None
         self.client_sock = None
         self.client_info = None
+        self.decoder = protocol.FrameDecoder()
+        # Drops frames replayed by the sender after a reconnect that were already received
+        self.sequence_filter = protocol.SequenceFilter()
+
+        # Bring the device down again at script exit
+        atexit.register(self.transport.disable)
 
     def enable_bluetooth(self):
-        """Enable the Bluetooth device."""
-        try:
-            subprocess.run(["sudo", "hciconfig", "hci0", "up"], check=True)
-            print("Bluetooth device hci0 is now up.")
-        except subprocess.CalledProcessError:
-            print("Failed to turn on Bluetooth device hci0.")
+        """Enable the Bluetooth device (no-op for TCP and Unix sockets)."""
+        self.transport.enable()
 
     def disable_bluetooth(self):
-        """Disable the Bluetooth device."""
-        try:
-            subprocess.run(["sudo", "hciconfig", "hci0", "down"], check=True)
-            print("Bluetooth device hci0 is now down.")
-        except subprocess.CalledProcessError:
-            print("Failed to turn off Bluetooth device hci0.")
+        """Disable the Bluetooth device (no-op for TCP and Unix sockets)."""
+        self.transport.disable()
 
     def start_server(self):
-        """Start the Bluetooth server and listen for a client connection."""
+        """Start the server and listen for a client connection."""
         self.enable_bluetooth()
 
-        # Retrieve the MAC address of the Bluetooth adapter on the server
-        server_mac_address = bluetooth.read_local_bdaddr()[0]
-        print(f"Server MAC Address: {server_mac_address}")
-
-        # Create and bind the server socket
-        self.server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
         try:
-            self.server_sock.bind(("", self.port))
-            self.server_sock.listen(1)
-            print(f"Listening for connections on RFCOMM channel {self.port}")
-
-            # Accept a client connection
-            self.client_sock, self.client_info = self.server_sock.accept()
-            print(f"Accepted connection from {self.client_info}")
-        except bluetooth.BluetoothError as e:
+            # Create and bind the server socket
+            self.server_sock = self.transport.listen(1)
+            print(f"Listening for connections on {self.transport}")
+
+            self.accept_client()
+        except OSError as e:
             print(f"Failed to start server: {e}")
             self.cleanup()
 
+    def accept_client(self):
+        """Wait for a client to connect, e.g. a sender reconnecting after a link drop."""
+        self.client_sock, self.client_info = self.server_sock.accept()
+        # A partial frame of the previous connection will never be completed
+        self.decoder = protocol.FrameDecoder()
+        print(f"Accepted connection from {self.client_info}")
+
+    def _reconnect(self):
+        """Close the lost client and wait for it to connect again."""
+        try:
+            self.client_sock.close()
+        except Exception:
+            pass
+        self.client_sock = None
+        print("Client disconnected, waiting for it to reconnect...", flush=True)
+        try:
+            self.accept_client()
+        except OSError as e:
+            print(f"Failed to accept a new connection: {e}")
+
     def read_data(self):
         """
         Read data sent by the client.
@@ -72,6 +88,43 @@ class BluetoothReceiver:
             print("No client connected. Unable to read data.")
         return None
 
+    def read_frames(self):
+        """
+        Read data sent by the client and decode it into frames.
+        A frame split over several reads is returned once it is complete,
+        and frames already received before a reconnect are dropped.
+
+        If the client disconnects, waits for it to connect again. Corrupt
+        data closes the connection the same way: the stream cannot be
+        resynchronized, and the sender replays the lost frames once it
+        has reconnected.
+
+        Returns:
+            list: The completed frames as dicts (possibly empty),
+            or None if the connection failed and no client reconnected.
+        """
+        if self.client_sock:
+            try:
+                data = self.client_sock.recv(4096)
+                if data:
+                    return [frame for frame in self.decoder.feed(data)
+                            if self.sequence_filter.accept(frame)]
+            except protocol.ProtocolError as e:
+                print(f"Dropped corrupt data: {e}")
+                # Keep the frames decoded before the corrupt one
+                frames = [frame for frame in e.frames if self.sequence_filter.accept(frame)]
+                self._reconnect()
+                return frames if self.client_sock or frames else None
+            except OSError as e:
+                print(f"An error occurred while reading data: {e}")
+
+            # The connection is closed or failed
+            self._reconnect()
+            return [] if self.client_sock else None
+        else:
+            print("No client connected. Unable to read data.")
+        return None
+
     def stop_server(self):
         """Stop the Bluetooth server and clean up resources."""
         if self.client_sock:
@@ -95,9 +148,6 @@ class BluetoothReceiver:
         self.stop_server()
 
 
-# Register the disable_bluetooth function to run at script exit
-atexit.register(BluetoothReceiver.disable_bluetooth, BluetoothReceiver)
-
 # # Example usage
 # if __name__ == "__main__":
 #     receiver = BluetoothReceiver()
@@ -0,0 +1,295 @@
+"""
+Dashboard showing every connected sensor on one screen.
+
+A panel (trace and metrics) is added for each device as its first frame
+arrives. All panels share one canvas and one render loop; each refresh
+only blits the panels whose device sent a new frame, so the cost follows
+what changed rather than the number of devices.
+
+Usage:
+    python dashboard.py              # Serve senders and show the dashboard
+    python dashboard.py --benchmark  # Headless frame time for 8 simulated feeds
+"""
+import argparse
+import math
+
+import numpy as np
+
+from plotting import BlittedTracePlot, FrameTimer
+from store import SignalStore
+
+# Transport to listen on: "rfcomm", "tcp" or "unix"
+TRANSPORT = "rfcomm"
+
+# Number of samples in each trace (10 s at 25 Hz)
+TRACE_SAMPLES = 250
+# GUI refresh rate in frames per second
+REFRESH_FPS = 30
+# Directory where the raw samples of hub-mode senders are recorded, None to disable
+HUB_RECORD_DIR = "hub_logs"
+
+COLORS = ["tab:red", "tab:blue", "tab:green", "tab:orange",
+          "tab:purple", "tab:brown", "tab:pink", "tab:olive"]
+
+
+def format_metric(label, value, precision=1):
+    """Format a metric for a panel, "--" when it is not available."""
+    if value != value or value < 0:  # NaN or negative
+        return f"{label} --"
+    return f"{label} {value:.{precision}f}"
+
+
+class SensorPanel:
+    """Trace and metrics of one device."""
+
+    def __init__(self, ax, device_id, n_points, color):
+        """
+        Args:
+            ax (matplotlib.axes.Axes): Axes of the panel.
+            device_id (int): Id of the device shown.
+            n_points (int): Number of samples in the trace.
+            color (str): Color of the trace.
+        """
+        self.device_id = device_id
+        self.shown_frames = 0  # Frame count of the device at the last update
+
+        ax.set_title(f"Device {device_id}", fontsize=10)
+        ax.tick_params(labelsize=8)
+        self.plot = BlittedTracePlot(ax, n_points, color=color)
+        self.text = ax.text(0.01, 0.97, "", transform=ax.transAxes, va="top",
+                            fontsize=9, family="monospace", animated=True)
+        self.plot.artists.append(self.text)
+
+    def set_snapshot(self, snapshot):
+        """
+        Set the trace and metrics without drawing them.
+
+        Args:
+            snapshot (dict): Snapshot of the device's store.
+
+        Returns:
+            bool: True if the canvas needs a full redraw.
+        """
+        self.text.set_text("  ".join([
+            format_metric("BPM", snapshot["bpm"]),
+            format_metric("IPM", snapshot["ipm"]),
+            format_metric("HRSTD", snapshot["hrstd"], 2),
+            format_metric("RMSSD", snapshot["rmssd"], 2),
+            format_metric("SpO2", snapshot["spo2"]),
+        ]))
+        return self.plot.set_data(snapshot["samples"])
+
+
+class Dashboard:
+    """Grid of SensorPanels following the devices of a SignalStore."""
+
+    def __init__(self, fig, store, n_points=TRACE_SAMPLES):
+        """
+        Initialize the Dashboard object.
+
+        Args:
+            fig (matplotlib.figure.Figure): Figure to draw in.
+            store (SignalStore): Store written by the receiver.
+            n_points (int): Number of samples in each trace.
+        """
+        self.fig = fig
+        self.store = store
+        self.n_points = n_points
+        self.panels = []
+        self.timer = FrameTimer()
+        self.layouts = 0
+        self.full_redraws = 0
+
+    def _layout(self, device_ids):
+        """Create a panel for each device in a grid about as wide as it is high."""
+        for panel in self.panels:
+            panel.plot.remove()
+        self.fig.clear()
+
+        n = len(device_ids)
+        cols = math.ceil(math.sqrt(n))
+        rows = math.ceil(n / cols)
+        self.panels = []
+        for i, device_id in enumerate(device_ids):
+            ax = self.fig.add_subplot(rows, cols, i + 1)
+            self.panels.append(SensorPanel(ax, device_id, self.n_points,
+                                           COLORS[i % len(COLORS)]))
+        self.fig.tight_layout()
+        self.layouts += 1
+
+    def refresh(self):
+        """
+        Add panels for new devices and update the panels with new frames.
+
+        Returns:
+            int: Number of panels updated.
+        """
+        self.timer.start()
+        devices = {device.device_id: device for device in self.store.device_list()}
+        device_ids = sorted(devices)
+        redraw = len(device_ids) != len(self.panels)
+        if redraw:
+            self._layout(device_ids)
+
+        updated = []
+        for panel in self.panels:
+            device = devices[panel.device_id]
+            if device.frames != panel.shown_frames:
+                panel.shown_frames = device.frames
+                redraw |= panel.set_snapshot(device.snapshot(self.n_points))
+                updated.append(panel)
+
+        if redraw:
+            # One full redraw for all panels whose axes changed; it caches
+            # every panel's background again
+            self.full_redraws += 1
+            self.fig.canvas.draw()
+        else:
+            for panel in updated:
+                panel.plot.blit()
+        self.timer.stop()
+        return len(updated)
+
+
+def _simulated_frames(n_devices, n_frames, fs=25, window_size=100, hop=12, seed=0):
+    """Frames of `n_devices` senders, interleaved as a hub would receive them."""
+    import protocol
+
+    rng = np.random.default_rng(seed)
+    length = window_size + hop * n_frames
+    t = np.arange(length) / fs
+    signals = [np.sin(2 * np.pi * rng.uniform(1.0, 1.6) * t) * 50 + rng.normal(0, 3, length)
+               for _ in range(n_devices)]
+    for k in range(n_frames):
+        end = window_size + k * hop
+        for device_id, signal in enumerate(signals):
+            body = protocol.encode_frame(signal[end - window_size:end], 72.0, 70.0, 0.05, 0.04,
+                                         97.0, seq=k, start_index=end - window_size,
+                                         timestamp=end / fs, device_id=device_id)
+            yield protocol.decode_frame(body[protocol.LENGTH.size:])
+
+
+def benchmark(n_devices=8, seconds=10, fs=25, hop=12):
+    """
+    Measure the dashboard's frame time for simulated feeds, headless with
+    Agg. Frames arrive at each sender's real rate (every `hop` samples)
+    while the dashboard refreshes at REFRESH_FPS; the same feeds are then
+    shown by redrawing every panel from scratch whenever a frame arrived.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    n_frames = int(seconds * fs / hop)
+    frames = list(_simulated_frames(n_devices, n_frames, fs=fs, hop=hop))
+    # Arrival time of each frame, the senders are not in phase
+    phase = np.random.default_rng(1).uniform(0, hop / fs, n_devices)
+    arrival = np.array([k * hop / fs + phase[frame["device_id"]]
+                        for k in range(n_frames) for frame in frames[:n_devices]])
+    order = np.argsort(arrival, kind="stable")
+    refresh_times = np.arange(0, seconds, 1 / REFRESH_FPS)
+    # Number of frames received before each refresh
+    received = np.searchsorted(arrival[order], refresh_times, side="right")
+
+    def run(refresh):
+        store = SignalStore()
+        written = 0
+        for count in received:
+            for i in order[written:count]:
+                store.write(frames[i])
+            if store.device_list():
+                refresh(store, count > written)
+            written = count
+
+    # Blitted dashboard
+    fig = plt.figure(figsize=(16, 9))
+    dashboard = None
+
+    def refresh_dashboard(store, new_frames):
+        nonlocal dashboard
+        if dashboard is None:
+            dashboard = Dashboard(fig, store)
+        dashboard.refresh()
+
+    run(refresh_dashboard)
+    stats = dashboard.timer.stats()
+    print(f"Dashboard, {n_devices} feeds at {REFRESH_FPS} fps: {stats}, "
+          f"layouts: {dashboard.layouts}, full redraws: {dashboard.full_redraws}")
+    plt.close(fig)
+
+    # Every panel cleared and redrawn when a frame arrived
+    cols = math.ceil(math.sqrt(n_devices))
+    fig, axes = plt.subplots(math.ceil(n_devices / cols), cols, figsize=(16, 9), squeeze=False)
+    timer = FrameTimer()
+
+    def refresh_full(store, new_frames):
+        if not new_frames:
+            return
+        timer.start()
+        devices = sorted(store.device_list(), key=lambda device: device.device_id)
+        for ax, device in zip(axes.flat, devices):
+            snapshot = device.snapshot(TRACE_SAMPLES)
+            ax.clear()
+            ax.plot(snapshot["samples"], color='r')
+            ax.set_title(f"Device {device.device_id}")
+        fig.canvas.draw()
+        timer.stop()
+
+    run(refresh_full)
+    print(f"Full redraw, {n_devices} feeds: {timer.stats()}")
+    plt.close(fig)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heart rate dashboard for many sensors.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Measure the frame time with simulated feeds and exit")
+    parser.add_argument("--feeds", type=int, default=8, help="Simulated feeds of the benchmark")
+    parser.add_argument("--hub", action="store_true",
+                        help="Compute the metrics of senders streaming raw samples (needs SciPy)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.feeds)
+        return
+
+    import tkinter as tk
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from async_receiver import AsyncReceiver
+
+    store = SignalStore()
+    hub = None
+    if args.hub:
+        from hub import Hub
+
+        # Senders in hub mode stream raw samples, their metrics are computed here
+        hub = Hub(on_frame=store.write, record_dir=HUB_RECORD_DIR)
+    receiver = AsyncReceiver(transport=TRANSPORT, on_frame=hub.write if hub else store.write)
+    receiver.run_in_thread()
+
+    root = tk.Tk()
+    root.title("Heart Rate Dashboard")
+    fig = plt.figure(figsize=(16, 9))
+    canvas = FigureCanvasTkAgg(fig, master=root)
+    canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    dashboard = Dashboard(fig, store)
+
+    def update():
+        dashboard.refresh()
+        root.after(1000 // REFRESH_FPS, update)
+
+    root.after(1000 // REFRESH_FPS, update)
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        print("Shutting down server...")
+    print(f"Receiver stats: {receiver.stats()}")
+    if hub:
+        hub.close()
+        print(f"Hub stats: {hub.stats()}")
+
+
+if __name__ == "__main__":
+    main()
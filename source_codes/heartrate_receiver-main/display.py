@@ -3,8 +3,20 @@ from tkinter import ttk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from bluetooth_receiver import BluetoothReceiver
+from store import SignalStore
+from plotting import BlittedTracePlot
 import threading
-import json
+
+# Transport to listen on: "rfcomm", "tcp" or "unix"
+TRANSPORT = "rfcomm"
+
+# Number of samples in the trace (10 s at 25 Hz)
+TRACE_SAMPLES = 250
+
+# Update only the trace with blitting instead of redrawing the whole figure
+BLIT = True
+# GUI refresh rate in frames per second (at most 30)
+REFRESH_FPS = 30 if BLIT else 1
 
 
 def update_plot(raw_data):
@@ -18,19 +30,33 @@ def update_plot(raw_data):
     canvas.draw()  # Redraw canvas to update the plot
 
 
-data = None
+# Compute the metrics of senders streaming raw samples (hub mode, needs SciPy)
+HUB_MODE = False
+# Directory where the raw samples of hub-mode senders are recorded, None to disable
+HUB_RECORD_DIR = "hub_logs"
+
+# History of every received frame, written by the receiver thread
+store = SignalStore()
+hub = None
+if HUB_MODE:
+    from hub import Hub
+
+    # Computes the metrics of senders streaming raw samples, passes the others through
+    hub = Hub(on_frame=store.write, record_dir=HUB_RECORD_DIR)
+write_frame = hub.write if hub else store.write
+shown_frames = 0  # Frame count of the device when the GUI was last updated
 
 
 def data_receiver_thread(receiver):
     """
     Thread function for receiving data from the Bluetooth device.
     """
-    global data
-
     while receiver:
-        json_str = receiver.read_data()
-        if json_str:
-            data = json.loads(json_str)
+        frames = receiver.read_frames()
+        if frames is None:
+            break  # The server failed
+        for frame in frames:
+            write_frame(frame)
 
 
 def format_value(label, value, precision=2, invalid_placeholder="--"):
@@ -46,7 +72,7 @@ def format_value(label, value, precision=2, invalid_placeholder="--"):
     Returns:
         str: Formatted label string.
     """
-    if value < 0:
+    if value != value or value < 0:  # NaN or negative
         return f"{label}: {invalid_placeholder}"
     if isinstance(value, (float, int)):
         return f"{label}: {value:.{precision}f}" if isinstance(
@@ -56,35 +82,46 @@ def format_value(label, value, precision=2, invalid_placeholder="--"):
 
 def update_gui_with_threading():
     """
-    Function to update the GUI, retrieving data from the queue.
+    Function to update the GUI, retrieving data from the store.
     """
-
-    global data
-
-    if data:
-        raw_data = data.get('raw_value', [])
-        bpm = data.get('bpm', -1)
-        ipm = data.get('ipm', -1)
-        rmssd = data.get('rmssd', -1)
-        hrstd = data.get('hrstd', -1)
+    global shown_frames
+
+    # Show the first device that sent data
+    devices = store.device_list()
+    device = devices[0] if devices else None
+
+    # Only redraw when a new frame arrived
+    if device and device.frames != shown_frames:
+        shown_frames = device.frames
+        data = device.snapshot(TRACE_SAMPLES)
+        raw_data = data['samples']
+        bpm = data['bpm']
+        ipm = data['ipm']
+        rmssd = data['rmssd']
+        hrstd = data['hrstd']
+        spo2 = data['spo2']
 
         # Update labels using helper function
         bpm_label.config(text=f'{format_value("Heart Rate", bpm)} bpm')
         ipm_label.config(text=format_value("IPM", ipm))
         rmssd_label.config(text=format_value("RMSSD", rmssd))
         hrstd_label.config(text=format_value("HRSTD", hrstd))
+        spo2_label.config(text=f'{format_value("SpO2", spo2, precision=1)} %')
 
         # Update plot
-        update_plot(raw_data)
+        if BLIT:
+            trace_plot.update(raw_data)
+        else:
+            update_plot(raw_data)
 
     # Schedule the next GUI update
-    root.after(1000, update_gui_with_threading)
+    root.after(1000 // REFRESH_FPS, update_gui_with_threading)
 
 
 # Example usage
 if __name__ == "__main__":
     try:
-        receiver = BluetoothReceiver()
+        receiver = BluetoothReceiver(transport=TRANSPORT)
         receiver.start_server()
 
         # Start the data receiving thread
@@ -113,6 +150,8 @@ if __name__ == "__main__":
                                 width=20,
                                 font=label_font)
         hrstd_label.grid(row=3, column=0, sticky='w', padx=10, pady=5)
+        spo2_label = ttk.Label(root, text="SpO2: --", width=20, font=label_font)
+        spo2_label.grid(row=4, column=0, sticky='w', padx=10, pady=5)
 
         # Create figure for the plot
         fig, ax = plt.subplots(figsize=(12, 6))
@@ -121,11 +160,21 @@ if __name__ == "__main__":
         canvas = FigureCanvasTkAgg(fig, master=root)
         canvas.get_tk_widget().grid(row=0, column=1, rowspan=6)
 
+        if BLIT:
+            # Static parts of the plot are drawn once
+            ax.set_xlabel("Time")
+            ax.set_ylabel("IR")
+            ax.set_title("Heartbeat")
+            trace_plot = BlittedTracePlot(ax, TRACE_SAMPLES)
+
         # Start the GUI update loop
-        root.after(1000, update_gui_with_threading)
+        root.after(1000 // REFRESH_FPS, update_gui_with_threading)
         root.mainloop()
 
     except KeyboardInterrupt:
         print("Shutting down server...")
     finally:
         receiver.stop_server()
+        if hub:
+            hub.close()
+            print(f"Hub stats: {hub.stats()}")
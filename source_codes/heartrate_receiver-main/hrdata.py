@@ -0,0 +1,787 @@
+import numpy as np
+from scipy.signal import butter, find_peaks, firwin, sosfilt, sosfilt_zi, sosfiltfilt
+from collections import deque
+from functools import lru_cache
+from time import sleep, time
+
+from ringbuffer import RingBuffer
+
+# Bandpass filter design, cached so it is only computed once per fs/lowcut/highcut
+@lru_cache(maxsize=None)
+def design_bandpass(fs, lowcut=0.5, highcut=3.0):
+    nyquist = 0.5 * fs
+    low = lowcut / nyquist
+    high = highcut / nyquist
+    return butter(1, [low, high], btype="band", output="sos")
+
+# Bandpass filter function
+def bandpass_filter(data, fs, lowcut=0.5, highcut=3.0):
+    return sosfiltfilt(design_bandpass(fs, lowcut, highcut), data)
+
+
+class StreamingBandpass:
+    """
+    Stateful bandpass filter that only processes the new samples on each call.
+
+    With lag=0 the output is the causal filter output. With lag > 0 a
+    backward pass over the last `lag` + new samples approximates the
+    zero-phase filtfilt output, delayed by `lag` samples.
+
+    Several channels (e.g. red and IR as a (2, n) array) are filtered
+    together, in one call per block.
+    """
+
+    def __init__(self, fs, lowcut=0.5, highcut=3.0, lag=0):
+        """
+        Initialize the StreamingBandpass object.
+
+        Args:
+            fs (float): Sampling frequency in Hz.
+            lowcut (float): Low cutoff frequency in Hz.
+            highcut (float): High cutoff frequency in Hz.
+            lag (int): Delay in samples of the zero-phase output, 0 for causal output.
+        """
+        self.sos = design_bandpass(fs, lowcut, highcut)
+        self.lag = lag
+        self._zi_unit = sosfilt_zi(self.sos)
+        self._zi = None
+        # Forward-filtered samples still waiting for `lag` samples of future
+        self._tail = None
+
+    def _steady_state(self, first):
+        """Filter state of a constant input equal to `first` (one value per channel)."""
+        shape = (len(self.sos),) + (1,) * np.ndim(first) + (2,)
+        return self._zi_unit.reshape(shape) * np.asarray(first)[..., np.newaxis]
+
+    def process(self, samples):
+        """
+        Filter the new samples.
+
+        Args:
+            samples (np.array): New raw samples of shape (n,) or (channels, n).
+
+        Returns:
+            np.array: Filtered samples, as many as given when lag=0,
+            otherwise the samples that are now `lag` samples old.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.shape[-1] == 0:
+            return samples
+        if self._zi is None:
+            # Start from the steady state of the first sample to avoid a step transient
+            self._zi = self._steady_state(samples[..., 0])
+
+        forward, self._zi = sosfilt(self.sos, samples, axis=-1, zi=self._zi)
+        if self.lag == 0:
+            return forward
+
+        segment = forward if self._tail is None else np.concatenate((self._tail, forward), axis=-1)
+        ready = segment.shape[-1] - self.lag
+        if ready <= 0:
+            self._tail = segment
+            return segment[..., :0]
+
+        # Backward pass, the filter state decays within `lag` samples
+        backward, _ = sosfilt(self.sos, segment[..., ::-1], axis=-1,
+                              zi=self._steady_state(segment[..., -1]))
+        self._tail = segment[..., ready:]
+        return backward[..., ::-1][..., :ready]
+
+class PolyphaseDecimator:
+    """
+    Anti-alias FIR filter and downsampler for a block stream.
+
+    Only every `factor`-th output of the filter is kept, so only those are
+    computed: each one is the dot product of the taps with a strided,
+    zero-copy window of the input, which is the polyphase form without a
+    Python loop. Any number of channels can be decimated at once (e.g.
+    red and IR as a (2, n) array).
+
+    The filter is linear-phase with an odd number of taps, so every output
+    is centered on an input sample; with the input timestamps, the output
+    gets the timestamp of that sample and the filter adds no timing error.
+    The outputs are centered on every `factor`-th input index, lost input
+    samples included (see skip()), so a gap does not shift the grid.
+    """
+
+    def __init__(self, factor, numtaps=None, cutoff=0.8):
+        """
+        Initialize the PolyphaseDecimator object.
+
+        Args:
+            factor (int): Decimation factor.
+            numtaps (int): Filter length, made odd, defaults to 8 * factor + 1.
+            cutoff (float): Cutoff frequency as a fraction of the output's Nyquist frequency.
+        """
+        self.factor = factor
+        numtaps = 8 * factor + 1 if numtaps is None else numtaps | 1
+        self.taps = firwin(numtaps, cutoff / factor)
+        self.delay = numtaps // 2  # Input samples between an output's center and its last input
+        self._samples = None  # Inputs needed by the next outputs
+        self._timestamps = None
+        self._start = 0  # Input index of _samples[..., 0]
+        self._next = 0  # Input index the next output is centered on
+        self._input_index = 0  # Input index of the next input sample
+
+    def process(self, samples, timestamps=None):
+        """
+        Decimate new samples.
+
+        Args:
+            samples (np.array): New samples of shape (n,) or (channels, n).
+            timestamps (np.array): Time of each sample, optional.
+
+        Returns:
+            np.array: The decimated samples, or (samples, timestamps) if
+            timestamps were given. The outputs lag `delay` input samples.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if self._samples is None:
+            # Repeat the first sample before the start so the filter does not ring
+            self._samples = np.repeat(samples[..., :1], self.delay, axis=-1)
+            self._timestamps = np.full(self.delay, np.nan)
+            self._start = self._input_index - self.delay
+        self._input_index += samples.shape[-1]
+        buffered = np.concatenate((self._samples, samples), axis=-1)
+        if timestamps is not None:
+            buffered_t = np.concatenate((self._timestamps, timestamps))
+
+        # Windows of the outputs centered on _next, _next + factor, ...
+        first = self._next - self.delay - self._start
+        if buffered.shape[-1] >= len(self.taps):
+            windows = np.lib.stride_tricks.sliding_window_view(buffered, len(self.taps), axis=-1)
+            windows = windows[..., first::self.factor, :]
+        else:
+            windows = np.zeros(buffered.shape[:-1] + (0, len(self.taps)))
+        # The taps are symmetric, no need to reverse them
+        output = windows @ self.taps
+        n_out = windows.shape[-2]
+
+        centers = self._next - self._start + self.factor * np.arange(n_out)
+        self._next += self.factor * n_out
+        keep = self._next - self.delay - self._start
+        self._samples = buffered[..., keep:]
+        self._start += keep
+        if timestamps is None:
+            return output
+        self._timestamps = buffered_t[keep:]
+        return output, buffered_t[centers]
+
+    def skip(self, n):
+        """
+        Account for `n` input samples lost before the next ones. The
+        outputs centered before the first new sample are lost, since their
+        inputs are incomplete, and the filter starts again on the new
+        samples.
+
+        Args:
+            n (int): Number of input samples lost.
+
+        Returns:
+            int: Number of outputs lost, the `lost` count of the decimated stream.
+        """
+        if n <= 0:
+            return 0
+        self._input_index += n
+        lost = max(-(-(self._input_index - self._next) // self.factor), 0)
+        self._next += lost * self.factor
+        self._samples = None
+        self._timestamps = None
+        return lost
+
+
+# Calculate RMSSD
+def calculate_rmssd(ibi):
+    diff = np.diff(ibi)  # Successive differences of IBIs
+    squared_diff = diff ** 2
+    rmssd = np.sqrt(np.mean(squared_diff))
+    return rmssd
+
+# Function to calculate HR metrics
+def calculate_hr_metrics(ir_data, fs):
+    ir_filtered = bandpass_filter(ir_data, fs=fs)
+    return hr_metrics_from_filtered(ir_filtered, fs)
+
+# Function to calculate HR metrics from already bandpass filtered IR data
+def hr_metrics_from_filtered(ir_filtered, fs):
+    # Detect peaks
+    peaks, _ = find_peaks(ir_filtered, distance=fs / 2.5)  # Minimum distance for 150 bpm
+    if len(peaks) < 2:
+        return None, None, None, None, None
+
+    # Calculate IBI (in ms)
+    ibi = np.diff(peaks) / fs * 1000  # Convert from samples to milliseconds
+    avg_ibi = np.mean(ibi)  # Average IBI
+
+    # Calculate metrics
+    hr = 60 / (avg_ibi / 1000)  # Convert mean IBI to bpm
+    hrstd = np.std(60 / (ibi / 1000))  # Standard deviation of HR values
+    rmssd = calculate_rmssd(ibi)  # Root Mean Square of Successive Differences
+
+    # Calculate IPM (Impulses Per Minute)
+    window_duration_minutes = len(ir_filtered) / (fs * 60)  # Window duration in minutes
+    ipm = len(peaks) / window_duration_minutes
+
+    return hr, ipm, hrstd, rmssd, ir_filtered
+
+
+class BeatTracker:
+    """
+    Incremental beat detector over a filtered PPG stream.
+
+    Only the newly arrived samples are examined. A detected beat stays
+    pending for `distance` samples, in case a higher peak replaces it, and
+    is then appended to the beat list. HR, HRSTD and RMSSD are maintained
+    as running sums over the last `horizon` inter-beat intervals, so the
+    cost per update does not grow with the horizon.
+
+    With `interpolate`, a beat is placed at the vertex of the parabola
+    through the peak and its two neighbours instead of on the sample, so
+    the intervals are no longer multiples of the sample period.
+    """
+
+    def __init__(self, fs, horizon=10, distance=None, interpolate=False):
+        """
+        Initialize the BeatTracker object.
+
+        Args:
+            fs (float): Sampling frequency in Hz.
+            horizon (int): Number of inter-beat intervals the metrics are computed over.
+            distance (float): Minimum distance between beats in samples,
+                defaults to fs / 2.5 (150 bpm).
+            interpolate (bool): Locate the beats between samples.
+        """
+        self.fs = fs
+        self.horizon = horizon
+        self.distance = fs / 2.5 if distance is None else distance
+        self.interpolate = interpolate
+
+        self.beats = deque()  # Sample indices of the committed beats, fractional with `interpolate`
+        # Sample indices of the beats IPM is counted over, trimmed to the
+        # window asked for by metrics() rather than to the horizon
+        self._window_beats = deque()
+        self.count = 0  # Number of beats ever committed
+        self._pending = None  # (index, height) of the beat not yet committed
+        self._tail = np.zeros(0)  # Last two samples, neighbours of the next ones
+        self._index = 0  # Sample index of the next sample
+
+        # Running statistics over the IBI horizon
+        self._ibi = deque()
+        self._ibi_sum = 0.0
+        self._hr_sum = 0.0
+        self._hr_sq_sum = 0.0
+        self._sq_diff = deque()
+        self._sq_diff_sum = 0.0
+
+    @property
+    def next_index(self):
+        """Sample index of the next sample, lost samples included."""
+        return self._index
+
+    def update(self, filtered):
+        """
+        Examine new filtered samples for beats.
+
+        Args:
+            filtered (np.array): New bandpass filtered samples.
+        """
+        segment = np.concatenate((self._tail, filtered))
+        start = self._index - len(self._tail)  # Sample index of segment[0]
+
+        # Local maxima, a sample needs both neighbours to be examined
+        if len(segment) >= 3:
+            mid = segment[1:-1]
+            maxima = np.flatnonzero((mid > segment[:-2]) & (mid >= segment[2:])) + 1
+            positions = start + maxima
+            if self.interpolate and len(maxima):
+                left, peak, right = segment[maxima - 1], segment[maxima], segment[maxima + 1]
+                # Vertex of the parabola, within half a sample of the peak
+                positions = positions + 0.5 * (left - right) / (left - 2 * peak + right)
+            for position, i in zip(positions, maxima):
+                self._add_candidate(position, segment[i])
+
+        self._tail = segment[-2:]
+        self._index += len(filtered)
+
+        # No later peak can replace the pending beat anymore
+        if self._pending is not None and self._index - 1 - self._pending[0] >= self.distance:
+            self._commit(self._pending[0])
+            self._pending = None
+
+    def skip(self, n):
+        """
+        Account for `n` samples lost before the next ones, so the beats
+        around the gap keep their true distance.
+        """
+        if n <= 0:
+            return
+        self._index += n
+        # Samples on both sides of the gap are not neighbours
+        self._tail = np.zeros(0)
+
+    def _add_candidate(self, index, height):
+        if self._pending is None:
+            self._pending = (index, height)
+        elif index - self._pending[0] < self.distance:
+            # Within the refractory distance, keep the higher peak
+            if height > self._pending[1]:
+                self._pending = (index, height)
+        else:
+            self._commit(self._pending[0])
+            self._pending = (index, height)
+
+    def _commit(self, index):
+        if self.beats:
+            self._add_ibi((index - self.beats[-1]) / self.fs * 1000)
+        self.beats.append(index)
+        self._window_beats.append(index)
+        self.count += 1
+        if len(self.beats) > self.horizon + 1:
+            self.beats.popleft()
+
+    def _add_ibi(self, ibi):
+        if self._ibi:
+            sq_diff = (ibi - self._ibi[-1]) ** 2
+            self._sq_diff.append(sq_diff)
+            self._sq_diff_sum += sq_diff
+        self._ibi.append(ibi)
+        self._ibi_sum += ibi
+        self._hr_sum += 60000 / ibi
+        self._hr_sq_sum += (60000 / ibi) ** 2
+
+        if len(self._ibi) > self.horizon:
+            old = self._ibi.popleft()
+            self._ibi_sum -= old
+            self._hr_sum -= 60000 / old
+            self._hr_sq_sum -= (60000 / old) ** 2
+            self._sq_diff_sum -= self._sq_diff.popleft()
+
+    def metrics(self, window_size):
+        """
+        Return the current HR metrics.
+
+        Args:
+            window_size (int): Number of samples the IPM is counted over.
+
+        Returns:
+            tuple: (hr, ipm, hrstd, rmssd), all None if fewer than two beats
+            have been detected.
+        """
+        n = len(self._ibi)
+        if n == 0:
+            return None, None, None, None
+
+        hr = 60000 * n / self._ibi_sum
+        hr_mean = self._hr_sum / n
+        hrstd = np.sqrt(max(self._hr_sq_sum / n - hr_mean ** 2, 0.0))
+        rmssd = np.sqrt(self._sq_diff_sum / len(self._sq_diff)) if self._sq_diff else np.nan
+
+        # Beats in the last `window_size` samples
+        while self._window_beats and self._window_beats[0] < self._index - window_size:
+            self._window_beats.popleft()
+        ipm = len(self._window_beats) / (window_size / (self.fs * 60))
+
+        return hr, ipm, hrstd, rmssd
+
+
+class SpO2Estimator:
+    """
+    Per-beat SpO2 from the red and IR channels.
+
+    Over each interval between two beats, the pulse amplitude (AC, peak to
+    trough of the filtered signal) and the mean level (DC, raw signal) of
+    both channels come from one reduction over a (4, n) slice of the
+    history. Their ratio of ratios R = (AC_red / DC_red) / (AC_ir / DC_ir)
+    gives SpO2 = 110 - 25 R. The estimate is the median over the last
+    `horizon` beats, so one beat spoiled by motion does not move it.
+    """
+
+    def __init__(self, fs, horizon=10, history_seconds=5.0):
+        """
+        Initialize the SpO2Estimator object.
+
+        Args:
+            fs (float): Sampling frequency in Hz.
+            horizon (int): Number of beats the estimate is the median of.
+            history_seconds (float): Samples kept, longer than the longest beat interval.
+        """
+        # Filtered red, filtered IR, raw red and raw IR
+        self.history = RingBuffer(int(history_seconds * fs), channels=4, dtype=np.float64)
+        self.values = deque(maxlen=horizon)
+
+    def extend(self, filtered, raw, lost=0):
+        """
+        Add new samples.
+
+        Args:
+            filtered (np.array): Filtered red and IR of shape (2, n).
+            raw (np.array): The raw red and IR of the same samples.
+            lost (int): Samples lost before these ones, no beat spanning
+                them gets an estimate.
+        """
+        if lost:
+            self.history.extend(np.full((4, min(lost, self.history.capacity)), np.nan))
+        self.history.extend(np.vstack((filtered, raw)))
+
+    def add_beat(self, start, end, next_index):
+        """
+        Estimate the SpO2 of the interval between two beats.
+
+        Args:
+            start, end (float): Sample indices of the two beats.
+            next_index (int): Sample index of the next sample to be added.
+
+        Returns:
+            float: The beat's SpO2 in percent, None if it cannot be estimated.
+        """
+        lo = int(np.ceil(start))
+        hi = int(np.floor(end)) + 1
+        back = next_index - lo
+        if hi - lo < 2 or back > len(self.history):
+            return None
+        segment = self.history.latest(back)[:, :hi - lo]
+        ac = segment[:2].max(axis=1) - segment[:2].min(axis=1)
+        dc = segment[2:].mean(axis=1)
+        # NaN from lost samples fails the comparisons too
+        if not (np.all(ac > 0) and np.all(dc > 0)):
+            return None
+
+        ratio = (ac[0] / dc[0]) / (ac[1] / dc[1])
+        spo2 = min(max(110 - 25 * ratio, 0.0), 100.0)
+        self.values.append(spo2)
+        return spo2
+
+    def value(self):
+        """Median SpO2 of the recent beats, NaN before the first one."""
+        return float(np.median(self.values)) if self.values else np.nan
+
+
+class StreamingHRMonitor:
+    """
+    Sliding-window heart rate monitor.
+
+    New samples are bandpass filtered and examined for beats as they
+    arrive, and the filtered samples are pushed into a fixed-length window.
+    The metrics are output every `hop` samples, so the update rate no
+    longer depends on the window length.
+
+    With `spo2`, red and IR are pushed together as a (2, n) array and
+    filtered in the same pass; the beats found on IR also give a per-beat
+    SpO2 estimate from both channels (see SpO2Estimator).
+    """
+
+    def __init__(self, fs, window_size=100, hop=12, lag=0, horizon=10, interpolate=False,
+                 spo2=False):
+        """
+        Initialize the StreamingHRMonitor object.
+
+        Args:
+            fs (float): Sampling frequency in Hz.
+            window_size (int): Number of samples the metrics are computed over.
+            hop (int): Number of new samples between two outputs.
+            lag (int): Lag of the zero-phase filter mode, 0 for the causal filter.
+            horizon (int): Number of inter-beat intervals HR, HRSTD and RMSSD
+                are computed over.
+            interpolate (bool): Locate the beats between samples.
+            spo2 (bool): Take red and IR samples and estimate SpO2.
+        """
+        self.fs = fs
+        self.window_size = window_size
+        self.hop = hop
+        self.filter = StreamingBandpass(fs, lag=lag)
+        self.tracker = BeatTracker(fs, horizon=horizon, interpolate=interpolate)
+        # Filtered IR samples
+        self.window = RingBuffer(window_size, dtype=np.float64)
+        self._since_output = 0
+
+        self.oximeter = SpO2Estimator(fs, horizon=horizon) if spo2 else None
+        # Raw samples whose filtered output is still delayed by the filter's lag
+        self._raw_pending = np.zeros((2, 0))
+        self._pushed = 0  # Number of samples given to the filter
+        # (samples pushed before the gap, samples lost) of the gaps the
+        # filtered output has not reached yet
+        self._gaps = deque()
+
+    @property
+    def total_samples(self):
+        """Number of filtered samples pushed into the window so far."""
+        return self.window.total
+
+    @property
+    def spo2(self):
+        """SpO2 estimate in percent, NaN without an estimate or without `spo2`."""
+        return self.oximeter.value() if self.oximeter is not None else np.nan
+
+    def set_sample_rate(self, fs):
+        """
+        Use a measured sampling frequency for the intervals between beats
+        from now on. The filter keeps its design: a drift of a fraction of
+        a percent does not move its cutoffs noticeably.
+
+        Args:
+            fs (float): Sampling frequency in Hz, e.g. as estimated by the driver.
+        """
+        self.fs = fs
+        self.tracker.fs = fs
+
+    def push(self, samples, lost=0):
+        """
+        Filter new IR samples, track beats and push them into the window.
+
+        Args:
+            samples (np.array): New raw IR samples, any length, or red and
+                IR of shape (2, n) with `spo2`.
+            lost (int): Samples lost (e.g. to a FIFO overflow) before these ones.
+
+        Returns:
+            tuple: (hr, ipm, hrstd, rmssd, ir_filtered) as returned by
+            calculate_hr_metrics if an output is due, otherwise None. The
+            SpO2 estimate is in `spo2`.
+        """
+        samples = np.asarray(samples)
+        if lost > 0:
+            self._gaps.append((self._pushed, lost))
+        self._pushed += samples.shape[-1]
+        filtered = self.filter.process(samples)
+        n = filtered.shape[-1]
+        if self.oximeter is not None:
+            # The filter's output lags its input by `lag` samples
+            raw = np.concatenate((self._raw_pending, samples), axis=1)
+            self._raw_pending = raw[:, n:]
+
+        # A gap is applied when the lagging output reaches it, so the beats
+        # and the SpO2 history around it keep their true distance
+        first = self.window.total
+        bounds = [0]
+        gaps = [0]
+        while self._gaps and self._gaps[0][0] < first + n:
+            position, gap = self._gaps.popleft()
+            bounds.append(position - first)
+            gaps.append(gap)
+        bounds.append(n)
+
+        committed = self.tracker.count
+        for start, end, gap in zip(bounds[:-1], bounds[1:], gaps):
+            block = filtered[..., start:end]
+            if self.oximeter is not None:
+                self.oximeter.extend(block, raw[:, start:end], gap)
+                block = block[1]
+            self.window.extend(block)
+            self.tracker.skip(gap)
+            self.tracker.update(block)
+        self._since_output += n
+
+        if self.oximeter is not None:
+            beats = self.tracker.beats
+            new = self.tracker.count - committed
+            for i in range(max(len(beats) - new, 1), len(beats)):
+                self.oximeter.add_beat(beats[i - 1], beats[i], self.tracker.next_index)
+
+        if len(self.window) < self.window_size or self._since_output < self.hop:
+            return None
+
+        # A block spanning several hops still produces a single output
+        self._since_output %= self.hop
+        hr, ipm, hrstd, rmssd = self.tracker.metrics(self.window_size)
+        if hr is None:
+            return None, None, None, None, None
+        return hr, ipm, hrstd, rmssd, self.window.latest()
+
+
+def replay_hr_metrics(recording, fs, window_size=100, hop=12, block_size=17):
+    """
+    Feed a recorded IR signal through a StreamingHRMonitor, `block_size`
+    samples at a time (17 mimics the sensor's FIFO almost-full interrupt).
+
+    Yields:
+        tuple: (index of the newest sample in the window, metrics tuple)
+    """
+    monitor = StreamingHRMonitor(fs, window_size=window_size, hop=hop)
+    for start in range(0, len(recording), block_size):
+        result = monitor.push(recording[start:start + block_size])
+        if result is not None:
+            yield monitor.total_samples - 1, result
+
+# Overlapping windows of a 1-D recording as a zero-copy 2-D view
+def sliding_windows(recording, window_size, hop=1):
+    return np.lib.stride_tricks.sliding_window_view(recording, window_size)[::hop]
+
+
+# Function to find peaks in every row of a 2-D array at once
+def find_peaks_batch(x, distance):
+    """
+    Vectorized equivalent of scipy's find_peaks(row, distance=distance)
+    applied to every row of `x`. Close peaks of exactly equal height are
+    resolved in favour of the later one, which scipy leaves unspecified.
+
+    Args:
+        x (np.array): 2-D array, one signal per row.
+        distance (float): Minimum distance between peaks in samples.
+
+    Returns:
+        tuple: (rows, positions) of all peaks, sorted by row then position.
+    """
+    n_rows, n = x.shape
+    flat = x.ravel()
+    index = np.arange(flat.size)
+    position = index % n
+
+    # Rising edges, the first and last sample of a row are never peaks
+    candidates = np.flatnonzero((position >= 1) & (position <= n - 2))
+    candidates = candidates[flat[candidates] > flat[candidates - 1]]
+
+    # End of a flat top: the next sample that differs, capped at the row's last sample
+    changes = np.append(np.flatnonzero(flat[1:] != flat[:-1]) + 1, flat.size - 1)
+    ahead = changes[np.searchsorted(changes, candidates, side="right")]
+    ahead = np.minimum(ahead, candidates - position[candidates] + n - 1)
+    is_peak = flat[ahead] < flat[candidates]
+    peaks = (candidates[is_peak] + ahead[is_peak] - 1) // 2  # Middle of a flat top
+
+    rows = peaks // n
+    positions = peaks % n
+    heights = flat[peaks]
+
+    # Keep peaks greedily by height, in rounds over all rows at once
+    distance = np.ceil(distance)
+    keep = np.ones(len(peaks), dtype=bool)
+    undecided = np.ones(len(peaks), dtype=bool)
+    # Peaks of a row are at least 2 samples apart, so only a few neighbours can conflict
+    max_shift = int(distance) // 2 + 1
+    while undecided.any():
+        dominant = undecided.copy()
+        for shift in range(1, min(max_shift, len(peaks)) + 1):
+            close = (rows[shift:] == rows[:-shift]) & \
+                    (positions[shift:] - positions[:-shift] < distance)
+            # Undecided neighbour that is higher, or as high and later
+            left_wins = close & undecided[:-shift] & (heights[:-shift] > heights[shift:])
+            right_wins = close & undecided[shift:] & (heights[shift:] >= heights[:-shift])
+            dominant[shift:] &= ~left_wins
+            dominant[:-shift] &= ~right_wins
+        undecided &= ~dominant
+
+        # Drop the undecided peaks too close to a newly kept one
+        for shift in range(1, min(max_shift, len(peaks)) + 1):
+            close = (rows[shift:] == rows[:-shift]) & \
+                    (positions[shift:] - positions[:-shift] < distance)
+            suppressed_right = close & dominant[:-shift] & undecided[shift:]
+            suppressed_left = close & dominant[shift:] & undecided[:-shift]
+            keep[shift:] &= ~suppressed_right
+            undecided[shift:] &= ~suppressed_right
+            keep[:-shift] &= ~suppressed_left
+            undecided[:-shift] &= ~suppressed_left
+
+    return rows[keep], positions[keep]
+
+
+# Function to calculate HR metrics for many windows at once
+def calculate_hr_metrics_batch(data, fs, window_size=100, hop=None,
+                               lowcut=0.5, highcut=3.0, chunk_size=4096):
+    """
+    Calculate the metrics of calculate_hr_metrics for every window of a
+    recording in one vectorized pass.
+
+    Args:
+        data (np.array): 1-D recording, split into windows of `window_size`
+            samples every `hop` samples, or a 2-D stack of windows.
+        fs (float): Sampling frequency in Hz.
+        window_size (int): Window length for a 1-D recording.
+        hop (int): Samples between windows for a 1-D recording, defaults to window_size.
+        lowcut (float): Low cutoff frequency of the bandpass filter in Hz.
+        highcut (float): High cutoff frequency of the bandpass filter in Hz.
+        chunk_size (int): Number of windows processed at once, bounds the memory used.
+
+    Returns:
+        dict: Arrays "bpm", "ipm", "hrstd" and "rmssd" with one value per
+        window, NaN where fewer than two peaks were detected.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        windows = sliding_windows(data, window_size, window_size if hop is None else hop)
+    else:
+        windows = data
+    n_windows, n = windows.shape
+    sos = design_bandpass(fs, lowcut, highcut)
+
+    results = {key: np.full(n_windows, np.nan) for key in ("bpm", "ipm", "hrstd", "rmssd")}
+    for start in range(0, n_windows, chunk_size):
+        chunk = windows[start:start + chunk_size]
+        n_chunk = len(chunk)
+        filtered = sosfiltfilt(sos, chunk, axis=-1)
+        rows, positions = find_peaks_batch(filtered, distance=fs / 2.5)
+
+        # IBIs between consecutive peaks of the same window (in ms)
+        same = rows[1:] == rows[:-1]
+        ibi = (np.diff(positions) / fs * 1000)[same]
+        ibi_rows = rows[1:][same]
+        n_peaks = np.bincount(rows, minlength=n_chunk)
+        n_ibi = np.bincount(ibi_rows, minlength=n_chunk)
+        valid = n_peaks >= 2
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avg_ibi = np.bincount(ibi_rows, weights=ibi, minlength=n_chunk) / n_ibi
+            hr_values = 60 / (ibi / 1000)
+            hr_mean = np.bincount(ibi_rows, weights=hr_values, minlength=n_chunk) / n_ibi
+            hr_var = np.bincount(ibi_rows, weights=(hr_values - hr_mean[ibi_rows]) ** 2,
+                                 minlength=n_chunk) / n_ibi
+
+            # Successive IBI differences of the same window
+            same_ibi = ibi_rows[1:] == ibi_rows[:-1]
+            sq_diff = (np.diff(ibi) ** 2)[same_ibi]
+            sq_diff_rows = ibi_rows[1:][same_ibi]
+            rmssd = np.sqrt(np.bincount(sq_diff_rows, weights=sq_diff, minlength=n_chunk) /
+                            np.bincount(sq_diff_rows, minlength=n_chunk))
+
+        out = slice(start, start + n_chunk)
+        results["bpm"][out] = np.where(valid, 60 / (avg_ibi / 1000), np.nan)
+        results["ipm"][out] = np.where(valid, n_peaks / (n / (fs * 60)), np.nan)
+        results["hrstd"][out] = np.where(valid, np.sqrt(hr_var), np.nan)
+        results["rmssd"][out] = np.where(valid, rmssd, np.nan)
+
+    return results
+
+
+# Main script for continuous monitoring
+if __name__ == "__main__":
+    from max30102 import MAX30102
+
+    # Initialize the sensor
+    sensor = MAX30102()
+
+    # Sampling frequency (Hz)
+    fs = 25  # Confirm the sensor's sampling rate
+    window_size = 125  # Sliding window size (e.g., 5 seconds at 100 Hz)
+    output_interval = 0.04  # Output metrics every 40 ms
+
+    # Sliding window buffer for IR data
+    ir_buffer = deque(maxlen=window_size)
+
+    print("Starting continuous heart rate monitoring...")
+    last_output_time = time()
+
+    while True:
+        # Use read_sequential to read multiple samples
+        ir_data = sensor.read_sequential(amount=100)
+        ir_buffer.extend(ir_data)
+
+        # Process and output metrics at regular intervals
+        if time() - last_output_time >= output_interval:
+            if len(ir_buffer) >= window_size:
+                # Convert deque to numpy array
+                ir_data_window = np.array(ir_buffer)
+
+                # Calculate heart rate metrics
+                hr, ipm, hrstd, rmssd, ir_filtered = calculate_hr_metrics(ir_data_window, fs)
+                if hr is not None:
+                    print(f"Heart Rate (bpm): {hr:.2f}")
+                    print(f"Impulses per minute: {ipm:.2f}")
+                    print(f"HRSTD: {hrstd:.2f}")
+                    print(f"RMSSD: {rmssd:.2f}")
+                    print(f"Filtered Data: {ir_filtered} ...")
+                else:
+                    print("Not enough peaks detected. Adjust filter or check signal.")
+
+            # Update the last output time
+            last_output_time = time()
+
+        # Sleep briefly to prevent excessive CPU usage
+        sleep(0.01)
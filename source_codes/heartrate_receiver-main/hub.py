@@ -0,0 +1,229 @@
+"""
+Hub-side compute for senders streaming raw samples.
+
+In hub mode a sender only acquires and streams its raw red/IR samples
+(protocol.ENCODING_ZIGZAG_VARINT frames); the receiver runs the sender's
+signal processing per stream and produces the same frames a computing
+sender would send, so the store and the GUI do not see the difference.
+Frames that already carry metrics are passed through.
+
+The raw samples can be recorded per device, in the sender's recording
+format, for reprocessing. Each stream counts the bytes it received per
+sample and the receiver CPU time its processing took.
+
+hrdata.py and recorder.py are copies of the sender's, like protocol.py.
+The hub needs SciPy, a receiver without hub mode does not import it.
+
+Example:
+    store = SignalStore()
+    hub = Hub(on_frame=store.write, record_dir="hub_logs")
+    receiver = AsyncReceiver(on_frame=hub.write)
+"""
+import os
+from time import monotonic, strftime, thread_time
+
+import numpy as np
+
+import hrdata
+import protocol
+from recorder import Recorder
+
+# Sampling frequency (Hz) of the processing, faster streams are decimated to it
+PROCESSING_FS = 25
+WINDOW_SECONDS = 4  # Window the metrics are computed over
+HOP_SECONDS = 0.5  # Time between two metrics updates
+
+
+class RawStream:
+    """Metrics of one device's raw sample stream."""
+
+    def __init__(self, device_id, fs, record_dir=None):
+        """
+        Initialize the RawStream object.
+
+        Args:
+            device_id (int): Id of the sending device.
+            fs (float): Sampling frequency of the raw samples in Hz.
+            record_dir (str): Directory to record the raw samples in, None to disable.
+        """
+        self.device_id = device_id
+        self.raw_fs = fs
+        factor = int(fs // PROCESSING_FS) if fs > PROCESSING_FS else 1
+        self.decimator = hrdata.PolyphaseDecimator(factor) if factor > 1 else None
+        self.fs = fs / factor
+        window_size = int(round(WINDOW_SECONDS * self.fs))
+        self.monitor = hrdata.StreamingHRMonitor(self.fs, window_size=window_size,
+                                                 hop=int(HOP_SECONDS * self.fs),
+                                                 interpolate=True, spo2=True)
+        self.recorder = None
+        if record_dir:
+            self.recorder = Recorder(os.path.join(record_dir, f"device-{device_id}",
+                                                  strftime("%Y%m%d-%H%M%S")))
+
+        self.next_index = None  # Stream index of the next raw sample
+        self.seq = 0  # Sequence number of the next produced frame
+        self.frames = 0
+        self.samples = 0
+        self.lost = 0  # Samples missing from the stream
+        self.bytes = 0
+        self.cpu_s = 0.0
+        self._started_at = None
+
+    def process(self, frame):
+        """
+        Process a raw frame.
+
+        Args:
+            frame (dict): Decoded ENCODING_ZIGZAG_VARINT frame.
+
+        Returns:
+            dict: A frame with the filtered window and the metrics if an
+            update is due, otherwise None.
+        """
+        start_cpu = thread_time()
+        if self._started_at is None:
+            self._started_at = monotonic()
+        self.frames += 1
+        self.bytes += frame["size"]
+
+        red_ir = frame["raw_value"]
+        start = frame["start_index"]
+        timestamp = frame["timestamp"]
+        lost = 0
+        if self.next_index is not None:
+            if start < self.next_index:
+                # Samples already received, e.g. replayed after a reconnect
+                skip = self.next_index - start
+                red_ir = red_ir[:, skip:]
+                start += skip
+                timestamp += skip / frame["fs"]
+            lost = start - self.next_index
+        n = red_ir.shape[1]
+        self.next_index = start + n
+        self.samples += n
+        self.lost += lost
+        if n == 0:
+            self.cpu_s += thread_time() - start_cpu
+            return None
+
+        timestamps = timestamp + np.arange(n) / frame["fs"]
+        if self.recorder:
+            self.recorder.append_samples(red_ir, timestamps)
+
+        if self.decimator:
+            lost = self.decimator.skip(lost)
+            red_ir, timestamps = self.decimator.process(red_ir, timestamps)
+        # The sender measures its sensor's true rate
+        self.monitor.set_sample_rate(frame["fs"] * self.fs / self.raw_fs)
+        result = self.monitor.push(red_ir, lost)
+
+        output = None
+        if result is not None:
+            hr, ipm, hrstd, rmssd, window = result
+            if hr is None:
+                # Not enough peaks yet, the trace is still shown
+                hr = ipm = hrstd = rmssd = np.nan
+                window = self.monitor.window.latest()
+            output = {
+                "device_id": self.device_id,
+                "seq": self.seq,
+                "start_index": self.monitor.total_samples - len(window),
+                "timestamp": timestamps[-1] - (len(window) - 1) / self.monitor.fs,
+                "flags": 0,
+                "encoding": protocol.ENCODING_FLOAT32,
+                "size": 0,
+                "raw_value": window.copy(),
+                "fs": self.fs,
+                "bpm": hr,
+                "ipm": ipm,
+                "hrstd": hrstd,
+                "rmssd": rmssd,
+                "spo2": self.monitor.spo2,
+            }
+            self.seq += 1
+            if self.recorder:
+                self.recorder.append_metrics(output["timestamp"], hr, ipm, hrstd, rmssd,
+                                             output["spo2"])
+
+        self.cpu_s += thread_time() - start_cpu
+        return output
+
+    def close(self):
+        if self.recorder:
+            self.recorder.close()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Frames, samples and lost samples received, bytes per
+            sample on the wire, and the receiver CPU time spent on the
+            stream in total and as a share of one core.
+        """
+        elapsed = monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "frames": self.frames,
+            "samples": self.samples,
+            "lost": self.lost,
+            "bytes_per_sample": round(self.bytes / self.samples, 3) if self.samples else 0.0,
+            "cpu_s": round(self.cpu_s, 4),
+            "cpu_share": round(self.cpu_s / elapsed, 5) if elapsed else 0.0,
+        }
+
+
+class Hub:
+    """Routes raw frames to one RawStream per device."""
+
+    def __init__(self, on_frame=None, record_dir=None):
+        """
+        Initialize the Hub object.
+
+        Args:
+            on_frame (callable): Called with every frame carrying metrics,
+                received or produced, e.g. SignalStore.write.
+            record_dir (str): Directory to record the raw streams in, None to disable.
+        """
+        self.on_frame = on_frame
+        self.record_dir = record_dir
+        self.streams = {}
+
+    def process(self, frame):
+        """
+        Args:
+            frame (dict): Decoded frame.
+
+        Returns:
+            dict: The frame itself if it carries metrics, the frame
+            produced from a raw stream if an update is due, otherwise None.
+        """
+        if frame["encoding"] != protocol.ENCODING_ZIGZAG_VARINT:
+            return frame
+        device_id = frame["device_id"]
+        stream = self.streams.get(device_id)
+        restarted = frame["seq"] == 0 and not frame["flags"] & protocol.FLAG_REPLAY
+        if stream is None or restarted or abs(frame["fs"] / stream.raw_fs - 1) > 0.1:
+            # New sender, restarted sender or changed acquisition profile
+            if stream is not None:
+                stream.close()
+            stream = self.streams[device_id] = RawStream(device_id, frame["fs"], self.record_dir)
+        return stream.process(frame)
+
+    def write(self, frame):
+        """
+        Process a frame and pass the result on to on_frame. Can be used as
+        the on_frame callback of AsyncReceiver.
+        """
+        output = self.process(frame)
+        if output is not None and self.on_frame is not None:
+            self.on_frame(output)
+
+    def close(self):
+        """Close the recordings."""
+        for stream in self.streams.values():
+            stream.close()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Stats of every raw stream by device id.
+        """
+        return {device_id: stream.stats() for device_id, stream in self.streams.items()}
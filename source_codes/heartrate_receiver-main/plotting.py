@@ -0,0 +1,192 @@
+"""
+Fast incremental trace plotting with Matplotlib blitting.
+
+The line artist is created once. Every update only changes its data,
+restores a cached background (axes, labels, grid) and redraws the line,
+instead of clearing and redrawing the whole figure. A full redraw is
+only needed when the y range has to change or the window is resized.
+
+Run this file to compare both modes headless:
+    python plotting.py
+"""
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+
+
+class FrameTimer:
+    """Keeps the render time of the last frames."""
+
+    def __init__(self, size=300):
+        """
+        Args:
+            size (int): Number of frames kept.
+        """
+        self.times = deque(maxlen=size)
+        self.frames = 0
+        self._start = None
+
+    def start(self):
+        self._start = perf_counter()
+
+    def stop(self):
+        self.times.append(perf_counter() - self._start)
+        self.frames += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Mean, p50 and p99 render time in ms over the kept frames,
+            and the frame rate the render time alone would allow.
+        """
+        if not self.times:
+            return {"frames": 0, "mean_ms": np.nan, "p50_ms": np.nan,
+                    "p99_ms": np.nan, "max_fps": np.nan}
+        times = np.array(self.times) * 1000
+        return {
+            "frames": self.frames,
+            "mean_ms": float(times.mean()),
+            "p50_ms": float(np.percentile(times, 50)),
+            "p99_ms": float(np.percentile(times, 99)),
+            "max_fps": float(1000 / times.mean()),
+        }
+
+
+class BlittedTracePlot:
+    """A scrolling trace of the last `n_points` samples, drawn with blitting."""
+
+    def __init__(self, ax, n_points, color='r', margin=0.25):
+        """
+        Initialize the BlittedTracePlot object.
+
+        Args:
+            ax (matplotlib.axes.Axes): Axes to draw in; labels and title
+                are set by the caller once.
+            n_points (int): Number of samples shown.
+            color (str): Color of the trace.
+            margin (float): Fraction of the data range added above and
+                below when the y limits are recomputed.
+        """
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.n_points = n_points
+        self.margin = margin
+        self.timer = FrameTimer()
+        self.full_redraws = 0
+
+        # Preallocated y data, right-aligned, NaN where there is no sample yet
+        self._ydata = np.full(n_points, np.nan)
+        self.line, = ax.plot(np.arange(n_points), self._ydata, color=color, animated=True)
+        ax.set_xlim(0, n_points - 1)
+        # Artists redrawn on every update; others (e.g. a text) can be
+        # added, they must be animated and inside the axes
+        self.artists = [self.line]
+
+        self._background = None
+        # The background has to be cached again after any full redraw (e.g. resize)
+        self._cid = self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def remove(self):
+        """Stop following the canvas' redraws, e.g. before the figure is cleared."""
+        self.canvas.mpl_disconnect(self._cid)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def _fit_ylim(self, lo, hi):
+        """
+        Return True if the y limits had to change to fit [lo, hi]. They are
+        widened when the data leaves them, and tightened when it only uses
+        a third of them, so small changes in amplitude do not trigger full
+        redraws.
+        """
+        y0, y1 = self.ax.get_ylim()
+        span = max(hi - lo, 1e-9)
+        if lo >= y0 and hi <= y1 and (y1 - y0) <= 3 * span:
+            return False
+        self.ax.set_ylim(lo - span * self.margin, hi + span * self.margin)
+        return True
+
+    def set_data(self, samples):
+        """
+        Set the data without drawing it.
+
+        Args:
+            samples (np.array): The newest samples, the last `n_points` are shown.
+
+        Returns:
+            bool: True if the axes changed and the canvas needs a full redraw.
+        """
+        samples = np.asarray(samples)[-self.n_points:]
+        self._ydata[:self.n_points - len(samples)] = np.nan
+        self._ydata[self.n_points - len(samples):] = samples
+        self.line.set_ydata(self._ydata)
+
+        valid = samples[~np.isnan(samples)]
+        rescaled = len(valid) > 0 and self._fit_ylim(valid.min(), valid.max())
+        return rescaled or self._background is None
+
+    def blit(self):
+        """Redraw the artists over the cached background."""
+        self.canvas.restore_region(self._background)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+
+    def update(self, samples):
+        """
+        Show new data.
+
+        Args:
+            samples (np.array): The newest samples, the last `n_points` are shown.
+        """
+        self.timer.start()
+        if self.set_data(samples):
+            # The axes changed, redraw everything; _on_draw caches the new background
+            self.full_redraws += 1
+            self.canvas.draw()
+        else:
+            self.blit()
+        self.timer.stop()
+
+
+def _benchmark(n_frames=200, n_points=250):
+    """Compare a full redraw per frame with blitting, using the Agg backend."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    rng = np.random.default_rng(0)
+    signal = np.sin(np.arange(n_frames + n_points) * 2 * np.pi * 1.2 / 25) * 50
+    signal += rng.normal(0, 2, len(signal))
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    timer = FrameTimer()
+    for i in range(n_frames):
+        timer.start()
+        ax.clear()
+        ax.plot(range(n_points), signal[i:i + n_points], color='r')
+        ax.set_xlabel("Time")
+        ax.set_ylabel("IR")
+        ax.set_title("Heartbeat")
+        fig.canvas.draw()
+        timer.stop()
+    print(f"Full redraw: {timer.stats()}")
+    plt.close(fig)
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.set_xlabel("Time")
+    ax.set_ylabel("IR")
+    ax.set_title("Heartbeat")
+    plot = BlittedTracePlot(ax, n_points)
+    for i in range(n_frames):
+        plot.update(signal[i:i + n_points])
+    print(f"Blitted: {plot.timer.stats()}, full redraws: {plot.full_redraws}")
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    _benchmark()
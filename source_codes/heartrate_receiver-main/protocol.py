@@ -0,0 +1,386 @@
+"""
+Binary wire protocol between BluetoothSender and BluetoothReceiver.
+
+Each frame is length-prefixed so the receiver can split a byte stream into
+frames regardless of how the transport fragments or coalesces reads.
+All fields are little endian:
+
+    uint32   length of the rest of the frame
+    2s       magic b"HR"
+    uint8    protocol version
+    uint8    sample encoding (ENCODING_*)
+    uint8    flags
+    uint16   device id
+    uint32   sequence number
+    uint32   index of the first sample in the sender's sample stream
+    float64  timestamp of the first sample in seconds
+    float32  bpm, ipm, hrstd, rmssd, spo2 (NaN when not available)
+    uint16   number of samples
+    ...      sample block
+
+ENCODING_ZIGZAG_VARINT frames carry raw sensor samples instead of a
+filtered window, for a receiver computing the metrics itself (hub mode).
+Their sample block is:
+
+    uint8    number of channels (2: red, IR)
+    float32  sampling frequency in Hz
+    ...      per channel, the zigzag encoded differences between
+             successive samples (the first one from 0) as varints
+
+Consecutive PPG samples differ by little, so most differences fit in one
+or two bytes instead of the three of an 18-bit sample.
+
+The same file is used by the sender and the receiver.
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b"HR"
+VERSION = 2  # 2 added spo2
+
+# Sample block encodings
+ENCODING_FLOAT32 = 0  # n float32 values
+ENCODING_DELTA_INT16 = 1  # float32 scale, int32 first value, n - 1 int16 deltas
+ENCODING_ZIGZAG_VARINT = 2  # Raw integer channels, lossless
+
+# Flag bits
+FLAG_REPLAY = 0x01  # Frame sent again after a reconnect
+
+LENGTH = struct.Struct("<I")
+HEADER = struct.Struct("<2sBBBHIIdfffffH")
+FLAGS_OFFSET = LENGTH.size + 4  # After the length, magic, version and encoding
+DELTA_HEADER = struct.Struct("<fi")
+RAW_HEADER = struct.Struct("<Bf")
+
+# Frames larger than this can only come from a corrupt stream
+MAX_FRAME_SIZE = 1 << 20
+
+INT16_MAX = np.iinfo(np.int16).max
+INT32_MAX = np.iinfo(np.int32).max
+
+
+class ProtocolError(ValueError):
+    """
+    Raised when the received bytes are not a valid frame.
+
+    Raised by FrameDecoder.feed(), `frames` holds the frames decoded from
+    the same bytes before the invalid one.
+    """
+
+    def __init__(self, message, frames=()):
+        super().__init__(message)
+        self.frames = list(frames)
+
+
+def _encode_delta_int16(samples, scale):
+    """
+    Quantize the samples to 1 / scale and encode them as int16 deltas.
+    The scale is lowered if a delta does not fit in an int16.
+
+    Returns:
+        bytes: The sample block, or None if the samples cannot be encoded.
+    """
+    if len(samples) == 0:
+        return DELTA_HEADER.pack(scale, 0)
+    max_delta = np.max(np.abs(np.diff(samples))) if len(samples) > 1 else 0.0
+    if max_delta * scale > INT16_MAX:
+        scale = INT16_MAX / max_delta * 0.99
+
+    quantized = np.round(samples * scale).astype(np.int64)
+    deltas = np.diff(quantized)
+    if abs(quantized[0]) > INT32_MAX or np.any(np.abs(deltas) > INT16_MAX):
+        return None
+
+    return DELTA_HEADER.pack(scale, quantized[0]) + deltas.astype("<i2").tobytes()
+
+
+def zigzag_varint_encode(values):
+    """
+    Encode signed integers as zigzag varints: 0, -1, 1, -2, ... map to
+    0, 1, 2, 3, ..., then each value is written 7 bits per byte, low bits
+    first, the top bit set on every byte but the last.
+
+    Args:
+        values (np.array): Integers, at most 63 bits.
+
+    Returns:
+        bytes: The encoded values.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+    # Bytes per value, at least one
+    n_bytes = np.ones(len(zigzag), dtype=np.int64)
+    for k in range(1, 10):
+        n_bytes += zigzag >= np.uint64(1 << (7 * k))
+    width = int(n_bytes.max()) if len(zigzag) else 1
+
+    shifts = np.arange(width, dtype=np.uint64) * np.uint64(7)
+    groups = ((zigzag[:, np.newaxis] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+    position = np.arange(width)
+    groups[position < n_bytes[:, np.newaxis] - 1] |= 0x80
+    # Row-major order keeps the bytes of each value together and in order
+    return groups[position < n_bytes[:, np.newaxis]].tobytes()
+
+
+def zigzag_varint_decode(data, count):
+    """
+    Decode `count` values written by zigzag_varint_encode.
+
+    Returns:
+        tuple: (np.array of int64 values, number of bytes read)
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if len(ends) < count:
+        raise ProtocolError(f"Expected {count} varints, found {len(ends)}")
+    size = int(ends[count - 1]) + 1 if count else 0
+    raw = raw[:size]
+
+    starts = np.concatenate(([0], ends[:count - 1] + 1)) if count else np.zeros(0, dtype=np.int64)
+    value_of = np.repeat(np.arange(count), ends[:count] + 1 - starts)
+    position = np.arange(size) - starts[value_of]
+    if size and position.max() > 9:
+        raise ProtocolError("Varint longer than 10 bytes")
+    parts = (raw & 0x7F).astype(np.uint64) << (position * 7).astype(np.uint64)
+    zigzag = np.zeros(count, dtype=np.uint64)
+    np.bitwise_or.at(zigzag, value_of, parts)
+    values = (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+    return values, size
+
+
+def encode_frame(samples, bpm=np.nan, ipm=np.nan, hrstd=np.nan, rmssd=np.nan, spo2=np.nan,
+                 seq=0, start_index=0, timestamp=0.0, device_id=0,
+                 encoding=ENCODING_DELTA_INT16, scale=100.0, flags=0):
+    """
+    Encode metrics and a block of samples as a frame.
+
+    Args:
+        samples (np.array): Samples to send, e.g. the filtered IR window.
+        bpm, ipm, hrstd, rmssd (float): Metrics, NaN or None when not available.
+        spo2 (float): SpO2 in percent, NaN or None when not available.
+        seq (int): Sequence number of the frame.
+        start_index (int): Index of the first sample in the sender's stream.
+        timestamp (float): Timestamp of the first sample in seconds.
+        device_id (int): Id of the sending device.
+        encoding (int): ENCODING_DELTA_INT16 (falls back to float32 if the
+            samples do not fit) or ENCODING_FLOAT32.
+        scale (float): Quantization scale of the delta encoding, 100 keeps
+            two decimals.
+        flags (int): Flag bits.
+
+    Returns:
+        bytes: The length-prefixed frame.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+
+    block = None
+    if encoding == ENCODING_DELTA_INT16:
+        block = _encode_delta_int16(samples, scale)
+    if block is None:
+        encoding = ENCODING_FLOAT32
+        block = samples.astype("<f4").tobytes()
+
+    metrics = [np.nan if v is None else v for v in (bpm, ipm, hrstd, rmssd, spo2)]
+    header = HEADER.pack(MAGIC, VERSION, encoding, flags, device_id & 0xFFFF,
+                         seq & 0xFFFFFFFF, start_index & 0xFFFFFFFF, timestamp,
+                         *metrics, len(samples))
+    return LENGTH.pack(len(header) + len(block)) + header + block
+
+
+def encode_raw_frame(red_ir, fs, seq=0, start_index=0, timestamp=0.0, device_id=0, flags=0):
+    """
+    Encode a block of raw sensor samples as a frame, losslessly.
+
+    Args:
+        red_ir (np.array): Integer samples of shape (channels, n), e.g. red and IR.
+        fs (float): Sampling frequency in Hz.
+        seq (int): Sequence number of the frame.
+        start_index (int): Index of the first sample in the sender's stream.
+        timestamp (float): Timestamp of the first sample in seconds.
+        device_id (int): Id of the sending device.
+        flags (int): Flag bits.
+
+    Returns:
+        bytes: The length-prefixed frame, without metrics.
+    """
+    red_ir = np.asarray(red_ir, dtype=np.int64)
+    if red_ir.ndim == 1:
+        red_ir = red_ir[np.newaxis, :]
+    channels, n = red_ir.shape
+    deltas = np.diff(red_ir, axis=1, prepend=0)
+    block = RAW_HEADER.pack(channels, fs) + zigzag_varint_encode(deltas.ravel())
+
+    header = HEADER.pack(MAGIC, VERSION, ENCODING_ZIGZAG_VARINT, flags, device_id & 0xFFFF,
+                         seq & 0xFFFFFFFF, start_index & 0xFFFFFFFF, timestamp,
+                         np.nan, np.nan, np.nan, np.nan, np.nan, n)
+    return LENGTH.pack(len(header) + len(block)) + header + block
+
+
+def set_flags(frame, flags):
+    """
+    Return a copy of an encoded frame with the given flag bits set.
+
+    Args:
+        frame (bytes): Length-prefixed frame.
+        flags (int): Flag bits to set.
+    """
+    frame = bytearray(frame)
+    frame[FLAGS_OFFSET] |= flags
+    return bytes(frame)
+
+
+def decode_frame(body):
+    """
+    Decode a frame without its length prefix.
+
+    Args:
+        body (bytes): The frame.
+
+    Returns:
+        dict: The frame's fields, the samples as "raw_value" ((channels, n)
+        integers for ENCODING_ZIGZAG_VARINT, which also gives "fs") and the
+        frame's size on the wire as "size".
+    """
+    if len(body) < HEADER.size:
+        raise ProtocolError(f"Frame too short: {len(body)} bytes")
+    (magic, version, encoding, flags, device_id, seq, start_index, timestamp,
+     bpm, ipm, hrstd, rmssd, spo2, n_samples) = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad magic: {magic!r}")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+
+    block = memoryview(body)[HEADER.size:]
+    # The block must hold the samples the header announces
+    if encoding == ENCODING_FLOAT32:
+        needed = 4 * n_samples
+    elif encoding == ENCODING_DELTA_INT16:
+        needed = DELTA_HEADER.size + 2 * max(n_samples - 1, 0)
+    elif encoding == ENCODING_ZIGZAG_VARINT:
+        needed = RAW_HEADER.size + n_samples  # At least one byte per varint
+    else:
+        raise ProtocolError(f"Unknown sample encoding: {encoding}")
+    if len(block) < needed:
+        raise ProtocolError(f"Sample block too short: {len(block)} bytes for "
+                            f"{n_samples} samples, {needed} needed")
+
+    fs = None
+    if encoding == ENCODING_FLOAT32:
+        samples = np.frombuffer(block, dtype="<f4", count=n_samples).astype(np.float64)
+    elif encoding == ENCODING_DELTA_INT16:
+        scale, first = DELTA_HEADER.unpack_from(block)
+        quantized = np.empty(n_samples, dtype=np.int64)
+        if n_samples:
+            quantized[0] = first
+            deltas = np.frombuffer(block, dtype="<i2", count=n_samples - 1,
+                                   offset=DELTA_HEADER.size)
+            np.cumsum(deltas, out=quantized[1:])
+            quantized[1:] += first
+        samples = quantized / scale
+    elif encoding == ENCODING_ZIGZAG_VARINT:
+        channels, fs = RAW_HEADER.unpack_from(block)
+        deltas, _ = zigzag_varint_decode(block[RAW_HEADER.size:], channels * n_samples)
+        samples = np.cumsum(deltas.reshape(channels, n_samples), axis=1)
+
+    return {
+        "device_id": device_id,
+        "seq": seq,
+        "start_index": start_index,
+        "timestamp": timestamp,
+        "flags": flags,
+        "encoding": encoding,
+        "size": LENGTH.size + len(body),
+        "raw_value": samples,
+        "fs": fs,
+        "bpm": bpm,
+        "ipm": ipm,
+        "hrstd": hrstd,
+        "rmssd": rmssd,
+        "spo2": spo2,
+    }
+
+
+class FrameDecoder:
+    """
+    Streaming decoder that splits received bytes into frames.
+
+    Partial frames are kept until the rest arrives, and several frames
+    received in one read are all returned. An invalid frame raises
+    ProtocolError with the frames decoded before it; the stream cannot be
+    resynchronized, so the received bytes are dropped and the connection
+    should be closed (the sender replays what was lost once it reconnects).
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Add received bytes.
+
+        Args:
+            data (bytes): Bytes as returned by recv().
+
+        Returns:
+            list: The frames completed by these bytes, as dicts.
+
+        Raises:
+            ProtocolError: The bytes are not a valid frame stream, with the
+                frames decoded before the invalid one in `frames`.
+        """
+        self._buffer += data
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= LENGTH.size:
+            (length,) = LENGTH.unpack_from(self._buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                self._buffer.clear()
+                raise ProtocolError(f"Frame length {length} exceeds {MAX_FRAME_SIZE}", frames)
+            end = offset + LENGTH.size + length
+            if end > len(self._buffer):
+                break
+            try:
+                frames.append(decode_frame(bytes(self._buffer[offset + LENGTH.size:end])))
+            except (ValueError, struct.error) as e:  # ProtocolError included
+                # The stream cannot be resynchronized, drop what was received
+                self._buffer.clear()
+                raise ProtocolError(f"Invalid frame: {e}", frames) from e
+            offset = end
+        del self._buffer[:offset]
+        return frames
+
+
+class SequenceFilter:
+    """
+    Drops frames already received, e.g. replayed after a reconnect, by
+    comparing their sequence number with the newest one seen per device.
+    """
+
+    def __init__(self):
+        self.last_seq = {}  # Newest sequence number per device id
+        self.duplicates = 0
+
+    def accept(self, frame):
+        """
+        Args:
+            frame (dict): Decoded frame.
+
+        Returns:
+            bool: True if the frame is new.
+        """
+        device_id = frame["device_id"]
+        seq = frame["seq"]
+        last = self.last_seq.get(device_id)
+
+        # Sequence numbers restart at 0 when the sender restarts
+        restarted = seq == 0 and not frame["flags"] & FLAG_REPLAY
+        # Serial number comparison, sequence numbers wrap at 2 ** 32
+        newer = 0 < (seq - last) % (1 << 32) < (1 << 31) if last is not None else True
+
+        if not (newer or restarted):
+            self.duplicates += 1
+            return False
+        self.last_seq[device_id] = seq
+        return True
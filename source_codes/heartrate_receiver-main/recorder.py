@@ -0,0 +1,250 @@
+"""
+Append-only recording of raw samples and metrics.
+
+A recording is a directory with three files of fixed-size little endian
+records, so they can be memory-mapped and sliced without parsing:
+
+    samples.bin   SAMPLE_DTYPE: timestamp, red and IR of every sample
+    metrics.bin   METRICS_DTYPE: timestamp and metrics of every update
+    index.bin     INDEX_DTYPE: first sample and time range of every chunk
+    format        FORMAT_VERSION of the record layout
+
+Recordings without a format file are from before SpO2 was recorded
+(METRICS_DTYPE_V1). They are read with a NaN SpO2, and their metrics
+file is converted when a Recorder appends to them.
+
+Samples are buffered in memory and written a chunk at a time, so the
+sender pays one write() per chunk (about 40 s at 25 Hz) instead of one
+per sample. A crash loses at most the unwritten chunk; a partially
+written record is dropped when the recording is opened again.
+"""
+import os
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype([("t", "<f8"), ("red", "<u4"), ("ir", "<u4")])
+METRICS_DTYPE = np.dtype([("t", "<f8"), ("bpm", "<f4"), ("ipm", "<f4"),
+                          ("hrstd", "<f4"), ("rmssd", "<f4"), ("spo2", "<f4")])
+METRICS_DTYPE_V1 = np.dtype([("t", "<f8"), ("bpm", "<f4"), ("ipm", "<f4"),
+                             ("hrstd", "<f4"), ("rmssd", "<f4")])
+INDEX_DTYPE = np.dtype([("start", "<u8"), ("t_first", "<f8"), ("t_last", "<f8")])
+
+SAMPLES_FILE = "samples.bin"
+METRICS_FILE = "metrics.bin"
+INDEX_FILE = "index.bin"
+FORMAT_FILE = "format"
+FORMAT_VERSION = 2
+
+
+def _format_version(path):
+    """Layout version of a recording, FORMAT_VERSION for a new one."""
+    try:
+        with open(os.path.join(path, FORMAT_FILE)) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        if any(os.path.exists(os.path.join(path, name))
+               for name in (SAMPLES_FILE, METRICS_FILE, INDEX_FILE)):
+            return 1
+        return FORMAT_VERSION
+
+
+def _upgrade_metrics(records):
+    """Copy METRICS_DTYPE_V1 records to METRICS_DTYPE, with a NaN SpO2."""
+    metrics = np.zeros(len(records), dtype=METRICS_DTYPE)
+    for name in METRICS_DTYPE_V1.names:
+        metrics[name] = records[name]
+    metrics["spo2"] = np.nan
+    return metrics
+
+
+def _upgrade(path):
+    """Convert the metrics file of a version 1 recording and mark it as current."""
+    metrics_path = os.path.join(path, METRICS_FILE)
+    if os.path.exists(metrics_path):
+        metrics = _upgrade_metrics(_memmap(metrics_path, METRICS_DTYPE_V1))
+        tmp_path = metrics_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(metrics.tobytes())
+        os.replace(tmp_path, metrics_path)
+    _write_format(path)
+
+
+def _write_format(path):
+    with open(os.path.join(path, FORMAT_FILE), "w") as f:
+        f.write(f"{FORMAT_VERSION}\n")
+
+
+def _open_append(path, dtype):
+    """
+    Open a record file for appending, dropping a trailing partial record.
+
+    Returns:
+        tuple: (file, number of complete records)
+    """
+    f = open(path, "ab")
+    size = f.seek(0, os.SEEK_END)
+    if size % dtype.itemsize:
+        f.truncate(size - size % dtype.itemsize)
+        f.seek(0, os.SEEK_END)
+    return f, size // dtype.itemsize
+
+
+class Recorder:
+    """Writes a recording, appending to it if it already exists."""
+
+    def __init__(self, path, chunk_size=1024):
+        """
+        Initialize the Recorder object.
+
+        Args:
+            path (str): Directory of the recording.
+            chunk_size (int): Number of samples written at once.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        if _format_version(path) == 1:
+            _upgrade(path)
+        elif not os.path.exists(os.path.join(path, FORMAT_FILE)):
+            _write_format(path)
+        self._samples_file, self.samples_written = _open_append(
+            os.path.join(path, SAMPLES_FILE), SAMPLE_DTYPE)
+        self._metrics_file, self.metrics_written = _open_append(
+            os.path.join(path, METRICS_FILE), METRICS_DTYPE)
+        self._index_file, _ = _open_append(os.path.join(path, INDEX_FILE), INDEX_DTYPE)
+
+        # Preallocated chunk and metrics record
+        self._chunk = np.zeros(chunk_size, dtype=SAMPLE_DTYPE)
+        self._filled = 0
+        self._metrics = np.zeros(1, dtype=METRICS_DTYPE)
+        self._index = np.zeros(1, dtype=INDEX_DTYPE)
+
+    def append_samples(self, red_ir, timestamps):
+        """
+        Add a block of samples.
+
+        Args:
+            red_ir (np.array): Samples of shape (2, n), red in row 0 and IR in row 1.
+            timestamps (np.array): Timestamp of each sample in seconds.
+        """
+        n = len(timestamps)
+        done = 0
+        while done < n:
+            count = min(n - done, len(self._chunk) - self._filled)
+            chunk = self._chunk[self._filled:self._filled + count]
+            chunk["t"] = timestamps[done:done + count]
+            chunk["red"] = red_ir[0, done:done + count]
+            chunk["ir"] = red_ir[1, done:done + count]
+            self._filled += count
+            done += count
+            if self._filled == len(self._chunk):
+                self._write_chunk()
+
+    def append_metrics(self, timestamp, bpm, ipm, hrstd, rmssd, spo2=None):
+        """
+        Add a metrics update. Updates are rare, they are written right away.
+
+        Args:
+            timestamp (float): Timestamp of the update in seconds.
+            bpm, ipm, hrstd, rmssd, spo2 (float): Metrics, NaN or None when not available.
+        """
+        values = [np.nan if v is None else v for v in (bpm, ipm, hrstd, rmssd, spo2)]
+        self._metrics[0] = (timestamp, *values)
+        self._metrics_file.write(self._metrics.tobytes())
+        self.metrics_written += 1
+
+    def _write_chunk(self):
+        if not self._filled:
+            return
+        chunk = self._chunk[:self._filled]
+        self._index[0] = (self.samples_written, chunk["t"][0], chunk["t"][-1])
+        self._samples_file.write(chunk.tobytes())
+        self._index_file.write(self._index.tobytes())
+        self.samples_written += self._filled
+        self._filled = 0
+
+    def flush(self):
+        """Write the buffered samples and flush the files to the OS."""
+        self._write_chunk()
+        for f in (self._samples_file, self._metrics_file, self._index_file):
+            f.flush()
+
+    def close(self):
+        """Flush and close the recording."""
+        self.flush()
+        for f in (self._samples_file, self._metrics_file, self._index_file):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _memmap(path, dtype):
+    """Memory-map the complete records of a file, empty if there are none."""
+    n = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+
+
+class Recording:
+    """
+    Read-only view of a recording. Nothing is loaded until it is sliced,
+    and every slice is a view of the memory-mapped files.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Directory of the recording.
+        """
+        self.path = path
+        self.samples = _memmap(os.path.join(path, SAMPLES_FILE), SAMPLE_DTYPE)
+        if _format_version(path) == 1:
+            # Converted in memory, the recording is left untouched
+            self.metrics = _upgrade_metrics(
+                _memmap(os.path.join(path, METRICS_FILE), METRICS_DTYPE_V1))
+        else:
+            self.metrics = _memmap(os.path.join(path, METRICS_FILE), METRICS_DTYPE)
+        self.index = _memmap(os.path.join(path, INDEX_FILE), INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _sample_bounds(self, t0, t1):
+        """Indices of the first sample at or after t0 and the first after t1."""
+        # The index narrows the search to the chunks overlapping the range
+        first_chunk = np.searchsorted(self.index["t_last"], t0, side="left")
+        last_chunk = np.searchsorted(self.index["t_first"], t1, side="right")
+        starts = self.index["start"]
+        # Samples after the last indexed chunk (a crash between two writes) are searched too
+        lo = int(starts[min(first_chunk, len(starts) - 1)]) if len(starts) else 0
+        hi = int(starts[last_chunk]) if last_chunk < len(starts) else len(self.samples)
+        t = self.samples["t"][lo:hi]
+        return lo + np.searchsorted(t, t0, side="left"), lo + np.searchsorted(t, t1, side="right")
+
+    def time_range(self, t0, t1):
+        """
+        Samples with timestamps in [t0, t1].
+
+        Args:
+            t0, t1 (float): Time range in seconds.
+
+        Returns:
+            np.array: Zero-copy view of SAMPLE_DTYPE records.
+        """
+        lo, hi = self._sample_bounds(t0, t1)
+        return self.samples[lo:hi]
+
+    def metrics_range(self, t0, t1):
+        """
+        Metrics updates with timestamps in [t0, t1].
+
+        Returns:
+            np.array: METRICS_DTYPE records, a zero-copy view unless the
+            recording is in the version 1 layout.
+        """
+        t = self.metrics["t"]
+        return self.metrics[np.searchsorted(t, t0, side="left"):np.searchsorted(t, t1, side="right")]
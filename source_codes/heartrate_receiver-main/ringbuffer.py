@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity, preallocated ring buffer of samples.
+
+    Every sample is written twice (at `i` and `i + capacity`), so the newest
+    `n` samples are always contiguous and can be handed out as a zero-copy
+    view instead of being reassembled on every read.
+    """
+
+    def __init__(self, capacity, channels=1, dtype=np.uint32):
+        """
+        Initialize the RingBuffer object.
+
+        Args:
+            capacity (int): Number of samples kept per channel.
+            channels (int): Number of channels (e.g. 2 for red and IR).
+            dtype: NumPy dtype of the samples.
+        """
+        self.capacity = capacity
+        self.channels = channels
+        self.total = 0  # Number of samples ever written
+        self._data = np.zeros((channels, 2 * capacity), dtype=dtype)
+        self._head = 0  # Next write position in [0, capacity)
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def extend(self, block):
+        """
+        Append a block of samples.
+
+        Args:
+            block (np.array): Samples of shape (channels, n), or (n,) for a
+                single channel.
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[np.newaxis, :]
+        n = block.shape[1]
+        self.total += n
+
+        # Only the newest `capacity` samples can be kept
+        if n > self.capacity:
+            block = block[:, n - self.capacity:]
+            n = self.capacity
+
+        written = 0
+        while written < n:
+            count = min(n - written, self.capacity - self._head)
+            chunk = block[:, written:written + count]
+            self._data[:, self._head:self._head + count] = chunk
+            self._data[:, self._head + self.capacity:self._head + self.capacity + count] = chunk
+            self._head = (self._head + count) % self.capacity
+            written += count
+
+    def latest(self, n=None):
+        """
+        Return the newest `n` samples as a zero-copy view.
+
+        The view is only valid until `capacity - n` more samples are written;
+        copy it if it has to outlive that.
+
+        Args:
+            n (int): Number of samples, defaults to all buffered samples.
+
+        Returns:
+            np.array: View of shape (channels, n), or (n,) for a single channel.
+        """
+        n = len(self) if n is None else min(n, len(self))
+        stop = self._head + self.capacity
+        view = self._data[:, stop - n:stop]
+        return view[0] if self.channels == 1 else view
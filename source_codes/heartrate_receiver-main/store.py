@@ -0,0 +1,153 @@
+"""
+Receiver-side history of samples and metrics per device.
+
+The network thread writes every received frame into preallocated ring
+buffers; the GUI takes consistent snapshots without locking. Writes are
+guarded by a sequence counter (a seqlock): it is odd while a write is in
+progress, and a reader retries if the counter changed while it copied.
+The set of devices is guarded by a lock, the GUI lists them with
+SignalStore.device_list() rather than iterating the dict.
+"""
+import threading
+from time import sleep
+
+import numpy as np
+
+import protocol
+from ringbuffer import RingBuffer
+
+# Rows of the metrics history
+METRICS = ["timestamp", "bpm", "ipm", "hrstd", "rmssd", "spo2"]
+
+
+class DeviceStore:
+    """Samples and metrics history of one device."""
+
+    def __init__(self, device_id, sample_capacity=1500, metrics_capacity=1024):
+        """
+        Initialize the DeviceStore object.
+
+        Args:
+            device_id (int): Id of the sending device.
+            sample_capacity (int): Number of samples kept (60 s at 25 Hz).
+            metrics_capacity (int): Number of metrics updates kept.
+        """
+        self.device_id = device_id
+        self.samples = RingBuffer(sample_capacity, dtype=np.float64)
+        self.metrics = RingBuffer(metrics_capacity, channels=len(METRICS), dtype=np.float64)
+        self.next_index = None  # Stream index of the next new sample
+        self.frames = 0
+        self._version = 0
+        self._row = np.empty((len(METRICS), 1))
+
+    def write(self, frame):
+        """
+        Add a frame. Frames carry overlapping windows, only the samples
+        past the last stored one are appended; a gap in the stream is
+        filled with NaN.
+
+        Args:
+            frame (dict): Decoded frame.
+        """
+        samples = frame["raw_value"]
+        start = frame["start_index"]
+        restarted = frame["seq"] == 0 and not frame["flags"] & protocol.FLAG_REPLAY
+        if self.next_index is None or restarted:
+            self.next_index = start
+
+        self._version += 1  # Odd: write in progress
+        try:
+            if start > self.next_index:
+                gap = min(start - self.next_index, self.samples.capacity)
+                self.samples.extend(np.full(gap, np.nan))
+                self.next_index = start
+            new = samples[self.next_index - start:]
+            if len(new):
+                self.samples.extend(new)
+                self.next_index += len(new)
+
+            self._row[:, 0] = (frame["timestamp"], frame["bpm"], frame["ipm"],
+                               frame["hrstd"], frame["rmssd"], frame["spo2"])
+            self.metrics.extend(self._row)
+            self.frames += 1
+        finally:
+            self._version += 1
+
+    def snapshot(self, n_samples=None, n_metrics=None):
+        """
+        Copy the newest samples and metrics, consistent with each other.
+
+        Args:
+            n_samples (int): Number of samples, defaults to all stored.
+            n_metrics (int): Number of metrics updates, defaults to all stored.
+
+        Returns:
+            dict: "samples" (n,), "metrics" (len(METRICS), m) and the
+            latest value of each metric, NaN if nothing was received yet.
+        """
+        while True:
+            version = self._version
+            if version % 2:
+                sleep(0)  # Let the writer finish
+                continue
+            samples = self.samples.latest(n_samples).copy()
+            metrics = self.metrics.latest(n_metrics).copy()
+            if self._version == version:
+                break
+
+        snapshot = {"device_id": self.device_id, "samples": samples, "metrics": metrics}
+        for i, name in enumerate(METRICS):
+            snapshot[name] = metrics[i, -1] if metrics.shape[1] else np.nan
+        return snapshot
+
+
+class SignalStore:
+    """DeviceStore of every device, created as their frames arrive."""
+
+    def __init__(self, sample_capacity=1500, metrics_capacity=1024):
+        """
+        Args:
+            sample_capacity (int): Number of samples kept per device.
+            metrics_capacity (int): Number of metrics updates kept per device.
+        """
+        self.sample_capacity = sample_capacity
+        self.metrics_capacity = metrics_capacity
+        self.devices = {}  # Device id -> DeviceStore, insert under _lock
+        self.raw_dropped = 0  # Raw frames received without a Hub
+        self._lock = threading.Lock()
+
+    def device(self, device_id):
+        """Get the store of a device, creating it if needed."""
+        store = self.devices.get(device_id)
+        if store is None:
+            with self._lock:
+                store = self.devices.setdefault(
+                    device_id,
+                    DeviceStore(device_id, self.sample_capacity, self.metrics_capacity))
+        return store
+
+    def device_list(self):
+        """
+        List the stores of all devices, safe to call while another thread
+        writes frames.
+
+        Returns:
+            list: DeviceStore of every device, in the order they appeared.
+        """
+        with self._lock:
+            return list(self.devices.values())
+
+    def write(self, frame):
+        """
+        Add a frame to its device's store. Can be used as the on_frame
+        callback of AsyncReceiver.
+
+        Raw frames of hub-mode senders carry no metrics, they are dropped:
+        a Hub computes them.
+        """
+        if frame["encoding"] == protocol.ENCODING_ZIGZAG_VARINT:
+            if not self.raw_dropped:
+                print(f"Dropped raw frames of device {frame['device_id']}, enable hub mode")
+            self.raw_dropped += 1
+            return
+        self.device(frame["device_id"]).write(frame)
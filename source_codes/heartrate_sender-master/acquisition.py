@@ -0,0 +1,287 @@
+"""
+Acquisition decoupled from processing and transmission.
+
+A dedicated reader thread only waits for the MAX30102 interrupt and
+drains the FIFO; every other step runs in its own stage thread, and the
+stages are connected by bounded queues. A slow filter, a full radio
+queue or a disk stall then delays its own stage instead of the sensor,
+whose FIFO holds only 32 samples (1.3 s at 25 Hz).
+
+The reader never blocks on its output queue: if processing falls that
+far behind, the oldest block is dropped and counted, and its samples are
+added to the `lost` count of the block after it so the stream indices
+stay aligned downstream. The counters of every queue and stage show
+where back-pressure builds up. A stage that raises closes both its
+queues and stops the pipeline.
+
+Example:
+    pipeline = Pipeline(sensor, [("process", process), ("transmit", transmit)])
+    pipeline.start()
+    print(pipeline.stats())
+"""
+import threading
+from collections import deque
+from time import monotonic
+
+
+class StageQueue:
+    """Bounded queue between two stages, with back-pressure counters."""
+
+    def __init__(self, name, maxsize=64, block=True, on_drop=None):
+        """
+        Initialize the StageQueue object.
+
+        Args:
+            name (str): Name used in the stats.
+            maxsize (int): Maximum number of items waiting.
+            block (bool): When full, make put() wait (back-pressure on the
+                producer) instead of dropping the oldest item.
+            on_drop (callable): Called as on_drop(dropped, next) when an
+                item is dropped, returns the item replacing `next`, the
+                item after the dropped one.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.block = block
+        self.on_drop = on_drop
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.high_water = 0  # Largest number of items waiting
+        self.blocked_s = 0.0  # Time producers spent waiting for room
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """Add an item, waiting or dropping the oldest one if the queue is full."""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.block:
+                    start = monotonic()
+                    self._cond.wait_for(lambda: len(self._items) < self.maxsize or self._closed)
+                    self.blocked_s += monotonic() - start
+                else:
+                    dropped = self._items.popleft()
+                    self.dropped += 1
+                    if self.on_drop is not None:
+                        if self._items:
+                            self._items[0] = self.on_drop(dropped, self._items[0])
+                        else:
+                            item = self.on_drop(dropped, item)
+            if self._closed:
+                return
+            self._items.append(item)
+            self.put_count += 1
+            self.high_water = max(self.high_water, len(self._items))
+            self._cond.notify_all()
+
+    def get(self):
+        """
+        Remove the oldest item, waiting for one.
+
+        Returns:
+            The item, or None once the queue is closed and empty.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self.get_count += 1
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Wake up the waiting threads; get() returns None once the queue is empty."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "put": self.put_count,
+            "got": self.get_count,
+            "dropped": self.dropped,
+            "depth": len(self._items),
+            "high_water": self.high_water,
+            "blocked_s": round(self.blocked_s, 3),
+        }
+
+
+def carry_lost(dropped, next_block):
+    """
+    on_drop of the reader's queue: the samples of a dropped block, and the
+    ones lost before it, are lost before the next block.
+    """
+    timestamps, red_ir, lost = next_block
+    return timestamps, red_ir, lost + dropped[1].shape[1] + dropped[2]
+
+
+class SensorReader(threading.Thread):
+    """
+    Thread that waits for the sensor's interrupts and drains its FIFO.
+
+    Every block is queued as (timestamps, samples, lost): the monotonic
+    time of each sample, the samples and the number of samples lost to
+    FIFO overflow before them. The arrays are copied out of the driver's
+    ring buffers so they stay valid while queued.
+    """
+
+    def __init__(self, sensor, queue):
+        """
+        Args:
+            sensor (MAX30102): The sensor, in burst mode to drain once per interrupt.
+            queue (StageQueue): Output queue, should not block.
+        """
+        super().__init__(name="sensor-reader", daemon=True)
+        self.sensor = sensor
+        self.queue = queue
+        self.running = False
+        self.blocks = 0
+        self.samples = 0
+        self.max_drain_s = 0.0  # Longest time between an interrupt and the block being queued
+        self.error = None
+
+    def run(self):
+        self.running = True
+        try:
+            while self.running:
+                # Blocks until the next interrupt
+                event = self.sensor.int_line.event_read()
+                start = monotonic()
+                self.sensor.read_fifo_block(event)
+                red_ir, timestamps, lost = self.sensor.take_unread(timed=True)
+                self.queue.put((timestamps.copy(), red_ir.copy(), lost))
+                self.max_drain_s = max(self.max_drain_s, monotonic() - start)
+                self.blocks += 1
+                self.samples += red_ir.shape[1]
+        except Exception as e:
+            # E.g. the end of a replayed recording
+            print(f"Sensor reader stopped: {e!r}")
+            self.error = e
+        finally:
+            self.running = False
+            self.queue.close()
+
+    def stop(self):
+        """Stop after the next interrupt."""
+        self.running = False
+
+    def stats(self):
+        return {
+            "blocks": self.blocks,
+            "samples": self.samples,
+            "max_drain_ms": round(self.max_drain_s * 1000, 3),
+            "sensor": self.sensor.stats(),
+        }
+
+
+class Stage(threading.Thread):
+    """Thread applying a function to every item of its input queue."""
+
+    def __init__(self, name, func, inbox, outbox=None):
+        """
+        Args:
+            name (str): Name used in the stats.
+            func (callable): Called with each item; a result other than
+                None is put in `outbox`.
+            inbox (StageQueue): Input queue.
+            outbox (StageQueue): Output queue of the results, if any.
+        """
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.busy_s = 0.0
+        self._started_at = None
+        self.error = None
+
+    def run(self):
+        self._started_at = monotonic()
+        try:
+            while True:
+                item = self.inbox.get()
+                if item is None:
+                    break
+                start = monotonic()
+                result = self.func(item)
+                self.busy_s += monotonic() - start
+                self.processed += 1
+                if self.outbox is not None and result is not None:
+                    self.outbox.put(result)
+        except Exception as e:
+            print(f"Stage {self.name} stopped: {e!r}")
+            self.error = e
+        finally:
+            # Also unblock the producer of a stage that failed
+            self.inbox.close()
+            if self.outbox is not None:
+                self.outbox.close()
+
+    def stats(self):
+        elapsed = monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "processed": self.processed,
+            "busy_s": round(self.busy_s, 3),
+            "utilization": round(self.busy_s / elapsed, 4) if elapsed else 0.0,
+        }
+
+
+class Pipeline:
+    """A SensorReader followed by a chain of Stages."""
+
+    def __init__(self, sensor, stages, queue_size=64):
+        """
+        Initialize the Pipeline object.
+
+        Args:
+            sensor (MAX30102): The sensor.
+            stages (list): (name, func) of every stage, in order. The first
+                one gets (timestamps, (2, n) red and IR samples, lost) items.
+            queue_size (int): Maximum number of items between two stages.
+        """
+        # The reader must never wait, later queues push back on their producer
+        self.queues = [StageQueue("acquired", queue_size, block=False, on_drop=carry_lost)]
+        self.stages = []
+        for i, (name, func) in enumerate(stages):
+            outbox = StageQueue(name, queue_size) if i < len(stages) - 1 else None
+            self.stages.append(Stage(name, func, self.queues[-1], outbox))
+            if outbox is not None:
+                self.queues.append(outbox)
+        self.reader = SensorReader(sensor, self.queues[0])
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        self.reader.start()
+
+    def stop(self, timeout=5):
+        """Stop reading and let the stages finish the queued items."""
+        self.reader.stop()
+        self.queues[0].close()
+        for stage in self.stages:
+            if stage.ident is not None:  # Started
+                stage.join(timeout)
+
+    def is_alive(self):
+        """False once every stage finished, or as soon as one of them failed."""
+        if any(stage.error is not None for stage in self.stages):
+            return False
+        return any(stage.is_alive() for stage in self.stages)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Counters of the reader, every queue and every stage.
+        """
+        return {
+            "reader": self.reader.stats(),
+            "queues": {queue.name: queue.stats() for queue in self.queues},
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+        }
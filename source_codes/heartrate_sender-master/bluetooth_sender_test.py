@@ -1,67 +1,282 @@
-import bluetooth
-import subprocess
 import atexit
+import threading
+from collections import deque
+
+import protocol
+from replay_buffer import ReplayBuffer
+from transport import Transport, make_transport
+
+# Policies of the send queue when it is full
+DROP_OLDEST = "drop-oldest"  # Drop the oldest queued message
+COALESCE = "coalesce"  # Only keep the latest message, whatever the queue size
+BLOCK = "block"  # Block the caller until there is room
 
 class BluetoothSender:
-    def __init__(self, server_address, port=1):
+    def __init__(self, server_address, port=None, device_id=0, transport="rfcomm",
+                 queue_size=32, policy=DROP_OLDEST, verbose=False, reconnect=True,
+                 backoff_initial=0.5, backoff_max=30.0, replay_seconds=30.0,
+                 spill_path=None):
         """
         Initialize the BluetoothSender object.
 
+        Messages are sent by a background writer thread fed by a bounded
+        queue, so send_data() never waits for the radio (unless the
+        policy is BLOCK). If the link drops, the writer reconnects with
+        exponential backoff and sends the frames of the last
+        `replay_seconds` again; the receiver drops the ones it already has.
+
         Args:
-            server_address (str): MAC address of the server.
-            port (int): RFCOMM port to connect to. Default is 1.
+            server_address (str): MAC address of the server, or host / socket
+                path for the TCP and Unix transports.
+            port (int): RFCOMM channel or TCP port. Default is 1 for RFCOMM.
+            device_id (int): Id of this sensor node in the sent frames.
+            transport (str or Transport): "rfcomm", "tcp" or "unix".
+            queue_size (int): Maximum number of messages waiting to be sent.
+            policy (str): DROP_OLDEST, COALESCE or BLOCK.
+            verbose (bool): Print every sent message.
+            reconnect (bool): Reconnect automatically when the link drops.
+            backoff_initial (float): First delay between reconnect attempts in seconds.
+            backoff_max (float): Maximum delay between reconnect attempts in seconds.
+            replay_seconds (float): Age of the oldest frame replayed on reconnect.
+            spill_path (str): File for frames older than `replay_seconds`
+                produced while disconnected, None to drop them.
         """
+        if policy not in (DROP_OLDEST, COALESCE, BLOCK):
+            raise ValueError(f"Unknown queue policy {policy!r}")
+        if not isinstance(transport, Transport):
+            transport = make_transport(transport, server_address, port)
+        self.transport = transport
         self.server_address = server_address
         self.port = port
+        self.device_id = device_id
+        self.seq = 0  # Sequence number of the next frame
         self.client_sock = None
 
+        self.queue_size = queue_size
+        self.policy = policy
+        self.verbose = verbose
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._writer = None
+        self._running = False
+
+        self.reconnect = reconnect
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.replay = ReplayBuffer(replay_seconds, spill_path)
+
+        # Message counters
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.reconnects = 0
+
+        # Bring the device down again at script exit
+        atexit.register(self.transport.disable)
+
     def enable_bluetooth(self):
-        """Enable the Bluetooth device."""
-        try:
-            subprocess.run(["sudo", "hciconfig", "hci0", "up"], check=True)
-            print("Bluetooth device hci0 is now up.")
-        except subprocess.CalledProcessError:
-            print("Failed to turn on Bluetooth device hci0.")
+        """Enable the Bluetooth device (no-op for TCP and Unix sockets)."""
+        self.transport.enable()
 
     def disable_bluetooth(self):
-        """Disable the Bluetooth device."""
+        """Disable the Bluetooth device (no-op for TCP and Unix sockets)."""
+        self.transport.disable()
+
+    def _open(self):
+        """Open the connection, returns True on success."""
+        try:
+            # Connect to the server using the configured transport
+            self.client_sock = self.transport.connect()
+            print(f"Connected to server at {self.transport}", flush=True)
+            return True
+        except Exception as e:
+            # Any error, e.g. an ImportError without pybluez, must not end
+            # the writer thread while frames keep being queued
+            print(f"Failed to connect to the server: {e!r}", flush=True)
+            self.client_sock = None
+            return False
+
+    def _close(self):
+        """Close the connection after an error."""
         try:
-            subprocess.run(["sudo", "hciconfig", "hci0", "down"], check=True)
-            print("Bluetooth device hci0 is now down.")
-        except subprocess.CalledProcessError:
-            print("Failed to turn off Bluetooth device hci0.")
+            self.client_sock.close()
+        except Exception:
+            pass
+        self.client_sock = None
 
     def connect(self):
-        """Establish a connection to the server."""
+        """
+        Establish a connection to the server and start the background writer.
+        With `reconnect`, the writer keeps trying if this first attempt fails.
+        """
         self.enable_bluetooth()
-        # Set up a Bluetooth RFCOMM client socket
-        self.client_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-        try:
-            # Connect to the server using the server address and port
-            self.client_sock.connect((self.server_address, self.port))
-            print(f"Connected to server at {self.server_address} on port {self.port}", flush=True)
-        except bluetooth.BluetoothError as e:
-            print(f"Failed to connect to the server: {e}")
-            self.client_sock = None
+        if not self._open() and not self.reconnect:
+            return
 
-    def send_data(self, data):
+        # Start the background writer
+        self._running = True
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def send_data(self, data, replayable=False):
         """
-        Send data to the server.
+        Queue data to be sent to the server by the background writer.
 
         Args:
-            data (str): Data to send.
+            data (str or bytes): Data to send.
+            replayable (bool): The data is a frame also kept in the replay buffer.
         """
-        if self.client_sock:
+        with self._cond:
+            if not self._running:
+                print("No active connection. Unable to send data.")
+                self.dropped += 1
+                return
+
+            if self.policy == COALESCE:
+                # Only the latest message is worth sending
+                self.dropped += len(self._queue)
+                self._queue.clear()
+            elif len(self._queue) >= self.queue_size:
+                if self.policy == BLOCK:
+                    while len(self._queue) >= self.queue_size and self._running:
+                        self._cond.wait()
+                else:
+                    self._queue.popleft()
+                    self.dropped += 1
+
+            self._queue.append((data, replayable))
+            self.queued += 1
+            self._cond.notify_all()
+
+    def _send_replay(self):
+        """Send the frames of the replay buffer again after a reconnect."""
+        frames = self.replay.frames_to_replay()
+        for frame in frames:
+            self.client_sock.sendall(protocol.set_flags(frame, protocol.FLAG_REPLAY))
+        self.replayed += len(frames)
+        print(f"Replayed {len(frames)} frames", flush=True)
+
+    def _writer_loop(self):
+        """Send queued messages until stopped and the queue is drained."""
+        backoff = self.backoff_initial
+        while True:
+            self.replay.prune(connected=self.client_sock is not None)
+
+            if self.client_sock is None:
+                with self._cond:
+                    if not self._running:
+                        return
+                if not self._open():
+                    # Wait before the next attempt, unless disconnect() is called
+                    with self._cond:
+                        self._cond.wait_for(lambda: not self._running, timeout=backoff)
+                    backoff = min(backoff * 2, self.backoff_max)
+                    continue
+                backoff = self.backoff_initial
+                self.reconnects += 1
+                try:
+                    self._send_replay()
+                except Exception as e:
+                    print(f"An error occurred while replaying data: {e}")
+                    self._close()
+                    continue
+
+            with self._cond:
+                # Wake up regularly to prune the replay buffer
+                self._cond.wait_for(lambda: self._queue or not self._running, timeout=1.0)
+                if not self._queue:
+                    if self._running:
+                        continue
+                    return
+                data, replayable = self._queue.popleft()
+                self._cond.notify_all()
+
             try:
-                self.client_sock.send(data)
-                print(f"Sent: {data}", flush=True)
+                self.client_sock.sendall(data.encode("utf-8") if isinstance(data, str) else data)
+                self.sent += 1
+                if self.verbose:
+                    if isinstance(data, str):
+                        print(f"Sent: {data}", flush=True)
+                    else:
+                        print(f"Sent: {len(data)} byte frame", flush=True)
             except Exception as e:
                 print(f"An error occurred while sending data: {e}")
-        else:
-            print("No active connection. Unable to send data.")
+                # Frames are sent again from the replay buffer after reconnecting
+                if not replayable:
+                    with self._cond:
+                        self.dropped += 1
+                if not self.reconnect:
+                    with self._cond:
+                        self._running = False
+                        self.dropped += len(self._queue)
+                        self._queue.clear()
+                    return
+                self._close()
+
+    def stats(self):
+        """
+        Return the message counters.
+
+        Returns:
+            dict: Messages queued, sent, dropped and currently waiting.
+        """
+        with self._cond:
+            return {
+                "queued": self.queued,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "pending": len(self._queue),
+                "replayed": self.replayed,
+                "reconnects": self.reconnects,
+                "spilled": self.replay.spilled,
+            }
+
+    def send_frame(self, samples, bpm, ipm, hrstd, rmssd, spo2=None, start_index=0, timestamp=0.0):
+        """
+        Send metrics and a block of samples as a binary frame.
+
+        Args:
+            samples (np.array): Samples to send, e.g. the filtered IR window.
+            bpm, ipm, hrstd, rmssd (float): Metrics, None when not available.
+            spo2 (float): SpO2 in percent, None when not available.
+            start_index (int): Index of the first sample in the sample stream.
+            timestamp (float): Timestamp of the first sample in seconds.
+        """
+        frame = protocol.encode_frame(samples, bpm, ipm, hrstd, rmssd, spo2, seq=self.seq,
+                                      start_index=start_index, timestamp=timestamp,
+                                      device_id=self.device_id)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.replay.append(frame)
+        self.send_data(frame, replayable=True)
+
+    def send_raw(self, red_ir, fs, start_index=0, timestamp=0.0):
+        """
+        Send a block of raw samples as a losslessly compressed frame, for a
+        receiver computing the metrics itself.
+
+        Args:
+            red_ir (np.array): Raw samples of shape (2, n), red and IR.
+            fs (float): Sampling frequency in Hz.
+            start_index (int): Index of the first sample in the sample stream.
+            timestamp (float): Timestamp of the first sample in seconds.
+        """
+        frame = protocol.encode_raw_frame(red_ir, fs, seq=self.seq, start_index=start_index,
+                                          timestamp=timestamp, device_id=self.device_id)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self.replay.append(frame)
+        self.send_data(frame, replayable=True)
 
     def disconnect(self):
         """Disconnect from the server and clean up."""
+        # Let the writer send what is still queued, then stop it
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._writer:
+            self._writer.join(timeout=5)
+            self._writer = None
+
         if self.client_sock:
             try:
                 self.client_sock.close()
@@ -70,14 +285,11 @@ class BluetoothSender:
                 print(f"Error while closing the socket: {e}")
         self.disable_bluetooth()
 
-# Register the disable_bluetooth function to run at script exit
-atexit.register(BluetoothSender.disable_bluetooth, BluetoothSender)
-
 # Example usage
 if __name__ == "__main__":
     # Use receiver's Bluetooth MAC address
     SERVER_ADDRESS = "2C:CF:67:04:9D:D7"
-    sender = BluetoothSender(SERVER_ADDRESS)
+    sender = BluetoothSender(SERVER_ADDRESS, verbose=True)
 
     try:
         sender.connect()
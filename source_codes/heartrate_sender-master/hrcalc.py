@@ -22,9 +22,100 @@ def calc_hr_and_ipm(ir_data):
     x = -1 * (np.array(ir_data) - ir_mean)
 
     # Apply a 4-point moving average to smooth the signal
-    for i in range(x.shape[0] - MA_SIZE):
-        x[i] = np.sum(x[i:i+MA_SIZE]) / MA_SIZE
+    x = moving_average(x, MA_SIZE)
 
+    return calc_hr_from_smoothed(x)
+
+
+# Function to calculate HR, IPM, HRSTD, and RMSSD for many windows at once
+def calc_hr_and_ipm_batch(ir_data, window_size=BUFFER_SIZE, hop=None, chunk_size=4096):
+    """
+    Apply calc_hr_and_ipm to every window of a recording in one vectorized
+    pass.
+
+    DC removal, smoothing, the peak threshold and the peak search run on a
+    whole chunk of windows at once. The interval statistics run once per
+    number of peaks (at most 15), on all windows with that many peaks, so
+    every value is bit-identical to calc_hr_and_ipm.
+
+    Parameters:
+        ir_data (np.array): 1-D recording, split into windows of `window_size`
+            samples every `hop` samples, or a 2-D stack of windows of at
+            least BUFFER_SIZE samples.
+        window_size (int): Window length for a 1-D recording.
+        hop (int): Samples between windows for a 1-D recording, defaults to window_size.
+        chunk_size (int): Number of windows processed at once, bounds the memory used.
+
+    Returns:
+        hr, ipm, hrstd, rmssd (np.array): One value per window, -999 where invalid.
+    """
+    ir_data = np.asarray(ir_data)
+    if ir_data.ndim == 1:
+        hop = window_size if hop is None else hop
+        windows = np.lib.stride_tricks.sliding_window_view(ir_data, window_size)[::hop]
+    else:
+        windows = ir_data
+    n_windows, n = windows.shape
+    if n < BUFFER_SIZE:
+        raise ValueError("expected windows of at least {0} samples, got {1}".format(BUFFER_SIZE, n))
+
+    results = np.empty((4, n_windows))
+    for start in range(0, n_windows, chunk_size):
+        # Contiguous rows, reduced in the same order as a single window
+        chunk = np.array(windows[start:start + chunk_size])
+
+        # Remove the truncated DC mean of each window and invert the signal
+        ir_mean = np.mean(chunk, axis=1).astype(int)
+        x = -1 * (chunk - ir_mean[:, np.newaxis])
+        x = moving_average(x, MA_SIZE)
+
+        # Peak threshold of each window
+        n_th = np.clip(np.trunc(np.mean(x, axis=1)), 30, 60)
+
+        rows, locs = find_peaks_batch(x, BUFFER_SIZE, n_th, 4, 15)
+        results[:, start:start + len(chunk)] = _metrics_batch(rows, locs, len(chunk))
+
+    hr, ipm, hrstd, rmssd = results
+    return hr, ipm, hrstd, rmssd
+
+
+# Function to calculate the metrics of calc_hr_from_smoothed from batched peaks
+def _metrics_batch(rows, locs, n_rows):
+    """
+    Parameters:
+        rows, locs (np.array): Window and index of every peak, sorted by
+            window then index.
+        n_rows (int): Number of windows.
+
+    Returns:
+        np.array: hr, ipm, hrstd and rmssd rows, -999 where invalid.
+    """
+    n_peaks = np.bincount(rows, minlength=n_rows)
+    results = np.full((4, n_rows), -999.0)
+    results[1] = (n_peaks / SECS_DATA) * 60
+
+    # Windows with the same number of peaks stack into a 2-D array
+    first = np.concatenate(([0], np.cumsum(n_peaks)[:-1]))
+    for count in np.unique(n_peaks[n_peaks >= 2]):
+        windows = np.flatnonzero(n_peaks == count)
+        window_locs = locs[first[windows][:, np.newaxis] + np.arange(count)]
+        intervals = np.diff(window_locs, axis=1) / SAMPLE_FREQ  # Convert to seconds
+
+        results[0, windows] = (60 / np.mean(intervals, axis=1)).astype(int)
+        if count > 2:
+            results[2, windows] = np.std(intervals, axis=1) * 60
+            diff_intervals = np.diff(intervals, axis=1)
+            results[3, windows] = np.sqrt(np.mean(diff_intervals ** 2, axis=1)) * 60
+
+    return results
+
+
+# Function to calculate HR, IPM, HRSTD, and RMSSD from the smoothed signal
+def calc_hr_from_smoothed(x):
+    """
+    Detect the peaks of the inverted, smoothed PPG signal and calculate
+    the metrics returned by calc_hr_and_ipm.
+    """
     # Calculate the threshold for peak detection
     n_th = int(np.mean(x))
     n_th = 30 if n_th < 30 else n_th  # Minimum threshold allowed
@@ -117,6 +208,35 @@ def calc_hr_and_ipm(ir_data):
 
 #     return hr, hr_valid
 
+# Function to apply the forward-looking moving average
+def moving_average(x, size):
+    """
+    Replace x[i] by the mean of x[i:i+size] for all but the last `size` samples,
+    along the last axis.
+
+    The sum is accumulated in the same order as np.sum over each slice and
+    cast back to the dtype of `x`, so the result is bit-identical to the
+    per-sample loop it replaces.
+
+    Parameters:
+        x (np.array): Array of IR data.
+        size (int): Size of the moving average window.
+
+    Returns:
+        x (np.array): Smoothed copy of the data.
+    """
+    x = np.array(x)
+    n = x.shape[-1] - size
+    if n <= 0:
+        return x
+
+    window_sum = x[..., 0:n].copy()
+    for k in range(1, size):
+        window_sum += x[..., k:n+k]
+    x[..., :n] = window_sum / size
+
+    return x
+
 # Function to find peaks in the IR data
 def find_peaks(x, size, min_height, min_dist, max_num):
     """
@@ -161,30 +281,30 @@ def find_peaks_above_min_height(x, size, min_height, max_num):
         n_peaks (int): Number of peaks detected.
     """
     
-    i = 0
-    n_peaks = 0
-    ir_valley_locs = []
-    
-    # Iterate through the data to find peaks
-    while i < size - 1:
-        if x[i] > min_height and x[i] > x[i-1]:  # Detect the start of a potential peak
-            n_width = 1
-            
-            # Handle flat peaks by checking if the value remains the same
-            while i + n_width < size - 1 and x[i] == x[i+n_width]:
-                n_width += 1
-                
-            # Confirm a peak if the value drops after the flat section
-            if x[i] > x[i+n_width] and n_peaks < max_num:
-                ir_valley_locs.append(i)  # Record the peak location
-                n_peaks += 1
-                i += n_width + 1
-            else:
-                i += n_width
-        else:
-            i += 1
+    x = np.asarray(x)
+    last = size - 1  # Peaks are searched in x[0:size-1]
+    if len(x) < last:
+        raise IndexError("expected at least {0} samples, got {1}".format(last, len(x)))
+    if last <= 0:
+        return [], 0
 
-    return ir_valley_locs, n_peaks
+    # A peak rises from its left neighbour (x[-1] for the first sample)
+    values = x[:last]
+    left = np.concatenate((x[-1:], x[:last-1]))
+    rising = (values > min_height) & (values > left)
+
+    # Right neighbour after a flat top: the next sample that differs, capped at size - 1
+    changes = np.flatnonzero(x[1:last] != x[:last-1]) + 1
+    changes = np.append(changes, last)
+    right = changes[np.searchsorted(changes, np.arange(last), side='right')]
+    if len(x) == last and np.any(rising & (right == last)):
+        raise IndexError("flat top runs past the end of the data")
+    right = np.minimum(right, len(x) - 1)
+
+    # Keep the first `max_num` peaks that drop after their flat top
+    ir_valley_locs = np.flatnonzero(rising & (values > x[right]))[:max_num].tolist()
+
+    return ir_valley_locs, len(ir_valley_locs)
 
 # Function to remove peaks that are too close to each other
 def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
@@ -202,26 +322,93 @@ def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
         n_peaks (int): Updated number of peaks after filtering.
     """
     
-    # Sort peaks by height (from highest to lowest)
-    sorted_indices = sorted(ir_valley_locs, key=lambda i: x[i])
-    sorted_indices.reverse()
-
-    i = -1
-    while i < n_peaks:
-        old_n_peaks = n_peaks
-        n_peaks = i + 1
-        j = i + 1
-        
-        # Remove peaks that are too close to the current peak
-        while j < old_n_peaks:
-            n_dist = (sorted_indices[j] - sorted_indices[i]) if i != -1 else (sorted_indices[j] + 1)
-            if n_dist > min_dist or n_dist < -1 * min_dist:
-                sorted_indices[n_peaks] = sorted_indices[j]
-                n_peaks += 1
-            j += 1
-        i += 1
+    locs = np.asarray(ir_valley_locs[:n_peaks], dtype=int)
+
+    # Sort peaks by height (from highest to lowest), ties go to the later peak
+    order = np.lexsort((-locs, -np.asarray(x)[locs])) if n_peaks else locs
+    sorted_indices = locs[order]
+
+    # Peaks within `min_dist` of the start are dropped
+    keep = sorted_indices + 1 > min_dist
+
+    # Keep each remaining peak and drop the lower ones too close to it
+    for i in range(n_peaks):
+        if keep[i]:
+            n_dist = sorted_indices[i+1:] - sorted_indices[i]
+            keep[i+1:] &= (n_dist > min_dist) | (n_dist < -1 * min_dist)
 
     # Sort the remaining peaks in ascending order of indices
-    sorted_indices[:n_peaks] = sorted(sorted_indices[:n_peaks])
+    sorted_indices = np.sort(sorted_indices[keep]).tolist()
+
+    return sorted_indices, len(sorted_indices)
+
+
+# Function to find peaks in every row of a 2-D array at once
+def find_peaks_batch(x, size, min_height, min_dist, max_num):
+    """
+    Apply find_peaks to every row of `x`.
+
+    Parameters:
+        x (np.array): 2-D array, one window of filtered IR data per row.
+        size (int): Size of the data array, at most the row length.
+        min_height (np.array): Minimum height for a peak, one per row.
+        min_dist (int): Minimum distance between consecutive peaks.
+        max_num (int): Maximum number of peaks to detect per row.
+
+    Returns:
+        rows, locs (np.array): Row and index of every peak, sorted by row
+        then index.
+    """
+    x = np.asarray(x)
+    last = size - 1  # Peaks are searched in x[:, 0:size-1]
+    if last <= 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # A peak rises from its left neighbour (the row's last sample for the first one)
+    values = x[:, :last]
+    left = np.concatenate((x[:, -1:], x[:, :last-1]), axis=1)
+    rising = (values > np.asarray(min_height)[:, np.newaxis]) & (values > left)
+
+    # Right neighbour after a flat top: the next sample that differs, capped at size - 1
+    index = np.arange(1, last)
+    changes = np.where(x[:, 1:last] != x[:, :last-1], index, last)
+    changes = np.concatenate((changes, np.full((len(x), 1), last)), axis=1)
+    right = np.minimum.accumulate(changes[:, ::-1], axis=1)[:, ::-1]
+    right = np.minimum(right, x.shape[1] - 1)
+
+    # Keep the first `max_num` peaks of each row that drop after their flat top
+    peaks = rising & (values > np.take_along_axis(x, right, axis=1))
+    peaks &= np.cumsum(peaks, axis=1) <= max_num
+    rows, locs = np.nonzero(peaks)
+
+    # Peaks within `min_dist` of the start are dropped
+    near_start = locs + 1 <= min_dist
+    rows, locs = rows[~near_start], locs[~near_start]
+    heights = x[rows, locs]
+
+    # Keep peaks greedily by height (ties go to the later peak), in rounds
+    # over all rows at once; peaks of a row are at least 2 samples apart
+    keep = np.ones(len(locs), dtype=bool)
+    undecided = np.ones(len(locs), dtype=bool)
+    max_shift = min(min_dist // 2 + 1, len(locs))
+    while undecided.any():
+        dominant = undecided.copy()
+        for shift in range(1, max_shift + 1):
+            close = (rows[shift:] == rows[:-shift]) & (locs[shift:] - locs[:-shift] <= min_dist)
+            left_wins = close & undecided[:-shift] & (heights[:-shift] > heights[shift:])
+            right_wins = close & undecided[shift:] & (heights[shift:] >= heights[:-shift])
+            dominant[shift:] &= ~left_wins
+            dominant[:-shift] &= ~right_wins
+        undecided &= ~dominant
+
+        # Drop the undecided peaks too close to a newly kept one
+        for shift in range(1, max_shift + 1):
+            close = (rows[shift:] == rows[:-shift]) & (locs[shift:] - locs[:-shift] <= min_dist)
+            suppressed_right = close & dominant[:-shift] & undecided[shift:]
+            suppressed_left = close & dominant[shift:] & undecided[:-shift]
+            keep[shift:] &= ~suppressed_right
+            undecided[shift:] &= ~suppressed_right
+            keep[:-shift] &= ~suppressed_left
+            undecided[:-shift] &= ~suppressed_left
 
-    return sorted_indices, n_peaks
+    return rows[keep], locs[keep]
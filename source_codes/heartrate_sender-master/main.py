@@ -1,75 +1,164 @@
+import argparse
+import os
+import numpy as np
+import acquisition
 import max30102
 import hrdata
-import numpy as np
-from scipy.signal import butter, filtfilt, find_peaks
-from collections import deque
-import json
-from bluetooth_sender import BluetoothSender
-from time import sleep, time
+from bluetooth_sender_test import BluetoothSender
+from recorder import Recorder
+from simulator import SimulatedMAX30102
+from time import monotonic, sleep, time, strftime
+
+# Acquisition profile, see max30102.PROFILES (e.g. "400hz-avg4" for finer beat timing)
+PROFILE = max30102.DEFAULT_PROFILE
+
+# Use receiver's Bluetooth MAC address (or host / socket path for "tcp" / "unix")
+SERVER_ADDRESS = "2C:CF:67:03:0B:FE"
+TRANSPORT = "rfcomm"  # "rfcomm", "tcp" or "unix"
+
+parser = argparse.ArgumentParser(description="Stream heart rate metrics from the MAX30102.")
+parser.add_argument("--simulate", action="store_true",
+                    help="Run on a simulated sensor instead of the MAX30102, e.g. off the Pi")
+parser.add_argument("--transport", choices=["rfcomm", "tcp", "unix"], default=TRANSPORT)
+parser.add_argument("--address", default=SERVER_ADDRESS,
+                    help="Receiver's MAC address, or host / socket path for tcp / unix")
+args = parser.parse_args()
 
-sensor = max30102.MAX30102()
+if args.simulate:
+    sensor = SimulatedMAX30102(burst=True, profile=PROFILE)
+else:
+    sensor = max30102.MAX30102(burst=True, profile=PROFILE)
 
-# Sampling frequency (Hz)
+# Sampling frequency (Hz) of the processing, faster profiles are decimated to it
 fs = 25
+decimator = hrdata.PolyphaseDecimator(int(sensor.fs // fs)) if sensor.fs > fs else None
 window_size = 100  # Sliding window size (e.g., 5 seconds at 100 Hz) 4s
-output_interval = 0.5  # Output metrics every 500 ms
+hop = 12  # Output metrics every 12 new samples (~0.5 s at 25 Hz)
 
-# Sliding window buffer for IR data
-# ir_buffer = deque(maxlen=window_size)
+# Sliding window over the IR data, metrics are computed on the overlapping window;
+# beats are located between samples for finer intervals. Red is filtered along
+# with IR for the SpO2 estimate
+monitor = hrdata.StreamingHRMonitor(fs, window_size=window_size, hop=hop, interpolate=True,
+                                    spo2=True)
 
 print("Starting continuous heart rate monitoring...")
-last_output_time = time()
 
-# Use receiver's Bluetooth MAC address
-SERVER_ADDRESS = "2C:CF:67:03:0B:FE"
-sender = BluetoothSender(SERVER_ADDRESS)
+sender = BluetoothSender(args.address, transport=args.transport)
+
+# Directory where raw samples and metrics are recorded, None to disable
+RECORD_DIR = "logs"
+recorder = Recorder(os.path.join(RECORD_DIR, strftime("%Y%m%d-%H%M%S"))) if RECORD_DIR else None
+
+# Sample timestamps are monotonic, this offset turns them into Unix time
+CLOCK_OFFSET = time() - monotonic()
+
+# Only stream the raw samples and let the receiver compute the metrics
+# (hub mode), for senders with little CPU to spare
+HUB_MODE = False
+# Samples per raw frame in hub mode, larger frames spread the header over more samples
+RAW_FRAME_SAMPLES = 50
+raw_blocks = []  # Blocks of (timestamps, red_ir) not sent yet in hub mode
+raw_index = 0  # Stream index of the next raw sample, lost samples included
+
+
+def process(item):
+    """Processing stage: record the samples and update the metrics."""
+    timestamps, red_ir, lost = item
+    timestamps = timestamps + CLOCK_OFFSET
+    if lost:
+        print(f"FIFO overflow: {lost} samples lost")
+    if recorder:
+        recorder.append_samples(red_ir, timestamps)
+
+    if decimator:
+        lost = decimator.skip(lost)
+        red_ir, timestamps = decimator.process(red_ir, timestamps)
+    # The intervals between beats use the measured sample rate, not the nominal one
+    monitor.set_sample_rate(sensor.rate.fs * fs / sensor.fs)
+    # Process and output metrics every `hop` samples
+    result = monitor.push(red_ir, lost)
+    if result is None:
+        return None
+    if result[0] is None:
+        print("Not enough peaks detected. Adjust filter or check signal.")
+        return None
+
+    # The window is copied, the monitor keeps overwriting it
+    hr, ipm, hrstd, rmssd, ir_filtered = result
+    start_index = monitor.total_samples - len(ir_filtered)
+    timestamp = timestamps[-1] - (len(ir_filtered) - 1) / monitor.fs
+    return hr, ipm, hrstd, rmssd, monitor.spo2, ir_filtered.copy(), start_index, timestamp
+
+
+def transmit(item):
+    """Transmission stage: print, send and record the metrics."""
+    hr, ipm, hrstd, rmssd, spo2, ir_filtered, start_index, timestamp = item
+    print(f"Heart Rate (bpm): {hr:.2f}")
+    print(f"Impulses per minute: {ipm:.2f}")
+    print(f"HRSTD: {hrstd:.2f}")
+    print(f"RMSSD: {rmssd:.2f}")
+    print(f"SpO2 (%): {spo2:.1f}")
+    print(f"Filtered Data: {ir_filtered[:10]} ...")
+
+    # Send the filtered window and metrics over bluetooth as a binary frame
+    sender.send_frame(ir_filtered, hr, ipm, hrstd, rmssd, spo2=spo2,
+                      start_index=start_index, timestamp=timestamp)
+    if recorder:
+        # On the samples' clock, like the frame, so an NTP step cannot reorder them
+        recorder.append_metrics(timestamp, hr, ipm, hrstd, rmssd, spo2)
+
+
+def send_raw_blocks():
+    """Send the waiting raw blocks as one frame."""
+    global raw_index
+    if not raw_blocks:
+        return
+    red_ir = np.concatenate([red_ir for _, red_ir in raw_blocks], axis=1)
+    sender.send_raw(red_ir, sensor.rate.fs, start_index=raw_index, timestamp=raw_blocks[0][0][0])
+    raw_index += red_ir.shape[1]
+    raw_blocks.clear()
+
+
+def stream_raw(item):
+    """Hub mode stage: record the raw samples and send them in batches."""
+    global raw_index
+    timestamps, red_ir, lost = item
+    timestamps = timestamps + CLOCK_OFFSET
+    if recorder:
+        recorder.append_samples(red_ir, timestamps)
+    if lost:
+        print(f"FIFO overflow: {lost} samples lost")
+        # A frame holds contiguous samples, the receiver sees the gap in the indices
+        send_raw_blocks()
+        raw_index += lost
+
+    raw_blocks.append((timestamps, red_ir))
+    if sum(red_ir.shape[1] for _, red_ir in raw_blocks) >= RAW_FRAME_SAMPLES:
+        send_raw_blocks()
+
+
+# The sensor is read by its own thread; processing and transmission run as
+# separate stages so a slow stage never delays the FIFO reads
+if HUB_MODE:
+    stages = [("stream", stream_raw)]
+else:
+    stages = [("process", process), ("transmit", transmit)]
+pipeline = acquisition.Pipeline(sensor, stages)
 
 try:
     sender.connect()
-    
-    # 100 samples are read and used for HR calculation in a single loop
-    while True:
-        ir_data = sensor.read_sequential(amount=window_size)
-        # ir_buffer.extend(ir_data)
-
-        # Process and output metrics at regular intervals
-        if time() - last_output_time >= output_interval:
-            # if len(ir_buffer) >= window_size:
-                # Convert deque to numpy array
-            ir_data_window = np.array(ir_data)
-
-            # Calculate heart rate metrics
-            hr, ipm, hrstd, rmssd, ir_filtered = hrdata.calculate_hr_metrics(ir_data_window, fs)
-            if hr is not None:
-                print(f"Heart Rate (bpm): {hr:.2f}")
-                print(f"Impulses per minute: {ipm:.2f}")
-                print(f"HRSTD: {hrstd:.2f}")
-                print(f"RMSSD: {rmssd:.2f}")
-                print(f"Filtered Data: {ir_filtered[:10]} ...")
-
-                # Round filtered data to reduce precision
-                ir_filtered_rounded = np.round(ir_filtered, decimals=2)
-
-                data_to_send = {
-                    "raw_value": ir_filtered_rounded.tolist(),
-                    "bpm": round(hr, 2),
-                    "ipm": round(ipm,2),
-                    "hrstd": round(hrstd, 2),
-                    "rmssd": round(rmssd, 2)
-                }
-                print(data_to_send)
-                # Send data over bluetooth
-                json_data_to_send = json.dumps(data_to_send)
-                sender.send_data(json_data_to_send)
-            else:
-                print("Not enough peaks detected. Adjust filter or check signal.")
-
-            # Update the last output time
-            last_output_time = time()
-
-        # Sleep briefly to prevent excessive CPU usage
-        sleep(0.01)
+    pipeline.start()
 
+    while pipeline.is_alive():
+        sleep(10)
+        print(f"Pipeline stats: {pipeline.stats()}")
 
 finally:
-        sender.disconnect()
\ No newline at end of file
+        pipeline.stop()
+        if HUB_MODE:
+            send_raw_blocks()
+        sender.disconnect()
+        print(f"Pipeline stats: {pipeline.stats()}")
+        print(f"Sender stats: {sender.stats()}")
+        if recorder:
+            recorder.close()
\ No newline at end of file
@@ -2,11 +2,23 @@
 
 # this code is currently for python 2.7
 from __future__ import print_function
-from time import sleep
-import smbus
-
-import gpiod  # Library for GPIO control
+from collections import deque, namedtuple
+from time import monotonic, sleep
+
+# smbus and gpiod are only needed with the real sensor, simulator.py
+# provides stand-ins to run everywhere else
+try:
+    import smbus
+except ImportError:
+    smbus = None
+try:
+    import gpiod  # Library for GPIO control
+except ImportError:
+    gpiod = None
 import configparser
+import numpy as np
+
+from ringbuffer import RingBuffer
 
 # # Initialize the parser
 # config = configparser.ConfigParser()
@@ -16,6 +28,8 @@ import configparser
 # SAMPLE_FREQ = config.getint('param', 'sampling_freq')
 
 BUFFER_SIZE = 50
+# samples of red and ir kept in the sensor's ring buffer
+RING_CAPACITY = 1024
 
 # i2c address-es
 # not required?
@@ -54,26 +68,204 @@ REG_PART_ID = 0xFF
 # currently not used
 MAX_BRIGHTNESS = 255
 
+# gpiod.LineEvent.FALLING_EDGE, also used by the simulator's events
+FALLING_EDGE = gpiod.LineEvent.FALLING_EDGE if gpiod is not None else 2
+
+# FIFO holds 32 samples, each 3 bytes red + 3 bytes IR in SpO2 mode
+FIFO_DEPTH = 32
+BYTES_PER_SAMPLE = 6
+# SMBus block reads are limited to 32 bytes, i.e. 5 whole samples per read
+MAX_BLOCK_SAMPLES = 32 // BYTES_PER_SAMPLE
+# FIFO_A_FULL[3:0]: the almost-full interrupt fires with 32 - 15 = 17 samples in the FIFO
+FIFO_A_FULL = 0x0F
+A_FULL_SAMPLES = FIFO_DEPTH - FIFO_A_FULL
+# OVF_COUNTER saturates at 0x1F
+OVF_MAX = 0x1F
+
+# SPO2_CONFIG SPO2_SR[4:2] code of each sample rate
+SPO2_SR_CODES = {50: 0, 100: 1, 200: 2, 400: 3, 800: 4, 1000: 5, 1600: 6, 3200: 7}
+# FIFO_CONFIG SMP_AVE[7:5] code of each number of averaged samples
+SMP_AVE_CODES = {1: 0, 2: 1, 4: 2, 8: 3, 16: 4, 32: 5}
+
+
+class Profile(namedtuple("Profile", ["sample_rate", "averaging"])):
+    """
+    Acquisition profile: the ADC sample rate and the number of samples
+    the chip averages into each FIFO sample.
+    """
+
+    @property
+    def fs(self):
+        """Samples per second written into the FIFO."""
+        return self.sample_rate / self.averaging
+
+    @property
+    def spo2_config(self):
+        # SPO2_ADC range = 4096nA, LED pulse-width = 411uS (allowed up to 400Hz)
+        return 0x20 | SPO2_SR_CODES[self.sample_rate] << 2 | 0x03
+
+    @property
+    def fifo_config(self):
+        # fifo rollover = false, fifo almost full = 17
+        return SMP_AVE_CODES[self.averaging] << 5 | FIFO_A_FULL
+
+
+# Higher rates give finer beat timing at the cost of more I2C traffic and
+# host processing, the chip's averaging lowers the noise instead
+PROFILES = {
+    "100hz-avg4": Profile(100, 4),  # 25 Hz, the original setup
+    "100hz": Profile(100, 1),
+    "200hz-avg2": Profile(200, 2),
+    "200hz": Profile(200, 1),
+    "400hz-avg4": Profile(400, 4),
+    "400hz": Profile(400, 1),
+}
+DEFAULT_PROFILE = "100hz-avg4"
+
+
+def decode_fifo_data(data):
+    """
+    Decode a raw FIFO byte block into a (2, n) uint32 array of red and ir samples.
+    """
+    raw = np.frombuffer(bytes(data), dtype=np.uint8)
+    raw = raw[:len(raw) - len(raw) % BYTES_PER_SAMPLE].reshape(-1, 3).astype(np.uint32)
+    # mask MSB [23:18]
+    values = (raw[:, 0] << 16 | raw[:, 1] << 8 | raw[:, 2]) & 0x03FFFF
+    # samples alternate red, ir
+    return values.reshape(-1, 2).T
+
+
+class SampleRateEstimator:
+    """
+    Online estimate of the sensor's true sample rate.
+
+    The MAX30102 runs on its own oscillator, so its rate differs from the
+    nominal one by up to a few percent. Every interrupt gives the
+    monotonic time of a known sample; a least-squares line through the
+    (sample index, time) pairs of the last `horizon` seconds gives the
+    time per sample, unaffected by the jitter of a single interrupt.
+    """
+
+    def __init__(self, nominal_fs, horizon=60.0, min_span=5.0, tolerance=0.1):
+        """
+        Initialize the SampleRateEstimator object.
+
+        Args:
+            nominal_fs (float): Configured sampling frequency in Hz.
+            horizon (float): Seconds of interrupts the fit is computed over.
+            min_span (float): Seconds of interrupts needed before the
+                estimate replaces the nominal rate.
+            tolerance (float): Largest relative deviation from the nominal
+                rate accepted, larger ones come from misattributed edges.
+        """
+        self.nominal_fs = nominal_fs
+        self.horizon = horizon
+        self.min_span = min_span
+        self.tolerance = tolerance
+        self.fs = nominal_fs
+        self._points = deque()  # (sample index, time) of the recent interrupts
+
+    def reset(self):
+        """Forget the interrupts, e.g. when the sample count is no longer known."""
+        self._points.clear()
+
+    def update(self, index, t):
+        """
+        Add the time of a sample.
+
+        Args:
+            index (int): Sample index since the start, lost samples included.
+            t (float): Monotonic time of the sample in seconds.
+
+        Returns:
+            float: The current estimate in Hz.
+        """
+        points = self._points
+        points.append((index, t))
+        while t - points[0][1] > self.horizon:
+            points.popleft()
+        if t - points[0][1] < self.min_span:
+            return self.fs
+
+        xy = np.array(points, dtype=np.float64)
+        x = xy[:, 0] - xy[:, 0].mean()
+        y = xy[:, 1] - xy[:, 1].mean()
+        fs = (x * x).sum() / (x * y).sum()
+        if abs(fs / self.nominal_fs - 1) <= self.tolerance:
+            self.fs = fs
+        return self.fs
+
+    @property
+    def drift_ppm(self):
+        """Deviation of the estimated rate from the nominal one, in parts per million."""
+        return (self.fs / self.nominal_fs - 1) * 1e6
+
 
 class MAX30102():
+    # seconds to wait for the device to reset
+    RESET_DELAY = 1
+
     # by default, this assumes that physical GPIO17 is used as interrupt
     # by default, this assumes that the device is at 0x57 on channel 1
-    def __init__(self, channel=1, address=0x57, gpio_pin=17):
+    # burst=True drains the whole FIFO once per almost-full interrupt
+    # profile is a key of PROFILES or a Profile, it sets the sample rate
+    # bus / int_line can be given to use stand-ins instead of smbus / gpiod
+    def __init__(self, channel=1, address=0x57, gpio_pin=17, burst=False,
+                 bus=None, int_line=None, buffer_capacity=RING_CAPACITY,
+                 profile=DEFAULT_PROFILE):
         print("Channel: {0}, address: 0x{1:x}".format(channel, address))
         self.address = address
         self.channel = channel
-        self.bus = smbus.SMBus(self.channel)
+        self.bus = bus if bus is not None else smbus.SMBus(self.channel)
         self.interrupt = gpio_pin
-
-        # Initialize GPIO chip and request line for interrupt pin
-        chip = gpiod.Chip('gpiochip0')  # Use the appropriate GPIO chip, typically gpiochip0 for main GPIO
-        self.int_line = chip.get_line(self.interrupt)
-
-        # Configure the interrupt pin to listen for falling edge events
-        self.int_line.request(consumer='interrupt_pin', type=gpiod.LINE_REQ_EV_FALLING_EDGE)
+        self.burst = burst
+        self.profile = PROFILES[profile] if isinstance(profile, str) else profile
+        # nominal samples per second, see rate.fs for the measured one
+        self.fs = self.profile.fs
+
+        # samples lost to FIFO overflow, as reported by OVF_COUNTER
+        self.overflow_count = 0
+        # drains that found the FIFO overflowed
+        self.overflow_events = 0
+        # interrupts handled and samples drained by read_fifo_block
+        self.interrupts = 0
+        self.samples_read = 0
+        # unread samples overwritten in the buffer before they were taken
+        self.overwritten = 0
+        # highest FIFO level seen at a drain, 32 means samples may have been lost
+        self.max_fifo_level = 0
+        # longest time between an interrupt and its drain (seconds)
+        self.max_latency = 0.0
+        # red (row 0) and ir (row 1) samples drained from the FIFO
+        self.buffer = RingBuffer(buffer_capacity, channels=2)
+        # monotonic time of each sample in the buffer
+        self.timestamps = RingBuffer(buffer_capacity, dtype=np.float64)
+        # samples in the buffer not yet returned by read_sequential / read_window
+        self._unread = 0
+        # samples lost before the unread ones, returned by take_unread(timed=True)
+        self._lost_unread = 0
+        # samples lost after the last drained one
+        self._lost_after = 0
+        # true sample rate, estimated from the interrupt times
+        self.rate = SampleRateEstimator(self.fs)
+        # index of the next sample drained, lost samples included
+        self._next_index = 0
+        # (sample index, time) of the last interrupt-timed sample
+        self._last_edge = None
+        # OVF_COUNTER saturated: the number of lost samples is a lower bound
+        self._lost_unknown = False
+
+        if int_line is None:
+            # Initialize GPIO chip and request line for interrupt pin
+            chip = gpiod.Chip('gpiochip0')  # Use the appropriate GPIO chip, typically gpiochip0 for main GPIO
+            int_line = chip.get_line(self.interrupt)
+
+            # Configure the interrupt pin to listen for falling edge events
+            int_line.request(consumer='interrupt_pin', type=gpiod.LINE_REQ_EV_FALLING_EDGE)
+        self.int_line = int_line
 
         self.reset()
-        sleep(1)  # wait 1 sec
+        sleep(self.RESET_DELAY)  # wait 1 sec
 
         # Read & clear interrupt register (read 1 byte)
         reg_data = self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 1)
@@ -102,7 +294,9 @@ class MAX30102():
         # INTR setting
         # 0xc0 : A_FULL_EN and PPG_RDY_EN = Interrupt will be triggered when
         # fifo almost full & new fifo data ready
-        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [0xc0])
+        # 0x80 : A_FULL_EN only, used in burst mode
+        intr_enable = 0x80 if self.burst else 0xc0
+        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [intr_enable])
         self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_2, [0x00])
 
         # FIFO_WR_PTR[4:0]
@@ -112,15 +306,15 @@ class MAX30102():
         # FIFO_RD_PTR[4:0]
         self.bus.write_i2c_block_data(self.address, REG_FIFO_RD_PTR, [0x00])
 
-        # 0b 0100 1111
+        # 0b 0100 1111 with the default profile
         # sample avg = 4, fifo rollover = false, fifo almost full = 17
-        self.bus.write_i2c_block_data(self.address, REG_FIFO_CONFIG, [0x4f])
+        self.bus.write_i2c_block_data(self.address, REG_FIFO_CONFIG, [self.profile.fifo_config])
 
         # 0x02 for read-only, 0x03 for SpO2 mode, 0x07 multimode LED
         self.bus.write_i2c_block_data(self.address, REG_MODE_CONFIG, [led_mode])
-        # 0b 0010 0111
+        # 0b 0010 0111 with the default profile
         # SPO2_ADC range = 4096nA, SPO2 sample rate = 100Hz, LED pulse-width = 411uS
-        self.bus.write_i2c_block_data(self.address, REG_SPO2_CONFIG, [0x27])
+        self.bus.write_i2c_block_data(self.address, REG_SPO2_CONFIG, [self.profile.spo2_config])
 
         # choose value for ~7mA for LED1
         self.bus.write_i2c_block_data(self.address, REG_LED1_PA, [0x24])
@@ -153,25 +347,227 @@ class MAX30102():
         ir_led = (d[3] << 16 | d[4] << 8 | d[5]) & 0x03FFFF
 
         return red_led, ir_led
-    
-    def read_sequential(self, amount=BUFFER_SIZE):
+
+    def _now(self):
+        """
+        Monotonic time in seconds, the clock of the gpiod event timestamps.
+        """
+        return monotonic()
+
+    def read_fifo_block(self, event=None):
+        """
+        This function will drain every sample currently held in the FIFO
+        into the ring buffer and return them as a (2, n) view of red and ir.
+        Samples lost to overflow are added to `overflow_count`.
+
+        Each sample gets a monotonic timestamp in `timestamps`. The
+        interrupt `event` (as returned by event_read) dates the sample that
+        raised it: the 17th in the FIFO in burst mode, the first one
+        otherwise. The others are spaced by the estimated sample period.
+        Without an event, the newest sample is dated to the drain.
+        """
+        drained_at = self._now()
+
+        # read 2 bytes to clear both interrupt status registers (values are discarded)
+        self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 2)
+
+        # FIFO_WR_PTR, OVF_COUNTER and FIFO_RD_PTR are adjacent registers
+        wr_ptr, ovf, rd_ptr = self.bus.read_i2c_block_data(self.address, REG_FIFO_WR_PTR, 3)
+        wr_ptr &= 0x1F
+        ovf &= 0x1F
+        rd_ptr &= 0x1F
+
+        # an overflow means the FIFO is full
+        num_samples = FIFO_DEPTH if ovf else (wr_ptr - rd_ptr) % FIFO_DEPTH
+        self.overflow_count += ovf
+        self.overflow_events += ovf > 0
+        self.max_fifo_level = max(self.max_fifo_level, num_samples)
+
+        data = []
+        while num_samples > 0:
+            n = min(num_samples, MAX_BLOCK_SAMPLES)
+            data.extend(self.bus.read_i2c_block_data(self.address, REG_FIFO_DATA,
+                                                     n * BYTES_PER_SAMPLE))
+            num_samples -= n
+
+        # Without rollover, the samples lost at the previous drain came
+        # after its samples, i.e. before these ones
+        self._lost_unread += self._lost_after
+        self._lost_after = ovf
+
+        block = decode_fifo_data(data)
+        n = block.shape[1]
+        self._timestamp_block(n, event, drained_at)
+        self._next_index += n + ovf
+        if ovf == OVF_MAX:
+            self._lost_unknown = True
+
+        self.buffer.extend(block)
+        self._unread += n
+        self.interrupts += event is not None
+        self.samples_read += n
+
+        return self.buffer.latest(n)
+
+    def _timestamp_block(self, n, event, drained_at):
+        """
+        Date the `n` samples being drained and update the rate estimate.
+        """
+        if n == 0:
+            return
+        period = 1.0 / self.rate.fs
+        edge = A_FULL_SAMPLES - 1 if self.burst else 0
+        if event is not None and edge < n:
+            t_edge = event.sec + event.nsec * 1e-9
+            self.max_latency = max(self.max_latency, drained_at - t_edge)
+            if self._lost_unknown and self._last_edge is not None:
+                # OVF_COUNTER saturated, count the lost samples from the elapsed time
+                last_index, last_t = self._last_edge
+                expected = last_index + int(round((t_edge - last_t) * self.rate.fs))
+                missing = expected - (self._next_index + edge)
+                if missing > 0:
+                    self._next_index += missing
+                    self._lost_unread += missing
+                    self.overflow_count += missing
+            self._lost_unknown = False
+            index = self._next_index + edge
+            self._last_edge = (index, t_edge)
+            self.rate.update(index, t_edge)
+            first = t_edge - edge * period
+        else:
+            first = drained_at - (n - 1) * period
+        self.timestamps.extend(first + np.arange(n) * period)
+
+    def read_block(self, timed=False):
+        """
+        This function will block until the next interrupt and return every
+        sample that arrived since the last read as a (2, n) view of red and ir,
+        or a (samples, timestamps, lost) tuple with `timed` (see take_unread).
+        """
+        event = self.int_line.event_read()
+        self.read_fifo_block(event)
+
+        return self.take_unread(timed)
+
+    def take_unread(self, timed=False):
+        """
+        This function will return every sample drained from the FIFO but not
+        yet returned as a (2, n) view of red and ir, without waiting.
+        With `timed`, it returns (samples, timestamps, lost): the views of
+        the samples and of their monotonic timestamps, and the number of
+        samples lost to overflow before them (or among them, if they come
+        from several drains).
+        """
+        self._drop_overwritten()
+        n = self._unread
+        self._unread = 0
+        if not timed:
+            return self.buffer.latest(n)
+
+        lost = self._lost_unread
+        self._lost_unread = 0
+        return self.buffer.latest(n), self.timestamps.latest(n), lost
+
+    def _drop_overwritten(self):
+        """
+        Count the unread samples the buffer has already overwritten as lost
+        before the remaining unread ones.
+        """
+        excess = self._unread - self.buffer.capacity
+        if excess > 0:
+            self._unread -= excess
+            self._lost_unread += excess
+            self.overwritten += excess
+
+    def read_window(self, amount=BUFFER_SIZE, new=None):
+        """
+        This function will block until `new` (default `amount`) samples have
+        arrived since the last call and return the newest `amount` samples
+        as a zero-copy (2, amount) view of red and ir.
+        """
+        new = amount if new is None else new
+        while self._unread < new:
+            # Wait for an interrupt, then drain the whole FIFO
+            event = self.int_line.event_read()
+            self.read_fifo_block(event)
+        self._unread = 0
+
+        return self.buffer.latest(amount)
+
+    def stats(self):
+        """
+        Counters telling whether the FIFO is read in time.
+
+        Returns:
+            dict: Interrupts and samples drained, samples lost to overflow
+            and the drains that found an overflow, unread samples overwritten
+            in the buffer, the highest FIFO level,
+            the longest interrupt to drain latency and the estimated sample
+            rate with its deviation from the nominal one.
+        """
+        return {
+            "interrupts": self.interrupts,
+            "samples": self.samples_read,
+            "overflow": self.overflow_count,
+            "overflow_events": self.overflow_events,
+            "overwritten": self.overwritten,
+            "max_fifo_level": self.max_fifo_level,
+            "max_latency_ms": round(self.max_latency * 1000, 3),
+            "fs_estimate": round(float(self.rate.fs), 4),
+            "drift_ppm": int(round(self.rate.drift_ppm)),
+        }
+
+    def read_sequential(self, amount=BUFFER_SIZE, red_ir=False):
         """
         This function will read the red-led and ir-led `amount` times.
         This works as blocking function.
+
+        Returns the IR samples as a list, or with `red_ir` both channels
+        as an array of shape (2, amount), red and IR.
         """
-        # red_buf = []
+        if self.burst:
+            return self._read_sequential_burst(amount, red_ir)
+
+        red_buf = []
         ir_buf = []
 
         for i in range(amount):
             # Wait for an interrupt event before reading data
             event = self.int_line.event_read()  # Blocking wait for the interrupt
 
-            if event.type == gpiod.LineEvent.FALLING_EDGE:
+            if event.type == FALLING_EDGE:
                 # Interrupt signal received, read data
                 red, ir = self.read_fifo()
-                # red_buf.append(red)
+                red_buf.append(red)
                 ir_buf.append(ir)
 
+        if red_ir:
+            return np.array([red_buf, ir_buf])
         return ir_buf
 
+    def _read_sequential_burst(self, amount, red_ir=False):
+        """
+        Burst variant of read_sequential, one FIFO drain per interrupt.
+        Samples beyond `amount` are kept for the next call.
 
+        The samples are taken after every drain, so `amount` can exceed
+        the buffer's capacity.
+        """
+        chunks = []
+        needed = amount
+        while needed:
+            if not self._unread:
+                # Wait for the almost-full interrupt, then drain the whole FIFO
+                event = self.int_line.event_read()
+                self.read_fifo_block(event)
+            self._drop_overwritten()
+            n = min(needed, self._unread)
+            chunks.append(self.buffer.latest(self._unread)[:, :n].copy())
+            self._unread -= n
+            needed -= n
+
+        samples = np.concatenate(chunks, axis=1) if chunks else self.buffer.latest(0).copy()
+
+        if red_ir:
+            return samples
+        return samples[1].tolist()
@@ -0,0 +1,365 @@
+"""
+Time range queries over the metrics of a recording.
+
+Per-second, per-minute and per-hour summaries (count, mean, min and max
+of every metric) are kept for a recording written by recorder.Recorder,
+and updated incrementally as the recording grows. A query bisects the
+summary's bucket start times, so it never rescans the recorded metrics.
+
+The summaries are saved next to the recording, so a new process only
+summarizes the metrics recorded since the last save:
+
+    summary-<resolution>s.bin  SUMMARY_DTYPE: the closed buckets of a level
+    summary.json               metrics records summarized, closed buckets
+                               per level and each level's last bucket
+
+Only closed buckets are appended to the .bin files; the last bucket of
+a level can still grow and lives in summary.json, which is replaced
+atomically. A save interrupted by a crash is ignored when the summaries
+are loaded again.
+
+Example:
+    python query.py logs/20240101-220000 --resolution 60
+"""
+import argparse
+import json
+import os
+from time import localtime, strftime
+
+import numpy as np
+
+from recorder import Recording
+
+METRICS = ["bpm", "ipm", "hrstd", "rmssd", "spo2"]
+RESOLUTIONS = (1, 60, 3600)  # Seconds per bucket, finest first
+
+SUMMARY_DTYPE = np.dtype([("start", "<f8"), ("count", "<i8", (len(METRICS),)),
+                          ("sum", "<f8", (len(METRICS),)), ("min", "<f8", (len(METRICS),)),
+                          ("max", "<f8", (len(METRICS),))])
+SUMMARY_STATE_FILE = "summary.json"
+SUMMARY_VERSION = 1
+
+
+def _summary_file(resolution):
+    return f"summary-{resolution:g}s.bin"
+
+
+class SummaryLevel:
+    """Count, sum, min and max of every metric per bucket of `resolution` seconds."""
+
+    def __init__(self, resolution, capacity=1024):
+        """
+        Args:
+            resolution (float): Length of a bucket in seconds.
+            capacity (int): Initial number of buckets, grown as needed.
+        """
+        self.resolution = resolution
+        self.n = 0
+        self.start = np.empty(capacity)
+        self.count = np.empty((capacity, len(METRICS)), dtype=np.int64)
+        self.sum = np.empty((capacity, len(METRICS)))
+        self.min = np.empty((capacity, len(METRICS)))
+        self.max = np.empty((capacity, len(METRICS)))
+
+    def _reserve(self, n):
+        capacity = len(self.start)
+        if n <= capacity:
+            return
+        capacity = max(n, 2 * capacity)
+        for name in ("start", "count", "sum", "min", "max"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def add(self, t, values):
+        """
+        Add metrics updates.
+
+        Args:
+            t (np.array): Timestamps, non-decreasing and not before the last added one.
+            values (np.array): Metrics of shape (len(t), len(METRICS)), NaN when not available.
+        """
+        if len(t) == 0:
+            return
+        bucket = np.floor(t / self.resolution) * self.resolution
+        first = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+
+        valid = ~np.isnan(values)
+        count = np.add.reduceat(valid, first).astype(np.int64)
+        total = np.add.reduceat(np.where(valid, values, 0.0), first)
+        low = np.minimum.reduceat(np.where(valid, values, np.inf), first)
+        high = np.maximum.reduceat(np.where(valid, values, -np.inf), first)
+        starts = bucket[first]
+
+        # The first bucket may continue the last stored one
+        if self.n and starts[0] == self.start[self.n - 1]:
+            last = self.n - 1
+            self.count[last] += count[0]
+            self.sum[last] += total[0]
+            np.minimum(self.min[last], low[0], out=self.min[last])
+            np.maximum(self.max[last], high[0], out=self.max[last])
+            starts, count, total, low, high = starts[1:], count[1:], total[1:], low[1:], high[1:]
+
+        n = len(starts)
+        self._reserve(self.n + n)
+        end = self.n + n
+        self.start[self.n:end] = starts
+        self.count[self.n:end] = count
+        self.sum[self.n:end] = total
+        self.min[self.n:end] = low
+        self.max[self.n:end] = high
+        self.n = end
+
+    def records(self, lo, hi):
+        """Buckets [lo, hi) as SUMMARY_DTYPE records."""
+        records = np.empty(hi - lo, dtype=SUMMARY_DTYPE)
+        for name in SUMMARY_DTYPE.names:
+            records[name] = getattr(self, name)[lo:hi]
+        return records
+
+    def extend(self, records):
+        """Append buckets given as SUMMARY_DTYPE records."""
+        self._reserve(self.n + len(records))
+        end = self.n + len(records)
+        for name in SUMMARY_DTYPE.names:
+            getattr(self, name)[self.n:end] = records[name]
+        self.n = end
+
+    def bounds(self, t0, t1):
+        """Indices of the buckets starting in [t0, t1)."""
+        start = self.start[:self.n]
+        return np.searchsorted(start, t0, side="left"), np.searchsorted(start, t1, side="left")
+
+
+class MetricsIndex:
+    """Multi-resolution summaries of the metrics of a recording."""
+
+    def __init__(self, path, resolutions=RESOLUTIONS, persist=True):
+        """
+        Initialize the MetricsIndex object and summarize the recording,
+        starting from the saved summaries if there are any.
+
+        Args:
+            path (str): Directory of the recording.
+            resolutions (tuple): Bucket lengths in seconds, finest first;
+                each one must be a multiple of the previous one.
+            persist (bool): Load and save the summaries next to the recording.
+        """
+        self.path = path
+        self.resolutions = tuple(resolutions)
+        self.persist = persist
+        self.levels = [SummaryLevel(r) for r in resolutions]
+        self.processed = 0  # Metrics records already summarized
+        self._saved_closed = [0] * len(self.levels)  # Closed buckets in each level's file
+        if persist:
+            self._load()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Summarize the metrics recorded since the last refresh, and save
+        the summaries if there were any.
+
+        Returns:
+            int: Number of new metrics records.
+        """
+        metrics = Recording(self.path).metrics
+        if len(metrics) < self.processed:
+            # Not the recording the summaries were saved for
+            self._reset()
+        metrics = metrics[self.processed:]
+        if len(metrics):
+            t = np.asarray(metrics["t"], dtype=np.float64)
+            values = np.column_stack([metrics[name].astype(np.float64) for name in METRICS])
+            for level in self.levels:
+                level.add(t, values)
+            self.processed += len(metrics)
+            if self.persist:
+                self._save()
+        return len(metrics)
+
+    def _reset(self):
+        self.levels = [SummaryLevel(r) for r in self.resolutions]
+        self.processed = 0
+        self._saved_closed = [0] * len(self.levels)
+
+    def _load(self):
+        """Load the saved summaries, if they match this index."""
+        try:
+            with open(os.path.join(self.path, SUMMARY_STATE_FILE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (state.get("version") != SUMMARY_VERSION or state.get("metrics") != METRICS
+                or state.get("resolutions") != list(self.resolutions)):
+            return
+
+        for level, saved in zip(self.levels, state["levels"]):
+            closed = saved["closed"]
+            records = np.zeros(0, dtype=SUMMARY_DTYPE)
+            path = os.path.join(self.path, _summary_file(level.resolution))
+            if closed and os.path.exists(path):
+                records = np.fromfile(path, dtype=SUMMARY_DTYPE, count=closed)
+            if len(records) < closed:
+                # The file is older than the state, summarize from scratch
+                self._reset()
+                return
+            level.extend(records)
+            if saved["open"] is not None:
+                level.extend(np.array([tuple(saved["open"])], dtype=SUMMARY_DTYPE))
+        self.processed = state["processed"]
+        self._saved_closed = [saved["closed"] for saved in state["levels"]]
+
+    def _save(self):
+        """Append the newly closed buckets and replace the state file."""
+        levels = []
+        try:
+            for i, level in enumerate(self.levels):
+                closed = max(level.n - 1, 0)
+                if closed > self._saved_closed[i]:
+                    path = os.path.join(self.path, _summary_file(level.resolution))
+                    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                        # Overwrites what an interrupted save may have left
+                        f.seek(self._saved_closed[i] * SUMMARY_DTYPE.itemsize)
+                        level.records(self._saved_closed[i], closed).tofile(f)
+                        f.truncate()
+                last = level.records(closed, level.n)
+                levels.append({
+                    "closed": closed,
+                    "open": [np.asarray(last[0][name]).tolist() for name in SUMMARY_DTYPE.names]
+                    if len(last) else None,
+                })
+
+            state = {"version": SUMMARY_VERSION, "metrics": METRICS,
+                     "resolutions": list(self.resolutions), "processed": self.processed,
+                     "levels": levels}
+            path = os.path.join(self.path, SUMMARY_STATE_FILE)
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            # E.g. a read-only recording, the summaries are rebuilt next time
+            print(f"Could not save the summaries: {e}")
+            self.persist = False
+            return
+        self._saved_closed = [saved["closed"] for saved in levels]
+
+    def _level(self, resolution):
+        for level in self.levels:
+            if level.resolution == resolution:
+                return level
+        raise ValueError(f"No summary at {resolution} s, expected one of "
+                         f"{[level.resolution for level in self.levels]}")
+
+    def query(self, t0, t1, resolution=60):
+        """
+        Summaries of the buckets starting in [t0, t1), e.g. the average
+        heart rate per minute over a night.
+
+        Args:
+            t0, t1 (float): Time range in seconds.
+            resolution (float): One of the index's bucket lengths.
+
+        Returns:
+            dict: "t" (bucket start times) and, for every metric, a dict of
+            arrays "count", "mean", "min" and "max" (NaN without values).
+        """
+        level = self._level(resolution)
+        lo, hi = level.bounds(t0, t1)
+        result = {"t": level.start[lo:hi].copy()}
+        for i, name in enumerate(METRICS):
+            count = level.count[lo:hi, i]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = level.sum[lo:hi, i] / count
+            empty = count == 0
+            result[name] = {
+                "count": count.copy(),
+                "mean": mean,
+                "min": np.where(empty, np.nan, level.min[lo:hi, i]),
+                "max": np.where(empty, np.nan, level.max[lo:hi, i]),
+            }
+        return result
+
+    def _combine(self, level_index, t0, t1, acc):
+        """
+        Add the buckets covering [t0, t1) to `acc`, using the coarsest
+        buckets that fit entirely and finer ones at the edges.
+        """
+        if t0 >= t1:
+            return
+        level = self.levels[level_index]
+        r = level.resolution
+        if level_index == 0:
+            # Finest level: the buckets containing t0 and t1 are included whole
+            lo, hi = level.bounds(np.floor(t0 / r) * r, t1)
+        else:
+            inner0 = np.ceil(t0 / r) * r
+            inner1 = np.floor(t1 / r) * r
+            if inner0 >= inner1:
+                self._combine(level_index - 1, t0, t1, acc)
+                return
+            lo, hi = level.bounds(inner0, inner1)
+            self._combine(level_index - 1, t0, inner0, acc)
+            self._combine(level_index - 1, inner1, t1, acc)
+
+        if hi > lo:
+            acc["count"] += level.count[lo:hi].sum(axis=0)
+            acc["sum"] += level.sum[lo:hi].sum(axis=0)
+            np.minimum(acc["min"], level.min[lo:hi].min(axis=0), out=acc["min"])
+            np.maximum(acc["max"], level.max[lo:hi].max(axis=0), out=acc["max"])
+
+    def aggregate(self, t0, t1):
+        """
+        Count, mean, min and max of every metric over [t0, t1), at the
+        finest resolution at the edges of the range.
+
+        Args:
+            t0, t1 (float): Time range in seconds.
+
+        Returns:
+            dict: For every metric, a dict with "count", "mean", "min" and "max".
+        """
+        acc = {
+            "count": np.zeros(len(METRICS), dtype=np.int64),
+            "sum": np.zeros(len(METRICS)),
+            "min": np.full(len(METRICS), np.inf),
+            "max": np.full(len(METRICS), -np.inf),
+        }
+        self._combine(len(self.levels) - 1, t0, t1, acc)
+
+        result = {}
+        for i, name in enumerate(METRICS):
+            count = int(acc["count"][i])
+            result[name] = {
+                "count": count,
+                "mean": acc["sum"][i] / count if count else np.nan,
+                "min": acc["min"][i] if count else np.nan,
+                "max": acc["max"][i] if count else np.nan,
+            }
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the metrics of a recording.")
+    parser.add_argument("recording", help="Recording directory written by recorder.Recorder")
+    parser.add_argument("--resolution", type=float, default=60, choices=RESOLUTIONS,
+                        help="Bucket length in seconds")
+    parser.add_argument("--start", type=float, default=-np.inf, help="Start time (Unix time)")
+    parser.add_argument("--end", type=float, default=np.inf, help="End time (Unix time)")
+    args = parser.parse_args()
+
+    index = MetricsIndex(args.recording)
+    result = index.query(args.start, args.end, args.resolution)
+    print("time                 " + "  ".join(f"{name:>17}" for name in METRICS))
+    for i, t in enumerate(result["t"]):
+        cells = [f"{result[name]['mean'][i]:6.2f} ({result[name]['min'][i]:.1f}-{result[name]['max'][i]:.1f})"
+                 for name in METRICS]
+        print(strftime("%Y-%m-%d %H:%M:%S", localtime(t)) + "  " + "  ".join(f"{c:>17}" for c in cells))
+
+    total = index.aggregate(args.start, args.end)
+    print("total                " + "  ".join(f"{total[name]['mean']:17.2f}" for name in METRICS))
+
+
+if __name__ == "__main__":
+    main()
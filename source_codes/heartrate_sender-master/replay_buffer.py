@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import deque
+from time import monotonic
+
+import protocol
+
+
+class ReplayBuffer:
+    """
+    Keeps the frames of the last `max_seconds` so they can be sent again
+    after a reconnect. The receiver drops the ones it already has by their
+    sequence number.
+
+    Frames that age out of memory while the link is down are appended to a
+    spill file, if one is given, and replayed first on the next reconnect.
+    """
+
+    def __init__(self, max_seconds=30.0, spill_path=None):
+        """
+        Initialize the ReplayBuffer object.
+
+        Args:
+            max_seconds (float): Age of the oldest frame kept in memory.
+            spill_path (str): File for frames aged out while disconnected,
+                None to drop them.
+        """
+        self.max_seconds = max_seconds
+        self.spill_path = spill_path
+        self.spilled = 0  # Frames currently in the spill file
+        self._frames = deque()  # (time added, frame)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def append(self, frame, now=None):
+        """
+        Add a frame as it is queued for sending.
+
+        Args:
+            frame (bytes): Length-prefixed frame.
+            now (float): Current monotonic time, defaults to monotonic().
+        """
+        now = monotonic() if now is None else now
+        with self._lock:
+            self._frames.append((now, frame))
+
+    def prune(self, connected, now=None):
+        """
+        Remove the frames older than `max_seconds`.
+
+        Args:
+            connected (bool): Whether the link is up. While it is down the
+                removed frames were never delivered and go to the spill file.
+            now (float): Current monotonic time, defaults to monotonic().
+        """
+        now = monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            while self._frames and now - self._frames[0][0] > self.max_seconds:
+                expired.append(self._frames.popleft()[1])
+
+        if expired and not connected and self.spill_path:
+            with open(self.spill_path, "ab") as f:
+                f.write(b"".join(expired))
+            self.spilled += len(expired)
+
+    def frames_to_replay(self):
+        """
+        Return the spilled frames followed by the frames in memory, oldest
+        first. The spill file is emptied; the frames in memory are kept in
+        case the link drops again.
+
+        Returns:
+            list: Length-prefixed frames.
+        """
+        frames = []
+        if self.spill_path and os.path.exists(self.spill_path):
+            with open(self.spill_path, "rb") as f:
+                data = f.read()
+            os.remove(self.spill_path)
+            self.spilled = 0
+
+            offset = 0
+            while offset + protocol.LENGTH.size <= len(data):
+                (length,) = protocol.LENGTH.unpack_from(data, offset)
+                end = offset + protocol.LENGTH.size + length
+                if end > len(data):
+                    break  # Truncated by a crash while spilling
+                frames.append(data[offset:end])
+                offset = end
+
+        with self._lock:
+            frames.extend(frame for _, frame in self._frames)
+        return frames
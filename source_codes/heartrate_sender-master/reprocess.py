@@ -0,0 +1,150 @@
+"""
+Reprocess recorded PPG sessions over a sweep of filter cutoffs and window sizes.
+
+Every (recording, lowcut, highcut, window size) combination is processed in
+a separate worker process and the per-window metrics are streamed to a CSV
+file with one column per field.
+
+Example:
+    python reprocess.py recordings/*.npy --lowcut 0.5 0.7 --highcut 3.0 4.0 \
+        --window-size 100 125 --output results.csv
+"""
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import numpy as np
+
+import hrcalc
+import hrdata
+from recorder import Recording
+
+COLUMNS = ["file", "engine", "lowcut", "highcut", "window_size", "window",
+           "bpm", "ipm", "hrstd", "rmssd"]
+
+
+def load_recording(path):
+    """
+    Load a recorded IR signal.
+
+    Args:
+        path (str): A recording directory written by recorder.Recorder,
+            a .npy file, or a text file with one sample per line.
+
+    Returns:
+        np.array: The IR samples.
+    """
+    if os.path.isdir(path):
+        return Recording(path).samples["ir"]
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return np.loadtxt(path)
+
+
+def process_recording(path, engine, fs, lowcut, highcut, window_size, hop):
+    """
+    Compute the metrics of every window of one recording.
+
+    Returns:
+        tuple: (task parameters, dict of metric arrays, number of samples)
+    """
+    ir = load_recording(path)
+    hop = window_size if hop is None else hop
+
+    if engine == "hrcalc":
+        # hrcalc has no bandpass filter, main() only allows its own window
+        # size and sampling frequency
+        hr, ipm, hrstd, rmssd = hrcalc.calc_hr_and_ipm_batch(ir, window_size, hop)
+        metrics = {"bpm": hr, "ipm": ipm, "hrstd": hrstd, "rmssd": rmssd}
+        lowcut = highcut = ""
+    else:
+        metrics = hrdata.calculate_hr_metrics_batch(ir, fs, window_size=window_size, hop=hop,
+                                                    lowcut=lowcut, highcut=highcut)
+
+    params = (path, engine, lowcut, highcut, window_size)
+    return params, metrics, len(ir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess recorded PPG sessions.")
+    parser.add_argument("recordings", nargs="+",
+                        help="Recording directories or IR signals (.npy or text)")
+    parser.add_argument("--engine", choices=["hrdata", "hrcalc"], default="hrdata")
+    parser.add_argument("--fs", type=float, default=25, help="Sampling frequency in Hz")
+    parser.add_argument("--lowcut", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--highcut", type=float, nargs="+", default=[3.0])
+    parser.add_argument("--window-size", type=int, nargs="+", default=None,
+                        help="Samples per window, defaults to 100 (hrcalc: "
+                             f"{hrcalc.BUFFER_SIZE})")
+    parser.add_argument("--hop", type=int, default=None,
+                        help="Samples between windows, defaults to the window size")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="results.csv")
+    args = parser.parse_args()
+
+    if args.engine == "hrcalc":
+        # hrcalc searches BUFFER_SIZE samples at SAMPLE_FREQ for peaks, its
+        # thresholds and peak distances are tuned for them
+        if args.window_size is None:
+            args.window_size = [hrcalc.BUFFER_SIZE]
+        if args.window_size != [hrcalc.BUFFER_SIZE] or args.fs != hrcalc.SAMPLE_FREQ:
+            parser.error(f"the hrcalc engine needs --window-size {hrcalc.BUFFER_SIZE} "
+                         f"and --fs {hrcalc.SAMPLE_FREQ}")
+        # Cutoffs do not apply
+        cutoffs = [(None, None)]
+    else:
+        if args.window_size is None:
+            args.window_size = [100]
+        cutoffs = list(itertools.product(args.lowcut, args.highcut))
+    tasks = [(path, lowcut, highcut, window_size)
+             for path in args.recordings
+             for lowcut, highcut in cutoffs
+             for window_size in args.window_size]
+
+    print(f"Processing {len(tasks)} tasks on {args.workers} workers...")
+    start = perf_counter()
+    total_samples = 0
+    failed = 0
+
+    with open(args.output, "w", newline="") as f, \
+            ProcessPoolExecutor(max_workers=args.workers) as executor:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+
+        futures = {}  # Future -> task
+        for task in tasks:
+            path, lowcut, highcut, window_size = task
+            future = executor.submit(process_recording, path, args.engine, args.fs,
+                                     lowcut, highcut, window_size, args.hop)
+            futures[future] = task
+
+        # Write each task's results as soon as it completes
+        for future in as_completed(futures):
+            try:
+                params, metrics, n_samples = future.result()
+            except Exception as e:
+                # One bad recording must not abort the whole sweep
+                path, lowcut, highcut, window_size = futures[future]
+                print(f"Failed: {path} lowcut={lowcut} highcut={highcut} "
+                      f"window_size={window_size}: {e!r}", flush=True)
+                failed += 1
+                continue
+            total_samples += n_samples
+            columns = [metrics[key] for key in ("bpm", "ipm", "hrstd", "rmssd")]
+            for window, values in enumerate(zip(*columns)):
+                writer.writerow(list(params) + [window] + [f"{v:.4f}" for v in values])
+            print(f"Done: {params[0]} {params[2:]}", flush=True)
+
+    elapsed = perf_counter() - start
+    rate = total_samples / elapsed
+    print(f"Processed {total_samples} samples in {elapsed:.2f} s")
+    if failed:
+        print(f"{failed} of {len(tasks)} tasks failed, their rows are missing from {args.output}")
+    print(f"Throughput: {rate:.0f} samples/s, {rate / args.workers:.0f} samples/s per core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Simulated MAX30102 for running the sender pipeline without the sensor.
+
+SimulatedMAX30102 is the real MAX30102 driver talking to a simulated
+I2C bus and interrupt line, so the driver's own register reads, FIFO
+pointer arithmetic, overflow handling and burst draining are exercised.
+The simulated device fills its 32-sample FIFO at the rate configured in
+SPO2_CONFIG / FIFO_CONFIG (100 Hz with 4-sample averaging gives 25 Hz)
+and raises the almost-full and data-ready interrupts like the chip.
+
+Samples come from a synthetic PPG (heart rate, HRV, SpO2, noise, motion
+artifacts) or from a recording. The clock is either real time, so a
+slow reader overflows the FIFO as it would on the Pi, or virtual, so the
+pipeline runs as fast as it can while seeing the same sample timing.
+
+Example:
+    sensor = SimulatedMAX30102(SyntheticPPG(hr=65, hrv=0.05), realtime=False, burst=True)
+    red_ir = sensor.read_block()
+"""
+import os
+from collections import deque
+from time import monotonic, sleep
+
+import numpy as np
+
+import max30102
+from recorder import Recording
+
+# SPO2_CONFIG SPO2_SR[4:2] -> samples per second
+SAMPLE_RATES = [50, 100, 200, 400, 800, 1000, 1600, 3200]
+# FIFO_CONFIG SMP_AVE[7:5] -> samples averaged per FIFO sample
+AVERAGING = [1, 2, 4, 8, 16, 32, 32, 32]
+
+# INTR_STATUS_1 / INTR_ENABLE_1 bits
+A_FULL = 0x80
+PPG_RDY = 0x40
+
+PART_ID = 0x15
+
+
+class SyntheticPPG:
+    """
+    Synthetic red and IR PPG signal.
+
+    Beats are drawn with a mean rate `hr` and a beat-to-beat variability
+    `hrv`; each beat is a systolic peak followed by a dicrotic wave. The
+    red pulse amplitude follows from `spo2` through the usual ratio of
+    ratios, SpO2 = 110 - 25 R.
+    """
+
+    # Can be sampled at any rate, e.g. the ADC rate before averaging
+    continuous = True
+
+    def __init__(self, hr=72.0, hrv=0.05, spo2=97.0, noise=20.0, motion_rate=0.0,
+                 motion_amplitude=5.0, dc_ir=100000.0, dc_red=80000.0,
+                 perfusion=0.01, respiration=0.3, seed=0):
+        """
+        Initialize the SyntheticPPG object.
+
+        Args:
+            hr (float): Mean heart rate in beats per minute.
+            hrv (float): Standard deviation of the beat intervals, as a
+                fraction of the mean interval.
+            spo2 (float): Oxygen saturation in percent.
+            noise (float): Standard deviation of the white noise in ADC counts.
+            motion_rate (float): Motion artifacts per minute.
+            motion_amplitude (float): Size of a motion artifact relative to
+                the IR pulse amplitude.
+            dc_ir, dc_red (float): DC levels in ADC counts (at most 2 ** 18 - 1).
+            perfusion (float): IR pulse amplitude relative to its DC level.
+            respiration (float): Baseline wander of the breathing, relative
+                to the pulse amplitude.
+            seed (int): Seed of the random generator.
+        """
+        self.hr = hr
+        self.hrv = hrv
+        self.noise = noise
+        self.motion_rate = motion_rate
+        self.dc = np.array([[dc_red], [dc_ir]])
+        ratio = (110.0 - spo2) / 25.0
+        ac_ir = perfusion * dc_ir
+        self.ac = np.array([[ratio * perfusion * dc_red], [ac_ir]])
+        self.motion_amplitude = motion_amplitude * ac_ir
+        self.respiration = respiration
+        self.rng = np.random.default_rng(seed)
+
+        self.t = 0.0  # Time of the next sample
+        self._onsets = np.array([0.0])  # Beat onset times, the last one not yet used
+        self._artifacts = []  # (start, duration, amplitude)
+        self._next_artifact = self._draw_artifact_time(0.0)
+
+    def _draw_artifact_time(self, after):
+        if self.motion_rate <= 0:
+            return np.inf
+        return after + self.rng.exponential(60.0 / self.motion_rate)
+
+    def _extend_beats(self, until):
+        """Draw beats until the last onset is after `until`."""
+        while self._onsets[-1] <= until:
+            intervals = 60.0 / self.hr * (1 + self.hrv * self.rng.standard_normal(64))
+            intervals = np.clip(intervals, 0.25, 3.0)
+            self._onsets = np.concatenate((self._onsets, self._onsets[-1] + np.cumsum(intervals)))
+
+    @staticmethod
+    def pulse(phase):
+        """Pulse shape over one beat, phase in [0, 1)."""
+        return (np.exp(-((phase - 0.2) / 0.08) ** 2)
+                + 0.4 * np.exp(-((phase - 0.5) / 0.1) ** 2))
+
+    def read(self, n, fs):
+        """
+        Generate the next `n` samples.
+
+        Args:
+            n (int): Number of samples.
+            fs (float): Sampling frequency in Hz.
+
+        Returns:
+            np.array: (2, n) uint32 array of red and IR.
+        """
+        t = self.t + np.arange(n) / fs
+        self.t += n / fs
+        self._extend_beats(t[-1] if n else self.t)
+
+        beat = np.searchsorted(self._onsets, t, side="right") - 1
+        phase = (t - self._onsets[beat]) / (self._onsets[beat + 1] - self._onsets[beat])
+        # Pulses lower the received light
+        signal = self.dc - self.ac * self.pulse(phase)
+        # Respiration moves the baseline by a fraction of the pulse
+        signal += self.respiration * self.ac * np.sin(2 * np.pi * 0.25 * t)
+
+        while n and self._next_artifact <= t[-1]:
+            start = self._next_artifact
+            self._artifacts.append((start, self.rng.uniform(1.0, 3.0),
+                                    self.motion_amplitude * self.rng.uniform(-1, 1)))
+            self._next_artifact = self._draw_artifact_time(start)
+        for start, duration, amplitude in self._artifacts:
+            inside = (t >= start) & (t < start + duration)
+            signal[:, inside] += amplitude * np.sin(np.pi * (t[inside] - start) / duration)
+        self._artifacts = [a for a in self._artifacts if a[0] + a[1] > self.t]
+
+        signal += self.noise * self.rng.standard_normal(signal.shape)
+        return np.clip(np.round(signal), 0, 0x3FFFF).astype(np.uint32)
+
+
+class ReplaySource:
+    """Samples of a recording, looped or ending the simulation."""
+
+    # The recording's samples are already averaged
+    continuous = False
+
+    def __init__(self, path, loop=True):
+        """
+        Args:
+            path (str): A recording directory written by recorder.Recorder,
+                a .npy file or a text file of IR samples (red is then a copy).
+            loop (bool): Start over at the end, otherwise raise EOFError.
+        """
+        if os.path.isdir(path):
+            samples = Recording(path).samples
+            self.red_ir = np.vstack((samples["red"], samples["ir"]))
+        else:
+            ir = np.load(path) if path.endswith(".npy") else np.loadtxt(path)
+            ir = np.asarray(ir).astype(np.uint32)
+            self.red_ir = np.vstack((ir, ir))
+        self.loop = loop
+        self.position = 0
+
+    def read(self, n, fs):
+        """
+        Return the next `n` samples; the recording's own rate is kept, `fs`
+        is ignored.
+        """
+        total = self.red_ir.shape[1]
+        index = self.position + np.arange(n)
+        if not self.loop and n and index[-1] >= total:
+            raise EOFError("End of the replayed recording")
+        self.position += n
+        return self.red_ir[:, index % total]
+
+
+class SimulatedClock:
+    """
+    Real time, or a virtual clock that jumps ahead instead of sleeping.
+    Real time can run `speed` times faster than the wall clock.
+    """
+
+    def __init__(self, realtime=True, speed=1.0):
+        self.realtime = realtime
+        self.speed = speed
+        self._start = self._now = monotonic()
+
+    def now(self):
+        if not self.realtime:
+            return self._now
+        if self.speed == 1.0:
+            return monotonic()
+        return self._start + (monotonic() - self._start) * self.speed
+
+    def to_monotonic(self, t):
+        """monotonic() time at which the real-time clock reads `t`."""
+        return self._start + (t - self._start) / self.speed
+
+    def sleep_until(self, t):
+        if self.realtime:
+            delay = (t - self.now()) / self.speed
+            if delay > 0:
+                sleep(delay)
+        else:
+            self._now = max(self._now, t)
+
+
+class SimulatedEvent:
+    """Falling edge of the interrupt line, like gpiod.LineEvent."""
+
+    def __init__(self, timestamp):
+        self.type = max30102.FALLING_EDGE
+        self.sec = int(timestamp)
+        self.nsec = int(round((timestamp - self.sec) * 1e9))
+
+    @property
+    def timestamp(self):
+        return self.sec + self.nsec * 1e-9
+
+
+class SimulatedBus:
+    """SMBus stand-in holding the registers and FIFO of a simulated MAX30102."""
+
+    def __init__(self, source, clock, drift_ppm=0.0):
+        """
+        Args:
+            source: SyntheticPPG, ReplaySource or any object with read(n, fs).
+            clock (SimulatedClock): Time base of the simulation.
+            drift_ppm (float): Error of the device's oscillator, the true
+                rate is the configured one times (1 + drift_ppm / 1e6).
+        """
+        self.source = source
+        self.clock = clock
+        self.drift_ppm = drift_ppm
+        self.reads = 0  # I2C read transactions
+        self.writes = 0  # I2C write transactions
+        self.lost = 0  # Samples lost to FIFO overflow
+        self.edges = deque()  # Times of the interrupt falling edges not yet read
+        self._reset()
+
+    def _reset(self):
+        self.regs = bytearray(256)
+        self.regs[max30102.REG_PART_ID] = PART_ID
+        self.fifo = deque()
+        self.ovf = 0
+        self.wr = 0
+        self.rd = 0
+        self.status = 0
+        self.running = False
+        self.start = None  # Time of sample 0 since the last start
+        self.produced = 0
+
+    @property
+    def fs(self):
+        """Samples per second written into the FIFO."""
+        spo2 = self.regs[max30102.REG_SPO2_CONFIG]
+        fifo = self.regs[max30102.REG_FIFO_CONFIG]
+        return SAMPLE_RATES[(spo2 >> 2) & 0x07] / AVERAGING[fifo >> 5] * (1 + self.drift_ppm / 1e6)
+
+    @property
+    def threshold(self):
+        """FIFO level raising the almost-full interrupt."""
+        return max30102.FIFO_DEPTH - (self.regs[max30102.REG_FIFO_CONFIG] & 0x0F)
+
+    def sample_time(self, k):
+        """Time at which sample `k` is written into the FIFO."""
+        return self.start + (k + 1) / self.fs
+
+    def advance(self, now=None):
+        """Write the samples due by `now` into the FIFO."""
+        if not self.running:
+            return
+        now = self.clock.now() if now is None else now
+        due = int(np.floor((now - self.start) * self.fs + 1e-9))
+        n = due - self.produced
+        if n <= 0:
+            return
+
+        averaging = AVERAGING[self.regs[max30102.REG_FIFO_CONFIG] >> 5]
+        if averaging > 1 and getattr(self.source, "continuous", False):
+            # The chip averages consecutive ADC samples, which lowers the noise
+            raw = self.source.read(n * averaging, self.fs * averaging)
+            samples = np.round(raw.reshape(2, n, averaging).mean(axis=2)).astype(np.uint32)
+        else:
+            samples = self.source.read(n, self.fs)
+        enable = self.regs[max30102.REG_INTR_ENABLE_1]
+        rollover = self.regs[max30102.REG_FIFO_CONFIG] & 0x10
+        for k in range(n):
+            if len(self.fifo) == max30102.FIFO_DEPTH:
+                self.ovf = min(self.ovf + 1, 0x1F)
+                self.lost += 1
+                if not rollover:
+                    continue
+                self.fifo.popleft()
+                self.rd = (self.rd + 1) % max30102.FIFO_DEPTH
+            self.fifo.append((int(samples[0, k]), int(samples[1, k])))
+            self.wr = (self.wr + 1) % max30102.FIFO_DEPTH
+
+            raised = 0
+            if enable & PPG_RDY:
+                raised |= PPG_RDY
+            if enable & A_FULL and len(self.fifo) == self.threshold:
+                raised |= A_FULL
+            # The line only falls if no interrupt is waiting to be read
+            if raised and not self.status:
+                self.edges.append(self.sample_time(self.produced + k))
+            self.status |= raised
+        self.produced = due
+
+    def next_edge_time(self):
+        """Time of the next falling edge if no register is read meanwhile."""
+        if not self.running:
+            raise RuntimeError("The simulated MAX30102 is not running, call setup()")
+        enable = self.regs[max30102.REG_INTR_ENABLE_1]
+        if enable & PPG_RDY:
+            needed = 1
+        elif enable & A_FULL:
+            needed = max(self.threshold - len(self.fifo), 1)
+        else:
+            raise RuntimeError("No interrupt enabled on the simulated MAX30102")
+        return self.sample_time(self.produced + needed - 1)
+
+    def write_i2c_block_data(self, address, reg, values):
+        self.writes += 1
+        self.advance()
+        for i, value in enumerate(values):
+            self._write(reg + i, value)
+
+    def _write(self, reg, value):
+        if reg == max30102.REG_MODE_CONFIG:
+            if value & 0x40:
+                self._reset()
+                return
+            self.regs[reg] = value & 0x87
+            running = not value & 0x80 and value & 0x07 in (0x02, 0x03, 0x07)
+            if running and not self.running:
+                self.start = self.clock.now()
+                self.produced = 0
+            self.running = running
+        elif reg == max30102.REG_FIFO_WR_PTR:
+            self.wr = value & 0x1F
+            self.fifo.clear()
+        elif reg == max30102.REG_FIFO_RD_PTR:
+            self.rd = value & 0x1F
+            self.fifo.clear()
+        elif reg == max30102.REG_OVF_COUNTER:
+            self.ovf = value & 0x1F
+        else:
+            self.regs[reg] = value
+
+    def read_i2c_block_data(self, address, reg, length):
+        self.reads += 1
+        self.advance()
+        if reg == max30102.REG_FIFO_DATA:
+            return self._read_fifo(length)
+        return [self._read(reg + i) for i in range(length)]
+
+    def _read(self, reg):
+        if reg == max30102.REG_INTR_STATUS_1:
+            # Reading the status clears it and releases the interrupt line
+            status, self.status = self.status, 0
+            return status
+        if reg == max30102.REG_FIFO_WR_PTR:
+            return self.wr
+        if reg == max30102.REG_OVF_COUNTER:
+            return self.ovf
+        if reg == max30102.REG_FIFO_RD_PTR:
+            return self.rd
+        return self.regs[reg]
+
+    def _read_fifo(self, length):
+        data = []
+        for _ in range(length // max30102.BYTES_PER_SAMPLE):
+            if not self.fifo:
+                break  # The chip returns the last sample again, never reached by the driver
+            red, ir = self.fifo.popleft()
+            self.rd = (self.rd + 1) % max30102.FIFO_DEPTH
+            # Popping a sample resets the overflow counter
+            self.ovf = 0
+            data += [red >> 16 & 0x03, red >> 8 & 0xFF, red & 0xFF,
+                     ir >> 16 & 0x03, ir >> 8 & 0xFF, ir & 0xFF]
+        return data
+
+
+class SimulatedLine:
+    """gpiod line stand-in delivering the simulated interrupt's falling edges."""
+
+    def __init__(self, bus):
+        """
+        Args:
+            bus (SimulatedBus): The simulated device raising the interrupts.
+        """
+        self.bus = bus
+
+    def event_read(self):
+        """Block until the next falling edge (real or virtual time) and return it."""
+        self.bus.advance()
+        while not self.bus.edges:
+            self.bus.clock.sleep_until(self.bus.next_edge_time())
+            self.bus.advance()
+        return SimulatedEvent(self.bus.edges.popleft())
+
+    def event_wait(self, sec=0, nsec=0):
+        """Return True if a falling edge arrives within the timeout."""
+        self.bus.advance()
+        if not self.bus.edges:
+            deadline = self.bus.clock.now() + sec + nsec * 1e-9
+            self.bus.clock.sleep_until(min(self.bus.next_edge_time(), deadline))
+            self.bus.advance()
+        return bool(self.bus.edges)
+
+
+class SimulatedMAX30102(max30102.MAX30102):
+    """Drop-in MAX30102 driving a simulated device instead of I2C and GPIO."""
+
+    # The simulated device resets instantly
+    RESET_DELAY = 0
+
+    def __init__(self, source=None, realtime=True, burst=False,
+                 buffer_capacity=max30102.RING_CAPACITY, drift_ppm=0.0,
+                 profile=max30102.DEFAULT_PROFILE, speed=1.0):
+        """
+        Initialize the SimulatedMAX30102 object.
+
+        Args:
+            source: SyntheticPPG (default), ReplaySource or any object with read(n, fs).
+            realtime (bool): Follow the wall clock, or run as fast as the reader.
+            burst (bool): Drain the whole FIFO once per almost-full interrupt.
+            buffer_capacity (int): Samples kept in the driver's ring buffer.
+            drift_ppm (float): Error of the simulated device's oscillator.
+            profile (str): Acquisition profile, a key of max30102.PROFILES or a Profile.
+            speed (float): With `realtime`, run this many times faster than
+                the wall clock, e.g. to load a pipeline like several sensors.
+        """
+        self.clock = SimulatedClock(realtime, speed)
+        self.sim_bus = SimulatedBus(source if source is not None else SyntheticPPG(),
+                                    self.clock, drift_ppm)
+        super().__init__(burst=burst, bus=self.sim_bus, int_line=SimulatedLine(self.sim_bus),
+                         buffer_capacity=buffer_capacity, profile=profile)
+
+    def _now(self):
+        # Timestamps follow the simulation's clock, virtual or not
+        return self.clock.now()
+
+
+# Example usage
+if __name__ == "__main__":
+    import hrdata
+
+    sensor = SimulatedMAX30102(SyntheticPPG(hr=65, hrv=0.03), realtime=False, burst=True)
+    monitor = hrdata.StreamingHRMonitor(25, window_size=100, hop=12)
+    for _ in range(100):
+        result = monitor.push(sensor.read_block()[1])
+        if result is not None and result[0] is not None:
+            print(f"Heart Rate (bpm): {result[0]:.2f}, RMSSD: {result[3]:.3f}")
+    print(f"I2C reads: {sensor.sim_bus.reads}, samples: {sensor.sim_bus.produced}, "
+          f"lost: {sensor.sim_bus.lost}")
@@ -0,0 +1,225 @@
+"""
+Regression tests of the vectorized hrcalc functions against the loop
+implementations they replaced.
+
+The signals are 50-sample windows (hrcalc.BUFFER_SIZE) of synthetic PPG
+(simulator.SyntheticPPG, with noise and motion artifacts), of quantized
+random walks full of flat tops, and of recorded sessions. Recordings are
+taken from the directories main.py writes (logs/<date-time>/, or the
+directories listed in HRCALC_RECORDINGS, separated by os.pathsep); a
+synthetic session written and read back with recorder.py is always
+included.
+
+Run with:
+    python -m pytest test_hrcalc.py
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+import hrcalc
+from recorder import Recorder, Recording
+from simulator import SyntheticPPG
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# The loop implementations replaced by the vectorized ones
+
+def moving_average_loop(x, size):
+    x = np.array(x)
+    for i in range(x.shape[0] - size):
+        x[i] = np.sum(x[i:i+size]) / size
+    return x
+
+
+def find_peaks_above_min_height_loop(x, size, min_height, max_num):
+    i = 0
+    n_peaks = 0
+    ir_valley_locs = []
+    while i < size - 1:
+        if x[i] > min_height and x[i] > x[i-1]:
+            n_width = 1
+            while i + n_width < size - 1 and x[i] == x[i+n_width]:
+                n_width += 1
+            if x[i] > x[i+n_width] and n_peaks < max_num:
+                ir_valley_locs.append(i)
+                n_peaks += 1
+                i += n_width + 1
+            else:
+                i += n_width
+        else:
+            i += 1
+    return ir_valley_locs, n_peaks
+
+
+def remove_close_peaks_loop(n_peaks, ir_valley_locs, x, min_dist):
+    sorted_indices = sorted(ir_valley_locs, key=lambda i: x[i])
+    sorted_indices.reverse()
+    i = -1
+    while i < n_peaks:
+        old_n_peaks = n_peaks
+        n_peaks = i + 1
+        j = i + 1
+        while j < old_n_peaks:
+            n_dist = (sorted_indices[j] - sorted_indices[i]) if i != -1 else (sorted_indices[j] + 1)
+            if n_dist > min_dist or n_dist < -1 * min_dist:
+                sorted_indices[n_peaks] = sorted_indices[j]
+                n_peaks += 1
+            j += 1
+        i += 1
+    sorted_indices[:n_peaks] = sorted(sorted_indices[:n_peaks])
+    return sorted_indices, n_peaks
+
+
+def calc_hr_and_ipm_loop(ir_data):
+    ir_mean = int(np.mean(ir_data))
+    x = -1 * (np.array(ir_data) - ir_mean)
+    x = moving_average_loop(x, hrcalc.MA_SIZE)
+
+    n_th = int(np.mean(x))
+    n_th = 30 if n_th < 30 else n_th
+    n_th = 60 if n_th > 60 else n_th
+    locs, n_peaks = find_peaks_above_min_height_loop(x, hrcalc.BUFFER_SIZE, n_th, 15)
+    locs, n_peaks = remove_close_peaks_loop(n_peaks, locs, x, 4)
+    n_peaks = min([n_peaks, 15])
+
+    peak_intervals = []
+    hr = -999
+    hr_valid = False
+    if n_peaks >= 2:
+        for i in range(1, n_peaks):
+            peak_intervals.append((locs[i] - locs[i-1]) / hrcalc.SAMPLE_FREQ)
+        hr = int(60 / np.mean(peak_intervals))
+        hr_valid = True
+    ipm = (n_peaks / hrcalc.SECS_DATA) * 60
+    hrstd = np.std(peak_intervals) * 60 if len(peak_intervals) > 1 else -999
+    if len(peak_intervals) > 1:
+        rmssd = np.sqrt(np.mean(np.diff(peak_intervals) ** 2)) * 60
+    else:
+        rmssd = -999
+    return hr, hr_valid, ipm, hrstd, rmssd
+
+
+# Signals
+
+def windows_of(ir, hop=7):
+    """Overlapping BUFFER_SIZE windows of a signal, as rows."""
+    ir = np.asarray(ir)
+    starts = range(0, len(ir) - hrcalc.BUFFER_SIZE + 1, hop)
+    return np.array([ir[start:start + hrcalc.BUFFER_SIZE] for start in starts])
+
+
+def synthetic_ir(seconds=120, seed=0, **kwargs):
+    source = SyntheticPPG(seed=seed, **kwargs)
+    return source.read(int(seconds * hrcalc.SAMPLE_FREQ), hrcalc.SAMPLE_FREQ)[1].astype(np.int64)
+
+
+def flat_top_ir(n=3000, seed=0):
+    """Coarsely quantized random walk, most peaks are flat."""
+    rng = np.random.default_rng(seed)
+    return (np.cumsum(rng.integers(-1, 2, n)) * 40).astype(np.int64)
+
+
+def recording_dirs():
+    paths = os.environ.get("HRCALC_RECORDINGS")
+    if paths:
+        return [path for path in paths.split(os.pathsep) if path]
+    return sorted(glob.glob(os.path.join(HERE, "logs", "*")))
+
+
+@pytest.fixture(scope="module")
+def round_trip_recording(tmp_path_factory):
+    """A synthetic session written and read back by recorder.py."""
+    path = str(tmp_path_factory.mktemp("recording"))
+    red_ir = SyntheticPPG(hr=64, noise=30.0, motion_rate=2.0, seed=7).read(
+        3000, hrcalc.SAMPLE_FREQ)
+    with Recorder(path, chunk_size=256) as recorder:
+        recorder.append_samples(red_ir, np.arange(red_ir.shape[1]) / hrcalc.SAMPLE_FREQ)
+    return path
+
+
+SIGNALS = {
+    "synthetic-60": lambda: synthetic_ir(hr=60.0, seed=1),
+    "synthetic-110-noisy": lambda: synthetic_ir(hr=110.0, noise=60.0, seed=2),
+    "synthetic-motion": lambda: synthetic_ir(hr=75.0, motion_rate=6.0, seed=3),
+    "flat-tops": lambda: flat_top_ir(seed=4),
+    "float": lambda: synthetic_ir(hr=80.0, seed=5) + 0.25,
+}
+
+
+@pytest.fixture(params=sorted(SIGNALS) + ["recorded"] + recording_dirs())
+def ir_windows(request, round_trip_recording):
+    if request.param in SIGNALS:
+        return windows_of(SIGNALS[request.param]())
+    path = round_trip_recording if request.param == "recorded" else request.param
+    ir = np.asarray(Recording(path).samples["ir"], dtype=np.int64)
+    if len(ir) < hrcalc.BUFFER_SIZE:
+        pytest.skip(f"{path} holds less than one window")
+    return windows_of(ir)
+
+
+def smoothed(window):
+    x = -1 * (window - int(np.mean(window)))
+    return moving_average_loop(x, hrcalc.MA_SIZE)
+
+
+# Tests
+
+def test_moving_average(ir_windows):
+    for window in ir_windows:
+        x = -1 * (window - int(np.mean(window)))
+        expected = moving_average_loop(x, hrcalc.MA_SIZE)
+        result = hrcalc.moving_average(x, hrcalc.MA_SIZE)
+        assert result.dtype == expected.dtype
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_moving_average_stack(ir_windows):
+    x = -1 * (ir_windows - np.mean(ir_windows, axis=1).astype(int)[:, np.newaxis])
+    expected = np.array([moving_average_loop(row, hrcalc.MA_SIZE) for row in x])
+    np.testing.assert_array_equal(hrcalc.moving_average(x, hrcalc.MA_SIZE), expected)
+
+
+@pytest.mark.parametrize("min_height", [0, 30, 60])
+def test_find_peaks_above_min_height(ir_windows, min_height):
+    for window in ir_windows:
+        x = smoothed(window)
+        assert (hrcalc.find_peaks_above_min_height(x, hrcalc.BUFFER_SIZE, min_height, 15)
+                == find_peaks_above_min_height_loop(x, hrcalc.BUFFER_SIZE, min_height, 15))
+
+
+@pytest.mark.parametrize("min_dist", [1, 4, 10])
+def test_remove_close_peaks(ir_windows, min_dist):
+    for window in ir_windows:
+        x = smoothed(window)
+        locs, n_peaks = find_peaks_above_min_height_loop(x, hrcalc.BUFFER_SIZE, 0, 15)
+        expected_locs, expected_n = remove_close_peaks_loop(n_peaks, list(locs), x, min_dist)
+        result_locs, result_n = hrcalc.remove_close_peaks(n_peaks, list(locs), x, min_dist)
+        assert result_n == expected_n
+        assert list(result_locs[:result_n]) == list(expected_locs[:expected_n])
+
+
+def test_calc_hr_and_ipm(ir_windows):
+    for window in ir_windows:
+        np.testing.assert_array_equal(hrcalc.calc_hr_and_ipm(window),
+                                      calc_hr_and_ipm_loop(window))
+
+
+def test_calc_hr_and_ipm_batch(ir_windows):
+    expected = np.array([calc_hr_and_ipm_loop(window) for window in ir_windows], dtype=float)
+    hr, ipm, hrstd, rmssd = hrcalc.calc_hr_and_ipm_batch(ir_windows)
+    np.testing.assert_array_equal(np.column_stack((hr, ipm, hrstd, rmssd)),
+                                  expected[:, [0, 2, 3, 4]])
+
+
+@pytest.mark.parametrize("hop, chunk_size", [(7, 4096), (1, 33)])
+def test_calc_hr_and_ipm_batch_recording(hop, chunk_size):
+    ir = synthetic_ir(seconds=60, hr=95.0, noise=40.0, motion_rate=4.0, seed=6)
+    expected = np.array([calc_hr_and_ipm_loop(window) for window in windows_of(ir, hop)],
+                        dtype=float)
+    hr, ipm, hrstd, rmssd = hrcalc.calc_hr_and_ipm_batch(ir, hop=hop, chunk_size=chunk_size)
+    np.testing.assert_array_equal(np.column_stack((hr, ipm, hrstd, rmssd)),
+                                  expected[:, [0, 2, 3, 4]])
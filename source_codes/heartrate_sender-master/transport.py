@@ -0,0 +1,201 @@
+"""
+Socket transports used by BluetoothSender and BluetoothReceiver.
+
+Every transport hands out sockets with the same send / sendall / recv /
+accept / close semantics, so the sender and receiver work unchanged over
+Bluetooth RFCOMM, TCP or a Unix-domain socket.
+
+The same file is used by the sender and the receiver.
+"""
+import os
+import socket
+import subprocess
+
+
+class Transport:
+    """Base class of the transports."""
+
+    def enable(self):
+        """Bring up the underlying device, if any."""
+
+    def disable(self):
+        """Shut down the underlying device, if any."""
+
+    def connect(self):
+        """
+        Connect to the server.
+
+        Returns:
+            socket: The connected client socket.
+        """
+        raise NotImplementedError
+
+    def listen(self, backlog=1):
+        """
+        Create a server socket listening for clients.
+
+        Args:
+            backlog (int): Number of pending connections to queue.
+
+        Returns:
+            socket: The listening server socket.
+        """
+        raise NotImplementedError
+
+
+class RfcommTransport(Transport):
+    """Bluetooth RFCOMM through pybluez."""
+
+    def __init__(self, address="", port=1):
+        """
+        Args:
+            address (str): MAC address of the server, ignored when listening.
+            port (int): RFCOMM channel.
+        """
+        self.address = address
+        self.port = port
+
+    def __str__(self):
+        return f"rfcomm://{self.address}:{self.port}"
+
+    def enable(self):
+        """Enable the Bluetooth device."""
+        try:
+            subprocess.run(["sudo", "hciconfig", "hci0", "up"], check=True)
+            print("Bluetooth device hci0 is now up.")
+        except subprocess.CalledProcessError:
+            print("Failed to turn on Bluetooth device hci0.")
+
+    def disable(self):
+        """Disable the Bluetooth device."""
+        try:
+            subprocess.run(["sudo", "hciconfig", "hci0", "down"], check=True)
+            print("Bluetooth device hci0 is now down.")
+        except subprocess.CalledProcessError:
+            print("Failed to turn off Bluetooth device hci0.")
+
+    def connect(self):
+        import bluetooth  # Only needed for RFCOMM
+
+        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        try:
+            sock.connect((self.address, self.port))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def listen(self, backlog=1):
+        import bluetooth  # Only needed for RFCOMM
+
+        # Retrieve the MAC address of the Bluetooth adapter on the server
+        server_mac_address = bluetooth.read_local_bdaddr()[0]
+        print(f"Server MAC Address: {server_mac_address}")
+
+        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        try:
+            sock.bind(("", self.port))
+            sock.listen(backlog)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+
+class TcpTransport(Transport):
+    """TCP, e.g. for wired nodes or for running both ends on one machine."""
+
+    def __init__(self, address="", port=5000):
+        """
+        Args:
+            address (str): Host of the server, or the interface to listen on.
+            port (int): TCP port.
+        """
+        self.address = address
+        self.port = port
+
+    def __str__(self):
+        return f"tcp://{self.address}:{self.port}"
+
+    def connect(self):
+        sock = socket.create_connection((self.address or "localhost", self.port))
+        # Frames are small, send them right away
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def listen(self, backlog=1):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.address, self.port))
+            sock.listen(backlog)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixTransport(Transport):
+    """Unix-domain stream socket, for both ends on one machine."""
+
+    def __init__(self, address="/tmp/heartrate.sock", port=None):
+        """
+        Args:
+            address (str): Path of the socket file.
+            port: Unused.
+        """
+        self.address = address
+
+    def __str__(self):
+        return f"unix://{self.address}"
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def listen(self, backlog=1):
+        # Remove the socket file left by a previous server
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.address)
+            sock.listen(backlog)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+
+TRANSPORTS = {
+    "rfcomm": RfcommTransport,
+    "tcp": TcpTransport,
+    "unix": UnixTransport,
+}
+
+
+def make_transport(kind="rfcomm", address="", port=None):
+    """
+    Create a transport from its configuration.
+
+    Args:
+        kind (str): "rfcomm", "tcp" or "unix".
+        address (str): MAC address, host or socket path; empty to use the default.
+        port (int): RFCOMM channel or TCP port, None for the transport's default.
+
+    Returns:
+        Transport: The transport.
+    """
+    if kind not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {kind!r}, expected one of {sorted(TRANSPORTS)}")
+    kwargs = {}
+    if address:
+        kwargs["address"] = address
+    if port is not None:
+        kwargs["port"] = port
+    return TRANSPORTS[kind](**kwargs)